@@ -1,14 +1,52 @@
 from django.contrib import admin
+from django.contrib.auth.admin import UserAdmin
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.utils.html import format_html
-from .models import Movie, Rating
+from .deletion import soft_delete_movies, soft_delete_user
+from .models import Genre, Movie, Person, Rating
+from .pagination import ApproximateCountPaginator
+from .poster_proxy import proxy_url
+
+
+class CachedAllValuesFieldListFilter(admin.AllValuesFieldListFilter):
+    """
+    AllValuesFieldListFilter that caches its choices instead of running a
+    DISTINCT scan over the table on every changelist load.
+    """
+    cache_timeout = 300
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        super().__init__(field, request, params, model, model_admin, field_path)
+        key = f'admin-filter-choices:{model._meta.label_lower}:{field_path}'
+        self.lookup_choices = cache.get_or_set(key, lambda: list(self.lookup_choices), self.cache_timeout)
+
+
+class SoftDeleteAdminMixin:
+    """
+    Deletes that only hide objects, leaving the cascade to purge_deleted, so
+    neither the confirmation page nor the delete collects every related row
+    """
+
+    def get_deleted_objects(self, objs, request):
+        objs = list(objs)
+        return [str(obj) for obj in objs], {self.opts.verbose_name_plural: len(objs)}, set(), []
 
 
 @admin.register(Movie)
-class MovieAdmin(admin.ModelAdmin):
+class MovieAdmin(SoftDeleteAdminMixin, admin.ModelAdmin):
     list_display = ('title', 'release_year', 'genre', 'director', 'imdb_id', 'created_by', 'poster_preview')
-    list_filter = ('release_year', 'genre', 'created_at')
+    list_filter = (
+        ('release_year', CachedAllValuesFieldListFilter),
+        ('genre', CachedAllValuesFieldListFilter),
+        'created_at',
+    )
     search_fields = ('title', 'director', 'imdb_id', 'actors')
     readonly_fields = ('created_at', 'updated_at', 'poster_preview_large')
+    list_select_related = ('created_by',)
+    autocomplete_fields = ('created_by',)
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
     
     fieldsets = (
         ('Basic Information', {
@@ -32,7 +70,7 @@ class MovieAdmin(admin.ModelAdmin):
         if obj.poster_image:
             return format_html('<img src="{}" style="max-width: 50px; max-height: 75px;" />', obj.poster_image.url)
         elif obj.poster_url:
-            return format_html('<img src="{}" style="max-width: 50px; max-height: 75px;" />', obj.poster_url)
+            return format_html('<img src="{}" style="max-width: 50px; max-height: 75px;" />', proxy_url(obj.pk, 100))
         return "No poster"
     poster_preview.short_description = 'Poster'
     
@@ -41,15 +79,51 @@ class MovieAdmin(admin.ModelAdmin):
         if obj.poster_image:
             return format_html('<img src="{}" style="max-width: 300px; max-height: 450px;" />', obj.poster_image.url)
         elif obj.poster_url:
-            return format_html('<img src="{}" style="max-width: 300px; max-height: 450px;" />', obj.poster_url)
+            return format_html('<img src="{}" style="max-width: 300px; max-height: 450px;" />', proxy_url(obj.pk, 600))
         return "No poster available"
     poster_preview_large.short_description = 'Poster Preview'
 
+    def delete_model(self, request, obj):
+        soft_delete_movies(Movie.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        soft_delete_movies(queryset)
+
 
 @admin.register(Rating)
 class RatingAdmin(admin.ModelAdmin):
     list_display = ('movie', 'user', 'score', 'created_at')
-    list_filter = ('score', 'created_at')
+    list_filter = (('score', CachedAllValuesFieldListFilter), 'created_at')
     search_fields = ('movie__title', 'user__username', 'comment')
     readonly_fields = ('created_at', 'updated_at')
+    list_select_related = ('movie', 'user')
+    autocomplete_fields = ('movie', 'user')
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(Genre)
+class GenreAdmin(admin.ModelAdmin):
+    list_display = ('name',)
+    search_fields = ('name',)
+    readonly_fields = ('normalized_name',)
+
+
+@admin.register(Person)
+class PersonAdmin(admin.ModelAdmin):
+    list_display = ('name',)
+    search_fields = ('name',)
+    readonly_fields = ('normalized_name',)
+
+
+admin.site.unregister(User)
+
+
+@admin.register(User)
+class SoftDeleteUserAdmin(SoftDeleteAdminMixin, UserAdmin):
+    def delete_model(self, request, obj):
+        soft_delete_user(obj)
 
+    def delete_queryset(self, request, queryset):
+        for user in queryset:
+            soft_delete_user(user)
@@ -0,0 +1,248 @@
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class CopyStats:
+    """Bytes copied, wall time and time spent holding database locks by one part of a snapshot"""
+
+    def __init__(self):
+        self.bytes = 0
+        self.seconds = 0.0
+        self.lock_seconds = 0.0
+        self.max_lock_seconds = 0.0
+        self.steps = 0
+        self.restarts = 0
+        self.files = 0
+        self.files_copied = 0
+        self.journal_mode = None
+
+    def held(self, seconds):
+        self.lock_seconds += seconds
+        self.max_lock_seconds = max(self.max_lock_seconds, seconds)
+
+    @property
+    def throughput(self):
+        """MiB per second"""
+        return self.bytes / 2 ** 20 / self.seconds if self.seconds else 0.0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in (
+            'bytes', 'seconds', 'lock_seconds', 'max_lock_seconds', 'steps', 'restarts', 'files', 'files_copied',
+            'journal_mode',
+        )}
+
+
+class BackupError(Exception):
+    """A snapshot that cannot be taken, e.g. of an unsupported database"""
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def backup_sqlite(alias, target, pages, pause, max_restarts=10):
+    """
+    Copy a SQLite database with the online backup API, pages at a time
+    with a pause between steps, from a dedicated connection.
+
+    In WAL mode the copy reads one snapshot inside a read transaction, so
+    writers are never blocked and the copy never restarts. With a rollback
+    journal each step holds a shared lock that writers wait for, the pauses
+    let them commit, and every commit restarts the copy; after max_restarts
+    the rest is copied in a single step.
+    """
+    stats = CopyStats()
+    connection = connections[alias]
+    source = connection.get_new_connection(connection.get_connection_params())
+    source.isolation_level = None
+    stats.journal_mode = source.execute('PRAGMA journal_mode').fetchone()[0].lower()
+    partial = f'{target}.partial'
+    if os.path.exists(partial):
+        os.remove(partial)
+    destination = sqlite3.connect(partial)
+    started = step_started = time.perf_counter()
+    remaining_before = None
+
+    def progress(status, remaining, total):
+        nonlocal step_started, remaining_before
+        stats.held(time.perf_counter() - step_started)
+        stats.steps += 1
+        if remaining_before is not None and remaining > remaining_before:
+            stats.restarts += 1
+            if stats.restarts > max_restarts:
+                raise _TooManyRestarts
+        remaining_before = remaining
+        if remaining and pause:
+            # No lock is held between steps (outside WAL), so writers get in here
+            time.sleep(pause)
+        step_started = time.perf_counter()
+
+    try:
+        if stats.journal_mode == 'wal':
+            source.execute('BEGIN')
+            source.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+        try:
+            source.backup(destination, pages=pages, progress=progress)
+        except _TooManyRestarts:
+            step_started = time.perf_counter()
+            source.backup(destination, pages=-1)
+            stats.held(time.perf_counter() - step_started)
+            stats.steps += 1
+    finally:
+        destination.close()
+        source.close()
+    os.replace(partial, target)
+    stats.seconds = time.perf_counter() - started
+    stats.bytes = os.path.getsize(target)
+    return stats
+
+
+def _copy_out(cursor, sql, out):
+    if hasattr(cursor, 'copy_expert'):
+        cursor.copy_expert(sql, out)  # psycopg2
+    else:
+        with cursor.copy(sql) as copy:  # psycopg 3
+            for data in copy:
+                out.write(data)
+
+
+def backup_postgres(alias, target_dir):
+    """
+    Stream every table with COPY into gzipped files, all from one
+    REPEATABLE READ snapshot. The transaction only takes ACCESS SHARE
+    locks, which do not block reads or writes (only schema changes).
+    Returns the stats and the tables in the order they were copied.
+    """
+    stats = CopyStats()
+    connection = connections[alias]
+    os.makedirs(target_dir, exist_ok=True)
+    started = time.perf_counter()
+    with transaction.atomic(using=alias), connection.cursor() as cursor:
+        cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+        tables = sorted(connection.introspection.table_names(cursor))
+        for table in tables:
+            with gzip.open(os.path.join(target_dir, f'{table}.copy.gz'), 'wb') as out:
+                _copy_out(cursor, f'COPY {connection.ops.quote_name(table)} TO STDOUT', out)
+                stats.bytes += out.tell()
+            stats.steps += 1
+    stats.seconds = time.perf_counter() - started
+    stats.held(stats.seconds)
+    return stats, tables
+
+
+def _store_object(path, store_dir):
+    """Copy a file into the content-addressed store while hashing it; returns (digest, copied)"""
+    digest = hashlib.sha256()
+    partial = os.path.join(store_dir, f'.partial-{os.getpid()}')
+    with open(path, 'rb') as source, open(partial, 'wb') as out:
+        for chunk in iter(lambda: source.read(READ_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            out.write(chunk)
+    digest = digest.hexdigest()
+    final = _object_path(store_dir, digest)
+    if os.path.exists(final):
+        os.remove(partial)
+        return digest, False
+    os.makedirs(os.path.dirname(final), exist_ok=True)
+    os.replace(partial, final)
+    return digest, True
+
+
+def _object_path(store_dir, digest):
+    return os.path.join(store_dir, digest[:2], digest)
+
+
+def snapshot_media(source_dir, store_dir, previous=None):
+    """
+    Snapshot a media directory into a content-addressed store shared by
+    all snapshots: files whose size and mtime match the previous manifest
+    are not read again, and content already in the store is not copied
+    again. Files deleted while the walk runs are left out. Returns the
+    manifest, {relative path: [sha256, size, mtime_ns]}, and the stats.
+    """
+    stats = CopyStats()
+    previous = previous or {}
+    manifest = {}
+    os.makedirs(store_dir, exist_ok=True)
+    started = time.perf_counter()
+    for root, dirs, files in os.walk(source_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, source_dir).replace(os.sep, '/')
+            try:
+                stat = os.stat(path)
+                known = previous.get(relative)
+                if (known and known[1:] == [stat.st_size, stat.st_mtime_ns]
+                        and os.path.exists(_object_path(store_dir, known[0]))):
+                    stats.files += 1
+                    manifest[relative] = known
+                    continue
+                digest, copied = _store_object(path, store_dir)
+            except FileNotFoundError:
+                # Replaced or removed since it was listed
+                continue
+            stats.files += 1
+            if copied:
+                stats.files_copied += 1
+                stats.bytes += stat.st_size
+            manifest[relative] = [digest, stat.st_size, stat.st_mtime_ns]
+    stats.seconds = time.perf_counter() - started
+    return manifest, stats
+
+
+def _latest_media_manifest(output):
+    snapshots = sorted(
+        entry.path for entry in os.scandir(output)
+        if entry.is_dir() and os.path.exists(os.path.join(entry.path, 'posters.json'))
+    ) if os.path.isdir(output) else []
+    if not snapshots:
+        return None
+    with open(os.path.join(snapshots[-1], 'posters.json')) as manifest:
+        return json.load(manifest)
+
+
+def create_snapshot(output, alias='default', pages=None, pause=None, max_restarts=10, media=True):
+    """
+    Write a consistent snapshot of the database and the uploaded posters
+    to a new timestamped directory under output, with a manifest.json
+    describing it. Returns (snapshot directory, {part: CopyStats}).
+    """
+    pages = pages or getattr(settings, 'BACKUP_STEP_PAGES', 256)
+    pause = getattr(settings, 'BACKUP_STEP_PAUSE', 0.005) if pause is None else pause
+    connection = connections[alias]
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        raise BackupError(f'No online backup for {connection.vendor} databases')
+    directory = os.path.join(output, timezone.now().strftime('%Y%m%d-%H%M%S-%f'))
+    os.makedirs(directory)
+    manifest = {'created_at': timezone.now().isoformat(), 'database': alias, 'vendor': connection.vendor}
+    results = {}
+
+    if connection.vendor == 'sqlite':
+        results['database'] = backup_sqlite(alias, os.path.join(directory, 'db.sqlite3'), pages, pause, max_restarts)
+    else:
+        results['database'], manifest['tables'] = backup_postgres(alias, os.path.join(directory, 'tables'))
+
+    if media:
+        posters, results['posters'] = snapshot_media(
+            os.path.join(settings.MEDIA_ROOT, 'posters'), os.path.join(output, 'objects'),
+            _latest_media_manifest(output),
+        )
+        with open(os.path.join(directory, 'posters.json'), 'w') as out:
+            json.dump(posters, out, indent=0, sort_keys=True)
+
+    manifest['stats'] = {part: stats.as_dict() for part, stats in results.items()}
+    with open(os.path.join(directory, 'manifest.json'), 'w') as out:
+        json.dump(manifest, out, indent=2)
+    return directory, results
@@ -0,0 +1,194 @@
+import functools
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.functional import cached_property
+from rest_framework.response import Response
+
+from .routing import current_state
+
+
+VERSION_PREFIX = 'coalesce-version:'
+ENTRY_PREFIX = 'coalesce:'
+LOCK_PREFIX = 'coalesce-lock:'
+CACHE_HEADER = 'X-Cache'
+POLL_INTERVAL = 0.02
+
+# A rendered response: headers are its (name, value) pairs (Content-Type, Allow,
+# Vary...), delta is how long it took to compute, the cost early refresh weighs
+Entry = namedtuple('Entry', ['status', 'headers', 'content', 'delta', 'expires'])
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Run a function once per key at a time within this process: callers
+    arriving while it runs wait for that call and get its result (or its
+    exception) instead of running it again
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        """(result, shared), where shared is True for callers that waited on another's call"""
+        with self._lock:
+            call = self._calls.get(key)
+            owner = call is None
+            if owner:
+                call = self._calls[key] = _Call()
+        if not owner:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = function()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+flights = SingleFlight()
+
+
+def _versions(scopes):
+    keys = [VERSION_PREFIX + scope for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key, 0)
+    return [versions[key] for key in keys]
+
+
+def invalidate(*scopes):
+    """
+    Make cached responses of the given scopes stale, now and again when the
+    current transaction commits: a response computed in between would have
+    the new version but the old data
+    """
+    def bump():
+        # Versions are never reused, even when the cache evicts one
+        cache.set_many({VERSION_PREFIX + scope: time.time_ns() for scope in scopes}, None)
+    bump()
+    transaction.on_commit(bump)
+
+
+def entry_key(url, media_type, versions):
+    return ENTRY_PREFIX + hashlib.sha1(f'{url} {media_type} {versions}'.encode()).hexdigest()
+
+
+def _refresh_early(entry):
+    # XFetch (Vattani et al.): refresh with a probability that grows towards
+    # expiry and with the cost of recomputing, so one request usually
+    # refreshes a hot entry before it expires for everyone at once
+    beta = getattr(settings, 'COALESCE_EARLY_REFRESH_BETA', 1.0)
+    return time.time() - entry.delta * beta * math.log(1.0 - random.random()) >= entry.expires
+
+
+def _fill(key, compute):
+    """
+    Compute an entry and cache it; with COALESCE_SHARED_LOCK, another
+    worker already computing it is waited for instead, up to
+    COALESCE_WAIT_SECONDS
+    """
+    acquired = False
+    if getattr(settings, 'COALESCE_SHARED_LOCK', False):
+        wait = getattr(settings, 'COALESCE_WAIT_SECONDS', 5)
+        deadline = time.monotonic() + wait
+        lock = LOCK_PREFIX + key
+        acquired = cache.add(lock, 1, wait)
+        while not acquired:
+            entry = cache.get(key)
+            if entry is not None:
+                # Being refreshed elsewhere, or just filled
+                return entry
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(POLL_INTERVAL)
+            acquired = cache.add(lock, 1, wait)
+    try:
+        entry = compute()
+        if entry.status == 200 and len(entry.content) <= getattr(settings, 'COALESCE_MAX_BYTES', 1024 * 1024):
+            cache.set(key, entry, getattr(settings, 'COALESCE_CACHE_TTL', 5))
+        return entry
+    finally:
+        if acquired:
+            cache.delete(LOCK_PREFIX + key)
+
+
+class SharedResponse(HttpResponse):
+    """Rendered JSON shared between requests; data decodes it for callers used to DRF responses"""
+
+    @cached_property
+    def data(self):
+        return json.loads(self.content)
+
+
+def _response(entry, outcome):
+    response = SharedResponse(entry.content, status=entry.status, headers=dict(entry.headers))
+    response[CACHE_HEADER] = outcome
+    return response
+
+
+def coalesced(*scopes):
+    """
+    Coalesce a DRF GET handler whose JSON response depends only on the URL
+    and the negotiated media type:
+    identical requests arriving while one is computed wait for it and share
+    its rendered bytes, which are then cached for COALESCE_CACHE_TTL seconds
+    or until invalidate() is called for one of the scopes. Scopes are
+    formatted with the view kwargs, e.g. 'movie:{pk}'.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            state = current_state.get()
+            if request.accepted_renderer.format != 'json' or (state is not None and state.sticky):
+                # The browsable API, or a client reading its own recent writes
+                return method(view, request, *args, **kwargs)
+            versions = _versions([scope.format(**kwargs) for scope in scopes])
+            # Media type parameters (e.g. indent=4) change the rendered bytes
+            key = entry_key(request.build_absolute_uri(), request.accepted_media_type, versions)
+            entry = cache.get(key)
+            if entry is not None and not _refresh_early(entry):
+                return _response(entry, 'HIT')
+
+            def compute():
+                started = time.monotonic()
+                response = method(view, request, *args, **kwargs)
+                if isinstance(response, Response):
+                    response.accepted_renderer = request.accepted_renderer
+                    response.accepted_media_type = request.accepted_media_type
+                    response.renderer_context = view.get_renderer_context()
+                    response.render()
+                delta = time.monotonic() - started
+                return Entry(response.status_code, tuple(response.items()), response.content, delta,
+                             time.time() + getattr(settings, 'COALESCE_CACHE_TTL', 5))
+
+            entry, shared = flights.do(key, lambda: _fill(key, compute))
+            return _response(entry, 'SHARED' if shared else 'MISS')
+        return wrapper
+    return decorator
@@ -0,0 +1,118 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from . import coalesce, facets, suggest
+from .models import Movie, Rating, UserDeletion
+
+
+def _batch_size(batch_size):
+    return batch_size or getattr(settings, 'DELETION_BATCH_SIZE', 500)
+
+
+def soft_delete_movies(movies):
+    """
+    Hide movies at once: take them out of the facet counts with a few
+    grouped queries and mark them deleted with one UPDATE. Their ratings
+    and the rows themselves are removed later by purge(). Returns the
+    number of movies hidden.
+    """
+    with transaction.atomic():
+        movie_ids = list(movies.filter(deleted_at__isnull=True).values_list('pk', flat=True))
+        if not movie_ids:
+            return 0
+        hidden = Movie.objects.filter(pk__in=movie_ids)
+        for facet, values in facets.compute_counts(hidden).items():
+            for value, count in values.items():
+                facets.bump(facet, value, -count)
+        # updated_at moves too, so other workers' typeahead indexes drop them
+        now = timezone.now()
+        hidden.update(deleted_at=now, updated_at=now)
+    for movie_id in movie_ids:
+        suggest.on_movie_deleted(movie_id)
+    coalesce.invalidate('movies', *(f'movie:{movie_id}' for movie_id in movie_ids))
+    return len(movie_ids)
+
+
+def soft_delete_user(user):
+    """
+    Deactivate a user and hide their movies and ratings until purge()
+    removes them. Their ratings of other users' movies leave those movies'
+    aggregates and score bands now; the purge then doesn't subtract them
+    again (see api.signals.rating_deleted).
+    """
+    with transaction.atomic():
+        User.objects.filter(pk=user.pk).update(is_active=False)
+        user.is_active = False
+        _, created = UserDeletion.objects.get_or_create(user=user)
+        if not created:
+            return
+        soft_delete_movies(Movie.objects.filter(created_by=user))
+        rated = list(
+            Rating.all_objects.filter(user=user, movie__deleted_at__isnull=True)
+            .values('movie_id').annotate(n=Count('pk'), total=Sum('score')).order_by()
+        )
+        for row in rated:
+            facets.adjust_movie_ratings(row['movie_id'], -row['n'], -row['total'])
+    for row in rated:
+        suggest.on_rating_count_changed(row['movie_id'], -row['n'])
+    coalesce.invalidate('movies', *(f"movie:{row['movie_id']}" for row in rated))
+
+
+def _delete_ratings(ratings, batch_size, pause):
+    """
+    Delete ratings a batch per transaction, so other writers get the
+    database between batches; the rating signals adjust the movie and user
+    aggregates row by row as usual
+    """
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            batch = list(ratings.values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                return deleted
+            deleted += Rating.all_objects.filter(pk__in=batch).delete()[0]
+        if pause:
+            time.sleep(pause)
+
+
+def purge_movie(movie_id, batch_size=None, pause=0):
+    """Remove a soft-deleted movie: its ratings in batches, then the movie with its small relations"""
+    _delete_ratings(Rating.all_objects.filter(movie_id=movie_id).order_by(), _batch_size(batch_size), pause)
+    with transaction.atomic():
+        Movie.all_objects.filter(pk=movie_id, deleted_at__isnull=False).delete()
+
+
+def purge_user(user_id, batch_size=None, pause=0):
+    """
+    Remove a deleted user: their ratings and movies in batches, then the
+    account; returns the number of movies removed with it
+    """
+    batch_size = _batch_size(batch_size)
+    _delete_ratings(Rating.all_objects.filter(user_id=user_id).order_by(), batch_size, pause)
+    movie_ids = list(Movie.all_objects.filter(created_by=user_id).values_list('pk', flat=True))
+    for movie_id in movie_ids:
+        purge_movie(movie_id, batch_size, pause)
+    with transaction.atomic():
+        User.objects.filter(pk=user_id, deletion__isnull=False).delete()
+    return len(movie_ids)
+
+
+def purge(batch_size=None, pause=0):
+    """
+    Physically remove every soft-deleted movie and deleted user; returns
+    (movies, users) purged. Safe to interrupt and run again.
+    """
+    purged_movies = 0
+    users = list(UserDeletion.objects.order_by('requested_at').values_list('user_id', flat=True))
+    for user_id in users:
+        purged_movies += purge_user(user_id, batch_size, pause)
+    movies = Movie.all_objects.filter(deleted_at__isnull=False).order_by('deleted_at')
+    for movie_id in list(movies.values_list('pk', flat=True)):
+        purge_movie(movie_id, batch_size, pause)
+        purged_movies += 1
+    return purged_movies, len(users)
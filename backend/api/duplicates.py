@@ -0,0 +1,209 @@
+import hashlib
+import random
+import re
+import struct
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+
+from . import facets, stats, suggest
+from .models import Movie, MovieTitleBand, Rating, UserGenreStats, UserRatingStats
+from .text import normalize_text, split_names
+
+
+# MinHash LSH parameters: titles whose trigram Jaccard similarity is s share
+# at least one band bucket with probability 1 - (1 - s ** BAND_ROWS) ** NUM_BANDS,
+# about 0.91 at s = 0.6 and 0.24 at s = 0.3.
+NUM_BANDS = 10
+BAND_ROWS = 3
+
+_PRIME = (1 << 61) - 1
+_random = random.Random(1999)
+_PERMUTATIONS = [(_random.randrange(1, _PRIME), _random.randrange(_PRIME)) for _ in range(NUM_BANDS * BAND_ROWS)]
+
+# Optional fields a merge copies from duplicates when the survivor has none
+MERGED_FIELDS = ('imdb_id', 'imdb_rank', 'actors', 'aka', 'imdb_url', 'imdb_iv',
+                 'poster_url', 'poster_image', 'photo_width', 'photo_height')
+
+_punctuation = re.compile(r'[^\w\s]+')
+_trailing_article = re.compile(r'^(.+), (the|a|an)$')
+# "rocky 2", "rocky ii": titles that differ only here are sequels, not duplicates
+_sequel_number = re.compile(r' (\d+|[ivx]+)$')
+
+# How each kind of match ranks in results
+MATCH_ORDER = {'imdb_id': 0, 'title_year': 1, 'similar': 2}
+
+
+def _comparable(name):
+    # "Léon: The Professional" -> "leon the professional", "Matrix, The" -> "the matrix"
+    name = normalize_text(name)
+    inverted = _trailing_article.match(name)
+    if inverted:
+        name = f'{inverted[2]} {inverted[1]}'
+    return ' '.join(_punctuation.sub(' ', name).split())
+
+
+def title_variants(title, aka=None):
+    """Comparable forms of a movie's title and alternative titles"""
+    variants = [_comparable(title)] + [_comparable(name) for name in split_names(aka)]
+    return [variant for variant in dict.fromkeys(variants) if variant]
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big')
+
+
+def minhash(shingles):
+    hashes = [_hash64(shingle.encode()) for shingle in shingles]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def band_buckets(variants):
+    """(band, bucket) pairs for every variant, buckets as signed 64-bit ints"""
+    buckets = set()
+    for variant in variants:
+        signature = minhash(trigrams(variant))
+        for band in range(NUM_BANDS):
+            rows = signature[band * BAND_ROWS:(band + 1) * BAND_ROWS]
+            bucket = _hash64(struct.pack(f'>{BAND_ROWS}Q', *rows))
+            buckets.add((band, bucket - (1 << 64) if bucket >= 1 << 63 else bucket))
+    return buckets
+
+
+def _sequel(variant):
+    match = _sequel_number.search(variant)
+    return match[1] if match else None
+
+
+def similarity(variants, other_variants):
+    """
+    Best trigram Jaccard similarity between any pair of title variants;
+    pairs with different trailing sequel numbers do not count
+    """
+    best = 0.0
+    for variant in variants:
+        grams = trigrams(variant)
+        for other in other_variants:
+            if _sequel(variant) != _sequel(other):
+                continue
+            other_grams = trigrams(other)
+            best = max(best, len(grams & other_grams) / len(grams | other_grams))
+    return best
+
+
+def index_movie(movie):
+    """Replace the movie's band buckets after its title or alternative titles change"""
+    MovieTitleBand.objects.filter(movie=movie.pk).delete()
+    MovieTitleBand.objects.bulk_create(
+        MovieTitleBand(movie_id=movie.pk, band=band, bucket=bucket)
+        for band, bucket in band_buckets(title_variants(movie.title, movie.aka))
+    )
+
+
+def index_movies(batch_size=1000):
+    """Rebuild every movie's band buckets"""
+    MovieTitleBand.objects.all().delete()
+    batch = []
+    for movie_id, title, aka in Movie.all_objects.values_list('pk', 'title', 'aka').iterator(chunk_size=batch_size):
+        batch.extend(MovieTitleBand(movie_id=movie_id, band=band, bucket=bucket)
+                     for band, bucket in band_buckets(title_variants(title, aka)))
+        if len(batch) >= batch_size:
+            MovieTitleBand.objects.bulk_create(batch)
+            batch = []
+    MovieTitleBand.objects.bulk_create(batch)
+
+
+def _match(movie, kind, score):
+    return {'id': movie['id'], 'title': movie['title'], 'release_year': movie['release_year'],
+            'imdb_id': movie['imdb_id'], 'match': kind, 'similarity': round(score, 3)}
+
+
+def find_duplicates(title, release_year, imdb_id=None, aka=None, exclude=None, limit=10):
+    """
+    Existing movies that look like the given one: the same imdb_id, the same
+    normalized title and year, or a similar title (trigram similarity of at
+    least DUPLICATE_SIMILARITY) within DUPLICATE_YEAR_TOLERANCE years. Uses
+    the indexes on imdb_id and normalized_title/release_year and the band
+    buckets, so the cost does not grow with the size of the catalog.
+    """
+    fields = ('id', 'title', 'aka', 'release_year', 'imdb_id')
+    variants = title_variants(title, aka)
+    movies = Movie.objects.exclude(pk=exclude) if exclude is not None else Movie.objects.all()
+    matches = {}
+
+    exact = Q(normalized_title=normalize_text(title), release_year=release_year)
+    if imdb_id:
+        exact |= Q(imdb_id=imdb_id)
+    for movie in movies.filter(exact).values(*fields)[:limit]:
+        kind = 'imdb_id' if imdb_id and movie['imdb_id'] == imdb_id else 'title_year'
+        matches[movie['id']] = _match(movie, kind, 1.0)
+
+    buckets = band_buckets(variants)
+    if buckets and release_year is not None:
+        tolerance = getattr(settings, 'DUPLICATE_YEAR_TOLERANCE', 1)
+        threshold = getattr(settings, 'DUPLICATE_SIMILARITY', 0.6)
+        shared_bucket = Q()
+        for band, bucket in buckets:
+            shared_bucket |= Q(title_bands__band=band, title_bands__bucket=bucket)
+        candidates = (movies.filter(shared_bucket)
+                      .filter(release_year__range=(release_year - tolerance, release_year + tolerance))
+                      .exclude(pk__in=list(matches)).values(*fields).distinct()
+                      .order_by()[:getattr(settings, 'DUPLICATE_MAX_CANDIDATES', 200)])
+        for movie in candidates:
+            score = similarity(variants, title_variants(movie['title'], movie['aka']))
+            if score >= threshold:
+                matches[movie['id']] = _match(movie, 'similar', score)
+
+    ranked = sorted(matches.values(), key=lambda match: (MATCH_ORDER[match['match']], -match['similarity']))
+    return ranked[:limit]
+
+
+def merge_movies(survivor, duplicates):
+    """
+    Fold duplicate movies into survivor: move their ratings over in bulk
+    (keeping the most recent rating of a user who rated both), fill the
+    survivor's empty optional fields, then delete the duplicates. Returns
+    the number of ratings moved.
+    """
+    duplicate_ids = [movie.pk for movie in duplicates if movie.pk != survivor.pk]
+    if not duplicate_ids:
+        return 0
+    with transaction.atomic():
+        # Hidden ratings of deleted users too, or they would go with the duplicates
+        ratings = Rating.all_objects.filter(movie_id__in=[survivor.pk, *duplicate_ids])
+        overlapping = ratings.values('user_id').annotate(n=Count('pk')).filter(n__gt=1).values('user_id')
+        kept = set()
+        # Few rows, deleted one by one so signals adjust the aggregates
+        for rating in ratings.filter(user_id__in=overlapping).order_by('-updated_at', '-pk'):
+            if rating.user_id in kept:
+                rating.delete()
+            else:
+                kept.add(rating.user_id)
+
+        moving = Rating.all_objects.filter(movie_id__in=duplicate_ids)
+        user_ids = list(moving.values_list('user_id', flat=True))
+        moved = moving.update(movie=survivor)
+
+        changed = ['updated_at']
+        for movie in Movie.objects.filter(pk__in=duplicate_ids):
+            for field in MERGED_FIELDS:
+                if not getattr(survivor, field) and getattr(movie, field):
+                    setattr(survivor, field, getattr(movie, field))
+                    changed.append(field)
+            movie.delete()
+
+        # The bulk update bypassed the rating signals
+        survivor.rating_count, survivor.rating_sum = (
+            facets.recount_movie_ratings(survivor.pk) or (survivor.rating_count, survivor.rating_sum)
+        )
+        stats.populate(Rating, UserRatingStats, UserGenreStats, user_ids)
+        # Saved even without field changes so other workers' typeahead indexes catch up
+        survivor.save(update_fields=changed)
+        suggest.on_movie_saved(survivor, popularity=survivor.rating_count)
+    return moved
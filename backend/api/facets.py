@@ -0,0 +1,127 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Case, CharField, Count, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import FacetCount, Movie, MovieGenre, Rating
+
+
+GENRE = 'genre'
+DECADE = 'decade'
+SCORE = 'score'
+FACETS = (GENRE, DECADE, SCORE)
+
+UNRATED = 'unrated'
+# (band, lowest average in the band), highest first
+SCORE_BANDS = (('4-5', 4), ('3-4', 3), ('2-3', 2), ('1-2', 1))
+
+
+def decade(release_year):
+    return f'{release_year // 10 * 10}s'
+
+
+def score_band(rating_count, rating_sum):
+    if not rating_count:
+        return UNRATED
+    for band, low in SCORE_BANDS:
+        if rating_sum >= low * rating_count:
+            return band
+    return SCORE_BANDS[-1][0]
+
+
+def bump(facet, value, delta):
+    """Atomically add delta to a facet count, creating the row if needed"""
+    if not delta:
+        return
+    updated = FacetCount.objects.filter(facet=facet, value=value).update(count=F('count') + delta)
+    if not updated:
+        try:
+            with transaction.atomic():
+                FacetCount.objects.create(facet=facet, value=value, count=delta)
+        except IntegrityError:
+            # Created concurrently by another writer
+            FacetCount.objects.filter(facet=facet, value=value).update(count=F('count') + delta)
+
+
+def move(facet, old, new):
+    if old != new:
+        bump(facet, old, -1)
+        bump(facet, new, 1)
+
+
+def adjust_movie_ratings(movie_id, count_delta, sum_delta):
+    """
+    Apply a rating change to a movie's aggregates and its score band facet,
+    returning the new (rating_count, rating_sum), or None when nothing changed
+    """
+    if not count_delta and not sum_delta:
+        return None
+    updated = Movie.objects.filter(pk=movie_id).update(
+        rating_count=F('rating_count') + count_delta,
+        rating_sum=F('rating_sum') + sum_delta,
+        popularity_updated_at=timezone.now(),
+    )
+    if not updated:
+        return None
+    count, total = Movie.objects.filter(pk=movie_id).values_list('rating_count', 'rating_sum').get()
+    move(SCORE, score_band(count - count_delta, total - sum_delta), score_band(count, total))
+    return count, total
+
+
+def recount_movie_ratings(movie_id):
+    """Recompute one movie's aggregates when the size of a change is unknown"""
+    current = Movie.objects.filter(pk=movie_id).values_list('rating_count', 'rating_sum').first()
+    if current is None:
+        return None
+    # Deleted users' ratings left the aggregates when they were hidden (api.deletion)
+    ratings = Rating.all_objects.filter(movie_id=movie_id, user__deletion__isnull=True)
+    totals = ratings.aggregate(n=Count('pk'), total=Coalesce(Sum('score'), 0))
+    return adjust_movie_ratings(movie_id, totals['n'] - current[0], totals['total'] - current[1])
+
+
+def read_counts():
+    """Facet counts from the maintained table, as {facet: {value: count}}"""
+    result = {facet: {} for facet in FACETS}
+    for facet, value, count in FacetCount.objects.filter(count__gt=0).values_list('facet', 'value', 'count'):
+        result[facet][value] = count
+    return result
+
+
+def compute_counts(movies):
+    """Facet counts computed with GROUP BY over a (filtered) Movie queryset"""
+    band = Case(
+        When(rating_count=0, then=Value(UNRATED)),
+        *[When(rating_sum__gte=low * F('rating_count'), then=Value(name)) for name, low in SCORE_BANDS],
+        default=Value(SCORE_BANDS[-1][0]),
+        output_field=CharField(),
+    )
+    decade_start = F('release_year') / 10 * 10
+    result = {facet: {} for facet in FACETS}
+    genres = (MovieGenre.objects.filter(movie__in=movies.values('pk'))
+              .values('genre__name').annotate(n=Count('movie_id')).order_by())
+    for row in genres:
+        result[GENRE][row['genre__name']] = row['n']
+    decades = (movies.annotate(decade_start=decade_start).values('decade_start')
+               .annotate(n=Count('pk')).order_by())
+    for row in decades:
+        result[DECADE][f"{row['decade_start']}s"] = row['n']
+    bands = movies.annotate(band=band).values('band').annotate(n=Count('pk')).order_by()
+    for row in bands:
+        result[SCORE][row['band']] = row['n']
+    return result
+
+
+def rebuild():
+    """Recompute the per-movie rating aggregates and every facet count from scratch"""
+    with transaction.atomic():
+        ratings = Rating.all_objects.filter(movie=OuterRef('pk'), user__deletion__isnull=True).order_by().values('movie')
+        Movie.objects.update(
+            rating_count=Coalesce(Subquery(ratings.annotate(n=Count('pk')).values('n')), 0),
+            rating_sum=Coalesce(Subquery(ratings.annotate(total=Sum('score')).values('total')), 0),
+        )
+        FacetCount.objects.all().delete()
+        FacetCount.objects.bulk_create(
+            FacetCount(facet=facet, value=value, count=count)
+            for facet, values in compute_counts(Movie.objects.all()).items()
+            for value, count in values.items()
+        )
@@ -0,0 +1,133 @@
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def request_fingerprint(request):
+    """
+    Digest of what makes a request the same request: method, path, the
+    parsed fields and the content of each uploaded file. Uploads are hashed
+    chunk by chunk from the upload handlers' files, never the raw body.
+    """
+    digest = hashlib.sha256()
+    digest.update(f'{request.method} {request.get_full_path()}\n'.encode())
+    files = request.FILES
+    data = request.data
+    if hasattr(data, 'lists'):
+        fields = sorted((key, values) for key, values in data.lists() if key not in files)
+    else:
+        fields = data
+    digest.update(json.dumps(fields, sort_keys=True, cls=DjangoJSONEncoder).encode())
+    for name in sorted(files):
+        for upload in files.getlist(name):
+            digest.update(f'\n{name} {upload.name} {upload.size}\n'.encode())
+            for chunk in upload.chunks():
+                digest.update(chunk)
+            upload.seek(0)
+    return digest.hexdigest()
+
+
+def _ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+
+def claim(user, key, fingerprint):
+    """
+    Take the key for a new write, returning (record, None), or return
+    (None, response) to send instead: the stored response for a retry, or
+    an error. The unique (user, key) row acts as the lock, so of concurrent
+    duplicates only the first write runs; the others get 409 at once rather
+    than holding a worker while they wait for it.
+    """
+    abandoned_after = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 60))
+    while True:
+        record = IdempotencyKey.objects.filter(user=user, key=key).first()
+        if record is None:
+            try:
+                with transaction.atomic():
+                    return IdempotencyKey.objects.create(user=user, key=key, fingerprint=fingerprint), None
+            except IntegrityError:
+                continue  # claimed concurrently
+        age = timezone.now() - record.created_at
+        if age > _ttl() or (record.status_code is None and age > abandoned_after):
+            # Expired, or its write died without releasing it
+            IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).delete()
+            continue
+        if record.fingerprint != fingerprint:
+            return None, Response(
+                {'error': f'{HEADER} was already used for a different request'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        if record.status_code is not None:
+            return None, Response(record.response_body, status=record.status_code, headers={REPLAYED_HEADER: 'true'})
+        return None, Response(
+            {'error': f'A request with this {HEADER} is still in progress'},
+            status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'},
+        )
+
+
+def complete(record, response):
+    # Round-trip through JSON so the stored body is exactly what a replay renders
+    body = json.loads(json.dumps(response.data, cls=DjangoJSONEncoder))
+    IdempotencyKey.objects.filter(pk=record.pk).update(status_code=response.status_code, response_body=body)
+
+
+def release(record):
+    IdempotencyKey.objects.filter(pk=record.pk).delete()
+
+
+def idempotent(method):
+    """
+    Make a DRF view method honour the Idempotency-Key header: the first
+    request with a key runs the method and stores its response, retries
+    with the same key and request get that response back without running
+    it again. Server errors release the key so the client can retry.
+    """
+    @functools.wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            # Keys are scoped per user; anonymous requests run as usual
+            return method(view, request, *args, **kwargs)
+        if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            return Response({'error': f'{HEADER} is too long'}, status=status.HTTP_400_BAD_REQUEST)
+
+        record, response = claim(request.user, key, request_fingerprint(request))
+        if response is not None:
+            return response
+        try:
+            response = method(view, request, *args, **kwargs)
+        except BaseException:
+            release(record)
+            raise
+        if response.status_code >= 500:
+            release(record)
+        else:
+            complete(record, response)
+        return response
+    return wrapper
+
+
+def purge_expired(batch_size=5000):
+    """Delete keys older than IDEMPOTENCY_KEY_TTL in batches; returns the number deleted"""
+    cutoff = timezone.now() - _ttl()
+    deleted = 0
+    while True:
+        batch = list(IdempotencyKey.objects.filter(created_at__lt=cutoff).values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(pk__in=batch).delete()[0]
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+RESYNC = object()
+
+
+class Subscription:
+    """
+    One event stream's pending events. At most max_pending are buffered;
+    a client that falls further behind is told to resync instead, so a slow
+    reader never holds more than a few events in memory.
+    """
+    __slots__ = ('movie_ids', 'loop', 'max_pending', 'pending', 'ready')
+
+    def __init__(self, movie_ids, loop, max_pending):
+        self.movie_ids = movie_ids
+        self.loop = loop
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.ready = asyncio.Event()
+
+    def deliver(self, event):
+        # Always runs on the subscriber's event loop
+        if len(self.pending) >= self.max_pending:
+            self.pending.clear()
+            self.pending.append(RESYNC)
+        self.pending.append(event)
+        self.ready.set()
+
+    async def next_event(self, timeout):
+        """The next encoded event, or None if nothing arrived within timeout"""
+        if not self.pending:
+            self.ready.clear()
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        event = self.pending.popleft()
+        return encode_event('resync', {}) if event is RESYNC else event
+
+
+class RatingBroker:
+    """
+    In-process fan-out of rating deltas to event stream subscribers, keyed
+    by movie. publish() may be called from any thread; each event is
+    encoded once and handed to subscriber loops with call_soon_threadsafe.
+    """
+
+    def __init__(self, max_subscribers=10000, max_pending=32):
+        self.max_subscribers = max_subscribers
+        self.max_pending = max_pending
+        self._by_movie = {}  # movie id -> set of subscriptions
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def subscribe(self, movie_ids):
+        """A Subscription for movie_ids on the running loop, or None when full"""
+        subscription = Subscription(frozenset(movie_ids), asyncio.get_running_loop(), self.max_pending)
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return None
+            self._count += 1
+            for movie_id in subscription.movie_ids:
+                self._by_movie.setdefault(movie_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._count -= 1
+            for movie_id in subscription.movie_ids:
+                subscribers = self._by_movie.get(movie_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._by_movie[movie_id]
+
+    def full(self):
+        return self._count >= self.max_subscribers
+
+    def has_subscribers(self, movie_id):
+        return movie_id in self._by_movie
+
+    def publish(self, movie_id, name, data):
+        with self._lock:
+            subscribers = list(self._by_movie.get(movie_id, ()))
+        if not subscribers:
+            return
+        event = encode_event(name, data)
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # Loop already closed; the stream's cleanup will unsubscribe it
+                pass
+
+
+def encode_event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data, cls=DjangoJSONEncoder, separators=(",", ":"))}\n\n'.encode()
+
+
+broker = RatingBroker(
+    max_subscribers=getattr(settings, 'LIVE_MAX_SUBSCRIBERS', 10000),
+    max_pending=getattr(settings, 'LIVE_MAX_PENDING_EVENTS', 32),
+)
+
+
+async def event_stream(movie_ids, heartbeat):
+    """
+    Server-sent events for the given movies until the client disconnects,
+    with a comment line every heartbeat seconds so dead peers are noticed.
+    """
+    subscription = broker.subscribe(movie_ids)
+    if subscription is None:
+        # Filled up since the view checked; the client retries later
+        return
+    try:
+        yield b'retry: 3000\n\n'
+        while True:
+            event = await subscription.next_event(heartbeat)
+            yield b': keepalive\n\n' if event is None else event
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def rating_payload(rating):
+    """Compact form of a rating for live events, shaped like RatingSerializer output"""
+    return {
+        'id': rating.pk,
+        'user': {'id': rating.user_id, 'username': rating.user.username},
+        'username': rating.user.username,
+        'score': int(rating.score),
+        'comment': rating.comment,
+        'created_at': rating.created_at,
+        'updated_at': rating.updated_at,
+    }
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.backup import BackupError, create_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Take a consistent snapshot of the database and uploaded posters while the site stays up'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help='Backup directory (default: BACKUP_ROOT)')
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--pages', type=int, default=None,
+                            help='SQLite pages copied per step (default: BACKUP_STEP_PAGES)')
+        parser.add_argument('--pause', type=float, default=None,
+                            help='Seconds between SQLite steps, when writers get the database (default: BACKUP_STEP_PAUSE)')
+        parser.add_argument('--max-restarts', type=int, default=10,
+                            help='Restarts caused by concurrent writes before SQLite copies the rest in one step')
+        parser.add_argument('--skip-media', action='store_true', help='Only back up the database')
+
+    def handle(self, *args, **options):
+        try:
+            directory, results = create_snapshot(
+                str(options['output'] or getattr(settings, 'BACKUP_ROOT', settings.BASE_DIR / 'backups')),
+                alias=options['database'], pages=options['pages'], pause=options['pause'],
+                max_restarts=options['max_restarts'], media=not options['skip_media'],
+            )
+        except BackupError as e:
+            raise CommandError(str(e))
+        for part, stats in results.items():
+            line = f'{part}: {stats.bytes / 2 ** 20:.1f} MiB in {stats.seconds:.2f} s ({stats.throughput:.1f} MiB/s)'
+            if part == 'database':
+                line += (f', locks held {stats.lock_seconds * 1000:.0f} ms in total, '
+                         f'{stats.max_lock_seconds * 1000:.1f} ms at most, over {stats.steps} steps')
+                if stats.journal_mode == 'wal':
+                    line += ' (read snapshot, writers not blocked)'
+                if stats.restarts:
+                    line += f', {stats.restarts} restarts'
+            else:
+                line += f', {stats.files_copied} of {stats.files} files copied'
+            self.stdout.write(line)
+        self.stdout.write(self.style.SUCCESS(f'Snapshot written to {directory}'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from api import duplicates
+from api.models import Movie
+
+
+class Command(BaseCommand):
+    help = 'List likely duplicate movies already in the catalog, for review before merge_movies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--exact', action='store_true', help='Only report imdb_id and title/year matches')
+
+    def handle(self, *args, **options):
+        reported = set()
+        movies = Movie.objects.order_by('pk').values_list('pk', 'title', 'aka', 'release_year', 'imdb_id')
+        for pk, title, aka, release_year, imdb_id in movies.iterator(chunk_size=2000):
+            if pk in reported:
+                continue
+            matches = [
+                match for match in duplicates.find_duplicates(title, release_year, imdb_id=imdb_id, aka=aka, exclude=pk)
+                if match['id'] not in reported and (match['match'] != 'similar' or not options['exact'])
+            ]
+            if not matches:
+                continue
+            reported.update(match['id'] for match in matches)
+            reported.add(pk)
+            self.stdout.write(f'{pk}: {title} ({release_year})')
+            for match in matches:
+                self.stdout.write(
+                    f"  {match['id']}: {match['title']} ({match['release_year']}) "
+                    f"[{match['match']}, {match['similarity']}]"
+                )
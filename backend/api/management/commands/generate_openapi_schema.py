@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.schema import code_fingerprint, write_schema_file
+
+
+class Command(BaseCommand):
+    help = 'Generate the OpenAPI schema once and store it as a build artifact'
+
+    def handle(self, *args, **options):
+        path = write_schema_file()
+        self.stdout.write(self.style.SUCCESS(f'Wrote {path} (fingerprint {code_fingerprint()})'))
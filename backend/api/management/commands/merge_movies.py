@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import duplicates
+from api.models import Movie
+
+
+class Command(BaseCommand):
+    help = 'Merge duplicate movies into a surviving movie, moving their ratings over in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('survivor', type=int, help='Id of the movie to keep')
+        parser.add_argument('duplicates', type=int, nargs='+', help='Ids of the movies to merge into it')
+
+    def handle(self, *args, **options):
+        try:
+            survivor = Movie.objects.get(pk=options['survivor'])
+        except Movie.DoesNotExist:
+            raise CommandError(f"Movie {options['survivor']} does not exist")
+        found = list(Movie.objects.filter(pk__in=options['duplicates']).exclude(pk=survivor.pk))
+        missing = set(options['duplicates']) - {movie.pk for movie in found} - {survivor.pk}
+        if missing:
+            raise CommandError(f"Movies do not exist: {', '.join(map(str, sorted(missing)))}")
+        moved = duplicates.merge_movies(survivor, found)
+        self.stdout.write(self.style.SUCCESS(
+            f'Merged {len(found)} movies into "{survivor.title}" ({survivor.pk}), moving {moved} ratings'
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api.deletion import purge
+
+
+class Command(BaseCommand):
+    help = 'Remove soft-deleted movies and deleted users with their ratings, a batch per transaction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Ratings deleted per transaction (default: DELETION_BATCH_SIZE)')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Seconds to sleep between batches, leaving the database to other writers')
+
+    def handle(self, *args, **options):
+        movies, users = purge(options['batch_size'], options['pause'])
+        self.stdout.write(self.style.SUCCESS(f'Purged {movies} movies and {users} users'))
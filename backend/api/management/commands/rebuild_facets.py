@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api import facets
+
+
+class Command(BaseCommand):
+    help = 'Recompute movie rating aggregates and browse facet counts from scratch'
+
+    def handle(self, *args, **options):
+        facets.rebuild()
+        counts = facets.read_counts()
+        summary = ', '.join(f'{facet}: {len(values)} values' for facet, values in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt facet counts ({summary})'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from api import stats
+from api.models import UserRatingStats
+
+
+class Command(BaseCommand):
+    help = 'Recompute per-user rating statistics and favourite genres from scratch'
+
+    def handle(self, *args, **options):
+        stats.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating stats for {UserRatingStats.objects.count()} users'))
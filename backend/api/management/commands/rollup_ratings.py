@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.rollups import rollup_ratings, rollup_signups
+
+
+class Command(BaseCommand):
+    help = 'Fold ratings and signups added since the last run into the hourly and daily analytics rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Rows folded per transaction (default: ROLLUP_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        ratings = rollup_ratings(options['batch_size'])
+        users = rollup_signups(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rolled up {ratings} ratings and {users} signups in {time.perf_counter() - started:.2f} s'
+        ))
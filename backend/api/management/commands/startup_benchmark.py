@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.startup import measure_startup
+
+
+class Command(BaseCommand):
+    help = 'Measure worker import time per server role (python -X importtime) against its budget'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--roles', nargs='+', default=list(settings.SERVER_ROLE_CHOICES),
+                            help='Server roles to measure (default: all of them)')
+        parser.add_argument('--top', type=int, default=10, help='Number of slowest imports to list')
+
+    def handle(self, *args, **options):
+        budgets = getattr(settings, 'STARTUP_IMPORT_BUDGET_MS', {})
+        over_budget = []
+        for role in options['roles']:
+            profile = measure_startup(role)
+            budget = budgets.get(role)
+            self.stdout.write(f'{role}: {profile.total_ms:.1f} ms' + (f' (budget {budget} ms)' if budget else ''))
+            slowest = sorted(profile.modules.items(), key=lambda item: item[1], reverse=True)
+            for name, ms in slowest[:options['top']]:
+                self.stdout.write(f'    {ms:8.1f} ms  {name}')
+            if budget and profile.total_ms > budget:
+                over_budget.append(role)
+        if over_budget:
+            raise CommandError(f'Import time over budget for: {", ".join(over_budget)}')
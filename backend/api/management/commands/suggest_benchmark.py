@@ -0,0 +1,83 @@
+import random
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from api.suggest import PrefixIndex
+
+
+WORDS = (
+    'the', 'a', 'of', 'night', 'day', 'love', 'war', 'dark', 'star', 'last', 'city', 'man', 'woman',
+    'king', 'queen', 'return', 'story', 'ghost', 'blood', 'house', 'river', 'summer', 'winter', 'dream',
+    'secret', 'lost', 'road', 'fire', 'ice', 'shadow', 'matrix', 'empire', 'island', 'storm', 'heart',
+    'game', 'time', 'world', 'escape', 'legend', 'rise', 'fall', 'golden', 'silent', 'wild', 'red',
+)
+
+
+class Command(BaseCommand):
+    help = 'Report memory footprint, query latency and update cost of the title typeahead index on synthetic titles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--titles', type=int, default=1000000, help='Number of synthetic titles')
+        parser.add_argument('--queries', type=int, default=20000, help='Number of timed queries')
+        parser.add_argument('--changes', type=int, default=1000, help='Number of renamed titles per timed batch update')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        rows = [
+            (i, ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 5))) + f' {i}',
+             None, 1950 + i % 75, rng.randint(0, 5000))
+            for i in range(options['titles'])
+        ]
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        index = PrefixIndex()
+        index.load(rows)
+        build_seconds = time.perf_counter() - started
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        prefixes = []
+        for _ in range(options['queries']):
+            title = rows[rng.randrange(len(rows))][1]
+            prefixes.append(title[:rng.randint(1, 8)])
+        for prefix in prefixes[:1000]:
+            index.search(prefix)  # warm the short prefix cache
+        timings = []
+        for prefix in prefixes:
+            started = time.perf_counter()
+            index.search(prefix)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+
+        def percentile(p):
+            return timings[min(len(timings) - 1, int(len(timings) * p))] * 1e6
+
+        # What a refresh applies: renames move keys, rating changes only move ranks
+        renamed = [(movie_id, f'{title} returns', aka, year, popularity)
+                   for movie_id, title, aka, year, popularity in rng.sample(rows, options['changes'])]
+        rerated = [(movie_id, title, aka, year, popularity + 1)
+                   for movie_id, title, aka, year, popularity in rng.sample(rows, options['changes'])]
+        started = time.perf_counter()
+        index.update(renamed)
+        rename_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        index.update(rerated)
+        rerate_seconds = time.perf_counter() - started
+        movie_id, title, aka, year, popularity = rows[0]
+        started = time.perf_counter()
+        index.upsert(movie_id, f'{title} again', aka, year, popularity)
+        upsert_seconds = time.perf_counter() - started
+
+        self.stdout.write(f'titles:        {len(index)}')
+        self.stdout.write(f'index keys:    {len(index._keys)}')
+        self.stdout.write(f'build time:    {build_seconds:.2f} s')
+        self.stdout.write(f'memory:        {memory / 2 ** 20:.1f} MiB')
+        self.stdout.write(f'query p50:     {percentile(0.5):.1f} us')
+        self.stdout.write(f'query p99:     {percentile(0.99):.1f} us')
+        self.stdout.write(f'{len(renamed)} renames:  {rename_seconds * 1e3:.0f} ms')
+        self.stdout.write(f'{len(rerated)} rerates:  {rerate_seconds * 1e3:.0f} ms')
+        self.stdout.write(f'single rename: {upsert_seconds * 1e3:.1f} ms')
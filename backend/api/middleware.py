@@ -0,0 +1,277 @@
+import gzip
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import patch_vary_headers
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .routing import RoutingState, current_state, replicas
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+
+class CompressedPayloadCache:
+    """
+    Small byte-bounded LRU of compressed bodies keyed by content digest,
+    so large payloads that are served repeatedly are only compressed once.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+payload_cache = CompressedPayloadCache(getattr(settings, 'COMPRESSION_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+
+
+def accepted_codings(accept_encoding):
+    """{coding: q-value} from an Accept-Encoding header; unreadable q-values count as 0"""
+    codings = {}
+    for item in accept_encoding.split(','):
+        coding, *params = item.split(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding] = q
+    return codings
+
+
+def choose_encoding(accept_encoding):
+    """
+    Pick the encoding we support with the highest q-value in an
+    Accept-Encoding header, br on ties; codings with q=0 are refused
+    """
+    codings = accepted_codings(accept_encoding)
+    default = codings.get('*', 0.0)
+    best, best_q = None, 0.0
+    for encoding in ('br', 'gzip') if brotli is not None else ('gzip',):
+        q = codings.get(encoding, default)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(content, encoding):
+    if encoding == 'br':
+        return brotli.compress(content, quality=5)
+    return gzip.compress(content, compresslevel=6, mtime=0)
+
+
+class CompressionMiddleware:
+    """
+    Compress JSON responses with brotli or gzip depending on what the
+    client accepts. Bodies smaller than COMPRESSION_MIN_LENGTH are sent as-is,
+    and bodies larger than COMPRESSION_CACHE_MIN_LENGTH are cached compressed.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_length = getattr(settings, 'COMPRESSION_MIN_LENGTH', 1024)
+        self.cache_min_length = getattr(settings, 'COMPRESSION_CACHE_MIN_LENGTH', 64 * 1024)
+        self.content_types = tuple(getattr(settings, 'COMPRESSION_CONTENT_TYPES', ('application/json',)))
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if content_type not in self.content_types:
+            return response
+
+        # The response varies on Accept-Encoding even when we decide not to compress
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        content = response.content
+        if len(content) < self.min_length:
+            return response
+
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        compressed = None
+        key = None
+        if len(content) >= self.cache_min_length:
+            key = (encoding, hashlib.sha1(content).digest())
+            compressed = payload_cache.get(key)
+        if compressed is None:
+            compressed = compress(content, encoding)
+            if key is not None:
+                payload_cache.set(key, compressed)
+
+        # Don't send a compressed body that is no smaller than the original
+        if len(compressed) >= len(content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+
+        # A strong ETag no longer matches the encoded representation
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+
+        return response
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+STICKY_COOKIE = 'db_primary_until'
+STICKY_PREFIX = 'db-primary-until:'
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Choose where a request's reads go (see api.routing). Safe requests read
+    from a random replica unless the client wrote within the last
+    REPLICA_STICKY_SECONDS, so it reads its own writes (api.coalesce skips
+    its shared responses then too). The window is kept in the cache per
+    user, for token clients that don't send cookies back, and in a cookie
+    for anonymous ones.
+    With DB_QUERY_METRICS on, per-alias query counts and time are reported
+    in a Server-Timing header. Without replicas or metrics it is left out
+    of the stack.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not replicas() and not getattr(settings, 'DB_QUERY_METRICS', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sticky_seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def requester(self, request):
+        """Id of the user a JWT bearer token was issued to, or None; views authenticate it properly"""
+        authentication = JWTAuthentication()
+        header = authentication.get_header(request)
+        if header is None:
+            return None
+        try:
+            raw_token = authentication.get_raw_token(header)
+            if raw_token is None:
+                return None
+            return authentication.get_validated_token(raw_token).get(jwt_settings.USER_ID_CLAIM)
+        except AuthenticationFailed:
+            return None
+
+    def wrote_recently(self, request, state):
+        now = time.time()
+        if state.requester is not None and cache.get(f'{STICKY_PREFIX}{state.requester}', 0) > now:
+            return True
+        try:
+            return float(request.COOKIES.get(STICKY_COOKIE, 0)) > now
+        except ValueError:
+            return False
+
+    def start(self, request):
+        state = RoutingState()
+        aliases = replicas()
+        if aliases:
+            state.requester = self.requester(request)
+            state.sticky = self.wrote_recently(request, state)
+            if request.method in SAFE_METHODS and not state.sticky:
+                state.replica = random.choice(aliases)
+        return state
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = self.start(request)
+        token = current_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_state.reset(token)
+        return self.finish(request, state, response)
+
+    async def __acall__(self, request):
+        # The cache is read and written with blocking calls, so start and
+        # finish run off the event loop
+        state = await sync_to_async(self.start)(request)
+        # Sync views run through sync_to_async, which carries the context over
+        token = current_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_state.reset(token)
+        return await sync_to_async(self.finish)(request, state, response)
+
+    def finish(self, request, state, response):
+        if state.wrote and replicas():
+            until = time.time() + self.sticky_seconds
+            # Set on the request by DRF (or the session middleware) once it authenticated the user
+            user = getattr(request, 'user', None)
+            requester = user.pk if user is not None and user.is_authenticated else state.requester
+            if requester is not None:
+                cache.set(f'{STICKY_PREFIX}{requester}', until, self.sticky_seconds)
+            response.set_cookie(STICKY_COOKIE, f'{until:.3f}',
+                                max_age=self.sticky_seconds, httponly=True, samesite='Lax')
+        if getattr(settings, 'DB_QUERY_METRICS', False):
+            response['Server-Timing'] = ', '.join(
+                f'db-{alias};dur={seconds * 1000:.2f};desc="{count} queries"'
+                for alias, (count, seconds) in state.queries.items()
+            )
+        return response
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:25
+
+import api.media
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_movie_actors_movie_aka_movie_imdb_id_movie_imdb_iv_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='movie',
+            name='poster_image',
+            field=models.ImageField(blank=True, help_text='Uploaded poster image', null=True, upload_to=api.media.poster_upload_to),
+        ),
+    ]
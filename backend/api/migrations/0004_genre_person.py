@@ -0,0 +1,85 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_poster_content_hash_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Genre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('normalized_name', models.CharField(max_length=100, unique=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Person',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('normalized_name', models.CharField(max_length=255, unique=True)),
+            ],
+            options={
+                'verbose_name_plural': 'people',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MovieGenre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('genre', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.genre')),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.movie')),
+            ],
+            options={
+                'unique_together': {('movie', 'genre')},
+            },
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='genres',
+            field=models.ManyToManyField(blank=True, related_name='movies', through='api.MovieGenre', to='api.genre'),
+        ),
+        migrations.CreateModel(
+            name='MovieDirector',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.movie')),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.person')),
+            ],
+            options={
+                'unique_together': {('movie', 'person')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MovieActor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.movie')),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.person')),
+            ],
+            options={
+                'unique_together': {('movie', 'person')},
+            },
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='cast',
+            field=models.ManyToManyField(blank=True, related_name='acted_in', through='api.MovieActor', to='api.person'),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='directors',
+            field=models.ManyToManyField(blank=True, related_name='directed', through='api.MovieDirector', to='api.person'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+import re
+import unicodedata
+
+from django.db import migrations
+
+
+# api.text as it was when this migration was written
+_whitespace = re.compile(r'\s+')
+_name_separators = re.compile(r'\s*[,;/|]\s*')
+
+
+def normalize_text(value):
+    if not value:
+        return ''
+    if not value.isascii():
+        value = unicodedata.normalize('NFKD', value)
+        value = ''.join(c for c in value if not unicodedata.combining(c))
+    return _whitespace.sub(' ', value.casefold()).strip()
+
+
+def split_names(value):
+    names = []
+    seen = set()
+    for name in _name_separators.split(value or ''):
+        name = _whitespace.sub(' ', name).strip()
+        key = normalize_text(name)
+        if key and key not in seen:
+            seen.add(key)
+            names.append(name)
+    return names
+
+
+CREDIT_FIELDS = {
+    'genre': ('MovieGenre', 'genre', 'Genre'),
+    'director': ('MovieDirector', 'person', 'Person'),
+    'actors': ('MovieActor', 'person', 'Person'),
+}
+
+
+def populate(apps, schema_editor):
+    Movie = apps.get_model('api', 'Movie')
+    lookups = {'Genre': {}, 'Person': {}}
+
+    def lookup(model_name, name):
+        key = normalize_text(name)
+        cache = lookups[model_name]
+        if key not in cache:
+            model = apps.get_model('api', model_name)
+            cache[key] = model.objects.get_or_create(normalized_name=key, defaults={'name': name})[0].pk
+        return cache[key]
+
+    for field, (through_name, target, model_name) in CREDIT_FIELDS.items():
+        through = apps.get_model('api', through_name)
+        batch = []
+        for movie_id, value in Movie.objects.values_list('id', field).iterator(chunk_size=2000):
+            for name in split_names(value):
+                batch.append(through(movie_id=movie_id, **{f'{target}_id': lookup(model_name, name)}))
+            if len(batch) >= 2000:
+                through.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        through.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_genre_person'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate, migrations.RunPython.noop),
+    ]
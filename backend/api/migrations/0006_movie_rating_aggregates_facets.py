@@ -0,0 +1,83 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:34
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+# Facet names and score bands this backfill counted with; api.facets
+# imports the live models, which a migration must not use
+GENRE = 'genre'
+DECADE = 'decade'
+SCORE = 'score'
+UNRATED = 'unrated'
+SCORE_BANDS = (('4-5', 4), ('3-4', 3), ('2-3', 2), ('1-2', 1))
+
+
+def decade(release_year):
+    return f'{release_year // 10 * 10}s'
+
+
+def score_band(rating_count, rating_sum):
+    if not rating_count:
+        return UNRATED
+    for band, low in SCORE_BANDS:
+        if rating_sum >= low * rating_count:
+            return band
+    return SCORE_BANDS[-1][0]
+
+
+def backfill(apps, schema_editor):
+    Movie = apps.get_model('api', 'Movie')
+    Rating = apps.get_model('api', 'Rating')
+    MovieGenre = apps.get_model('api', 'MovieGenre')
+    FacetCount = apps.get_model('api', 'FacetCount')
+
+    totals = Rating.objects.values('movie_id').annotate(n=Count('id'), total=Sum('score')).order_by()
+    for row in totals.iterator(chunk_size=2000):
+        Movie.objects.filter(pk=row['movie_id']).update(rating_count=row['n'], rating_sum=row['total'])
+
+    counts = Counter()
+    movies = Movie.objects.values_list('release_year', 'rating_count', 'rating_sum')
+    for release_year, rating_count, rating_sum in movies.iterator(chunk_size=2000):
+        counts[DECADE, decade(release_year)] += 1
+        counts[SCORE, score_band(rating_count, rating_sum)] += 1
+    for row in MovieGenre.objects.values('genre__name').annotate(n=Count('id')).order_by():
+        counts[GENRE, row['genre__name']] += row['n']
+    FacetCount.objects.bulk_create(
+        [FacetCount(facet=facet, value=value, count=count) for (facet, value), count in counts.items()]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_populate_genres_people'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='rating_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_sum',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(max_length=20)),
+                ('value', models.CharField(max_length=100)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('facet', 'value')},
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_movie_rating_aggregates_facets'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='movie',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:49
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+
+
+FAVOURITE_GENRES = 3
+SCORES = range(1, 6)
+
+
+def backfill(apps, schema_editor):
+    # What api.stats.populate did for everyone when the tables were added
+    Rating = apps.get_model('api', 'Rating')
+    UserRatingStats = apps.get_model('api', 'UserRatingStats')
+    UserGenreStats = apps.get_model('api', 'UserGenreStats')
+
+    ratings = Rating.objects.all()
+    totals = ratings.values('user_id').annotate(
+        n=Count('pk'), total=Sum('score'), last=Max('updated_at'),
+        **{f'score_{score}': Count('pk', filter=Q(score=score)) for score in SCORES},
+    ).order_by()
+    UserRatingStats.objects.bulk_create((
+        UserRatingStats(user_id=row['user_id'], rating_count=row['n'], rating_sum=row['total'],
+                        last_rated_at=row['last'], **{f'score_{score}': row[f'score_{score}'] for score in SCORES})
+        for row in totals.iterator(chunk_size=2000)
+    ), batch_size=500)
+
+    by_genre = (ratings.filter(movie__genres__isnull=False).values('user_id', 'movie__genres')
+                .annotate(n=Count('pk'), total=Sum('score')).order_by())
+    UserGenreStats.objects.bulk_create((
+        UserGenreStats(user_id=row['user_id'], genre_id=row['movie__genres'],
+                       rating_count=row['n'], rating_sum=row['total'])
+        for row in by_genre.iterator(chunk_size=2000)
+    ), batch_size=500)
+
+    favourites = defaultdict(list)
+    ranked = UserGenreStats.objects.order_by('user_id', '-rating_sum', '-rating_count', 'genre__name')
+    for user_id, name in ranked.values_list('user_id', 'genre__name').iterator(chunk_size=2000):
+        if len(favourites[user_id]) < FAVOURITE_GENRES:
+            favourites[user_id].append(name)
+    UserRatingStats.objects.bulk_update(
+        [UserRatingStats(user_id=user_id, favourite_genres=names) for user_id, names in favourites.items()],
+        ['favourite_genres'], batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_movie_updated_at_index'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserRatingStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('rating_count', models.IntegerField(default=0)),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('score_1', models.IntegerField(default=0)),
+                ('score_2', models.IntegerField(default=0)),
+                ('score_3', models.IntegerField(default=0)),
+                ('score_4', models.IntegerField(default=0)),
+                ('score_5', models.IntegerField(default=0)),
+                ('last_rated_at', models.DateTimeField(blank=True, null=True)),
+                ('favourite_genres', models.JSONField(blank=True, default=list)),
+            ],
+            options={
+                'verbose_name_plural': 'user rating stats',
+            },
+        ),
+        migrations.CreateModel(
+            name='UserGenreStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating_count', models.IntegerField(default=0)),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('genre', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_stats', to='api.genre')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='genre_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'user genre stats',
+                'unique_together': {('user', 'genre')},
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,142 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:03
+
+import hashlib
+import random
+import re
+import struct
+import unicodedata
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# The title normalization and MinHash banding this index was first built
+# with, copied so that tuning api.duplicates later can't change this backfill
+
+NUM_BANDS = 10
+BAND_ROWS = 3
+_PRIME = (1 << 61) - 1
+_random = random.Random(1999)
+_PERMUTATIONS = [(_random.randrange(1, _PRIME), _random.randrange(_PRIME)) for _ in range(NUM_BANDS * BAND_ROWS)]
+
+_whitespace = re.compile(r'\s+')
+_name_separators = re.compile(r'\s*[,;/|]\s*')
+_punctuation = re.compile(r'[^\w\s]+')
+_trailing_article = re.compile(r'^(.+), (the|a|an)$')
+
+
+def normalize_text(value):
+    if not value:
+        return ''
+    if not value.isascii():
+        value = unicodedata.normalize('NFKD', value)
+        value = ''.join(c for c in value if not unicodedata.combining(c))
+    return _whitespace.sub(' ', value.casefold()).strip()
+
+
+def split_names(value):
+    names = []
+    seen = set()
+    for name in _name_separators.split(value or ''):
+        name = _whitespace.sub(' ', name).strip()
+        key = normalize_text(name)
+        if key and key not in seen:
+            seen.add(key)
+            names.append(name)
+    return names
+
+
+def _comparable(name):
+    name = normalize_text(name)
+    inverted = _trailing_article.match(name)
+    if inverted:
+        name = f'{inverted[2]} {inverted[1]}'
+    return ' '.join(_punctuation.sub(' ', name).split())
+
+
+def title_variants(title, aka=None):
+    variants = [_comparable(title)] + [_comparable(name) for name in split_names(aka)]
+    return [variant for variant in dict.fromkeys(variants) if variant]
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big')
+
+
+def band_buckets(variants):
+    buckets = set()
+    for variant in variants:
+        hashes = [_hash64(shingle.encode()) for shingle in trigrams(variant)]
+        signature = [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+        for band in range(NUM_BANDS):
+            rows = signature[band * BAND_ROWS:(band + 1) * BAND_ROWS]
+            bucket = _hash64(struct.pack(f'>{BAND_ROWS}Q', *rows))
+            buckets.add((band, bucket - (1 << 64) if bucket >= 1 << 63 else bucket))
+    return buckets
+
+
+def backfill(apps, schema_editor):
+    Movie = apps.get_model('api', 'Movie')
+    MovieTitleBand = apps.get_model('api', 'MovieTitleBand')
+
+    movies = [Movie(pk=pk, normalized_title=normalize_text(title))
+              for pk, title in Movie.objects.values_list('pk', 'title').iterator(chunk_size=2000)]
+    Movie.objects.bulk_update(movies, ['normalized_title'], batch_size=500)
+
+    batch = []
+    for movie_id, title, aka in Movie.objects.values_list('pk', 'title', 'aka').iterator(chunk_size=1000):
+        batch.extend(MovieTitleBand(movie_id=movie_id, band=band, bucket=bucket)
+                     for band, bucket in band_buckets(title_variants(title, aka)))
+        if len(batch) >= 1000:
+            MovieTitleBand.objects.bulk_create(batch)
+            batch = []
+    MovieTitleBand.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_user_rating_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovieTitleBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.SmallIntegerField()),
+                ('bucket', models.BigIntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='normalized_title',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='movie',
+            name='imdb_id',
+            field=models.CharField(blank=True, db_index=True, help_text='IMDB ID (e.g., tt1234567)', max_length=20, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['normalized_title', 'release_year'], name='api_movie_normali_2cfda1_idx'),
+        ),
+        migrations.AddField(
+            model_name='movietitleband',
+            name='movie',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='title_bands', to='api.movie'),
+        ),
+        migrations.AddIndex(
+            model_name='movietitleband',
+            index=models.Index(fields=['band', 'bucket'], name='api_movieti_band_840cf4_idx'),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
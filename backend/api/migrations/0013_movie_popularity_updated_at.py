@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_rating_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='popularity_updated_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
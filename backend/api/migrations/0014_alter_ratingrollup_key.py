@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_movie_popularity_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ratingrollup',
+            name='key',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -1,6 +1,59 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
+from .media import poster_upload_to
+from .text import normalize_text
+
+
+class Genre(models.Model):
+    name = models.CharField(max_length=100)
+    normalized_name = models.CharField(max_length=100, unique=True)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_text(self.name)
+        super().save(*args, **kwargs)
+
+
+class Person(models.Model):
+    """An actor or director, parsed from the free-text Movie fields"""
+    name = models.CharField(max_length=255)
+    normalized_name = models.CharField(max_length=255, unique=True)
+
+    class Meta:
+        ordering = ['name']
+        verbose_name_plural = 'people'
+
+    def __str__(self):
+        return self.name
+
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_text(self.name)
+        super().save(*args, **kwargs)
+
+
+class MovieManager(models.Manager):
+    """Movies that are not soft-deleted; Movie.all_objects includes them"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+class RatingManager(models.Manager):
+    """
+    Ratings except those of soft-deleted movies and deleted users. Deleted
+    users' ratings leave the movie aggregates when they are hidden; a
+    hidden movie keeps its own until api.deletion purges it.
+    Rating.all_objects includes them all
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(movie__deleted_at__isnull=True, user__deletion__isnull=True)
 
 
 class Movie(models.Model):
@@ -11,36 +64,122 @@ class Movie(models.Model):
     director = models.CharField(max_length=255)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='movies')
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     
     # IMDB and extended fields (all optional)
-    imdb_id = models.CharField(max_length=20, blank=True, null=True, help_text="IMDB ID (e.g., tt1234567)")
+    imdb_id = models.CharField(max_length=20, blank=True, null=True, db_index=True, help_text="IMDB ID (e.g., tt1234567)")
     imdb_rank = models.FloatField(blank=True, null=True, help_text="IMDB ranking")
     actors = models.TextField(blank=True, null=True, help_text="Comma-separated list of actors")
     aka = models.CharField(max_length=500, blank=True, null=True, help_text="Also Known As (alternative titles)")
     imdb_url = models.URLField(blank=True, null=True, help_text="IMDB URL")
     imdb_iv = models.CharField(max_length=50, blank=True, null=True, help_text="IMDB IV identifier")
     poster_url = models.URLField(blank=True, null=True, help_text="External poster image URL")
-    poster_image = models.ImageField(upload_to='posters/', blank=True, null=True, help_text="Uploaded poster image")
+    poster_image = models.ImageField(upload_to=poster_upload_to, blank=True, null=True, help_text="Uploaded poster image")
     photo_width = models.IntegerField(blank=True, null=True, help_text="Poster image width in pixels")
     photo_height = models.IntegerField(blank=True, null=True, help_text="Poster image height in pixels")
 
+    # Normalized copies of genre, director and actors, kept in sync by api.signals
+    genres = models.ManyToManyField(Genre, through='MovieGenre', related_name='movies', blank=True)
+    directors = models.ManyToManyField(Person, through='MovieDirector', related_name='directed', blank=True)
+    cast = models.ManyToManyField(Person, through='MovieActor', related_name='acted_in', blank=True)
+
+    # Rating aggregates, maintained by api.signals on every rating write
+    rating_count = models.IntegerField(default=0, editable=False)
+    rating_sum = models.IntegerField(default=0, editable=False)
+    aggregate_fields = ('rating_count', 'rating_sum')
+    # When the aggregates last moved, so other workers' typeahead indexes can
+    # catch up on popularity without touching updated_at
+    popularity_updated_at = models.DateTimeField(blank=True, null=True, db_index=True, editable=False)
+
+    # Case- and accent-insensitive title, for duplicate checks
+    normalized_title = models.CharField(max_length=255, default='', editable=False)
+
+    # Set when the movie is deleted; api.deletion removes it and its ratings later
+    deleted_at = models.DateTimeField(blank=True, null=True, db_index=True, editable=False)
+
+    objects = MovieManager()
+    all_objects = models.Manager()
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['normalized_title', 'release_year']),
+        ]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        self.normalized_title = normalize_text(self.title)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'title' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'normalized_title'}
+        # Never write back stale in-memory aggregates over concurrent rating updates
+        if not self._state.adding and update_fields is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                f.attname for f in self._meta.concrete_fields
+                if not f.primary_key and f.attname not in self.aggregate_fields
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored year and titles so facet counts and the
+        # duplicate index are only touched when they change
+        instance._loaded_release_year = instance.__dict__.get('release_year')
+        instance._loaded_titles = (instance.__dict__.get('title'), instance.__dict__.get('aka'))
+        return instance
+
     @property
     def average_rating(self):
-        ratings = self.ratings.all()
-        if ratings:
-            return sum(r.score for r in ratings) / len(ratings)
+        if self.rating_count:
+            return self.rating_sum / self.rating_count
         return 0
 
     @property
     def ratings_count(self):
-        return self.ratings.count()
+        return self.rating_count
+
+
+class MovieTitleBand(models.Model):
+    """
+    MinHash LSH band buckets of a movie's title and alternative titles,
+    maintained by api.signals. Movies sharing a bucket are candidate
+    near-duplicates (see api.duplicates).
+    """
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='title_bands')
+    band = models.SmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['band', 'bucket']),
+        ]
+
+
+class MovieGenre(models.Model):
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
+    genre = models.ForeignKey(Genre, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ['movie', 'genre']
+
+
+class MovieDirector(models.Model):
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
+    person = models.ForeignKey(Person, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ['movie', 'person']
+
+
+class MovieActor(models.Model):
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
+    person = models.ForeignKey(Person, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ['movie', 'person']
 
 
 class Rating(models.Model):
@@ -51,6 +190,9 @@ class Rating(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = RatingManager()
+    all_objects = models.Manager()
+
     class Meta:
         unique_together = ['movie', 'user']
         ordering = ['-created_at']
@@ -58,3 +200,160 @@ class Rating(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.movie.title}: {self.score}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored score so aggregates can be adjusted by the difference
+        instance._loaded_score = instance.__dict__.get('score')
+        return instance
+
+
+class FacetCount(models.Model):
+    """
+    Number of movies per browse facet value (genre, decade, score band),
+    maintained incrementally by api.signals so facet reads never scan Movie.
+    """
+    facet = models.CharField(max_length=20)
+    value = models.CharField(max_length=100)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['facet', 'value']
+
+    def __str__(self):
+        return f"{self.facet}={self.value}: {self.count}"
+
+
+class UserRatingStats(models.Model):
+    """
+    Per-user rating summary, maintained by api.signals in the same
+    transaction as each rating write so profile reads are a primary key
+    lookup instead of a scan over the user's ratings.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='rating_stats')
+    rating_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    score_1 = models.IntegerField(default=0)
+    score_2 = models.IntegerField(default=0)
+    score_3 = models.IntegerField(default=0)
+    score_4 = models.IntegerField(default=0)
+    score_5 = models.IntegerField(default=0)
+    last_rated_at = models.DateTimeField(blank=True, null=True)
+    favourite_genres = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'user rating stats'
+
+    def __str__(self):
+        return f"{self.user_id}: {self.rating_count} ratings"
+
+    @property
+    def average_rating(self):
+        if self.rating_count:
+            return self.rating_sum / self.rating_count
+        return 0
+
+    @property
+    def histogram(self):
+        return {str(score): getattr(self, f'score_{score}') for score in range(1, 6)}
+
+
+class UserGenreStats(models.Model):
+    """Ratings a user has given per genre, the source of their favourite genres"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='genre_stats')
+    genre = models.ForeignKey(Genre, on_delete=models.CASCADE, related_name='user_stats')
+    rating_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['user', 'genre']
+        verbose_name_plural = 'user genre stats'
+
+    def __str__(self):
+        return f"{self.user_id} - {self.genre_id}: {self.rating_count}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    A client-supplied Idempotency-Key with a fingerprint of the write it
+    guarded and that write's response, replayed for retries by
+    api.idempotency. status_code is null while the write is in progress.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+    response_body = models.JSONField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = ['user', 'key']
+
+    def __str__(self):
+        return f"{self.user_id}: {self.key}"
+
+
+class UserDeletion(models.Model):
+    """
+    A deleted user: deactivated, with their movies and ratings hidden at
+    once, and removed with everything they own by api.deletion in batches
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='deletion')
+    requested_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user_id} (deleted {self.requested_at:%Y-%m-%d %H:%M})"
+
+
+class RatingRollup(models.Model):
+    """
+    Ratings given per hour or day, in total, per movie and per genre,
+    filled incrementally by api.rollups so analytics never scan Rating.
+    Ratings count in the bucket they were first given in, with the score
+    they had when folded in; later changes and deletions are not applied.
+    """
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIODS = [(HOUR, 'Hour'), (DAY, 'Day')]
+    TOTAL = 'total'
+    MOVIE = 'movie'
+    GENRE = 'genre'
+    DIMENSIONS = [(TOTAL, 'Total'), (MOVIE, 'Movie'), (GENRE, 'Genre')]
+
+    period = models.CharField(max_length=4, choices=PERIODS)
+    bucket = models.DateTimeField()
+    dimension = models.CharField(max_length=5, choices=DIMENSIONS)
+    # Movie or genre id; 0 for the totals
+    key = models.BigIntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    # Ratings by users who joined at most ANALYTICS_NEW_USER_DAYS before
+    new_user_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['period', 'dimension', 'key', 'bucket']
+
+    def __str__(self):
+        return f"{self.period} {self.bucket:%Y-%m-%d %H:00} {self.dimension}={self.key}: {self.rating_count}"
+
+
+class SignupRollup(models.Model):
+    """Users who joined per hour or day, filled incrementally by api.rollups"""
+    period = models.CharField(max_length=4, choices=RatingRollup.PERIODS)
+    bucket = models.DateTimeField()
+    user_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['period', 'bucket']
+
+    def __str__(self):
+        return f"{self.period} {self.bucket:%Y-%m-%d %H:00}: {self.user_count}"
+
+
+class RollupWatermark(models.Model):
+    """The highest primary key of a source table already folded into the rollups"""
+    name = models.CharField(max_length=50, primary_key=True)
+    last_id = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.last_id}"
@@ -0,0 +1,50 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def estimated_row_count(model, using='default'):
+    """
+    Planner statistics estimate of a table's row count, or None when the
+    database has none (SQLite before ANALYZE, Postgres before autovacuum).
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # Resolved through search_path like the ORM's own queries, so a
+            # same-named table in another schema is not picked up
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                           [connection.ops.quote_name(table)])
+            row = cursor.fetchone()
+            if row and row[0] >= 0:
+                return row[0]
+        elif connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone():
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [table])
+                row = cursor.fetchone()
+                if row:
+                    return int(row[0].split()[0])
+    return None
+
+
+class ApproximateCountPaginator(Paginator):
+    """
+    Paginator that trusts planner statistics for the total of an unfiltered
+    queryset over a large table instead of running COUNT(*).
+    """
+
+    # Below this many rows an exact count is cheap enough
+    approximate_threshold = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = getattr(queryset, 'query', None)
+        # Filters of the default manager (e.g. hiding soft-deleted rows) leave the estimate good enough
+        if query is not None and query.where == queryset.model._default_manager.all().query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= self.approximate_threshold:
+                return estimate
+        return super().count
@@ -0,0 +1,396 @@
+import hashlib
+import http.client
+import io
+import ipaddress
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urljoin, urlsplit
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotModified, HttpResponseRedirect
+from django.views.decorators.http import require_safe
+
+from .coalesce import flights
+from .media import _not_modified
+from .models import Movie
+
+
+USER_AGENT = 'movie-platform-poster-proxy/1.0'
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 3
+# Cache hits refresh a file's mtime, the recency eviction sorts by, at most this often
+TOUCH_INTERVAL = 60
+# Formats a fetched poster may have; anything else (SVG, HTML) is never served from our origin
+IMAGE_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+MAGIC_NUMBERS = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF8', 'image/gif'),
+    (b'RIFF', 'image/webp'),
+)
+
+
+class PosterFetchError(Exception):
+    """The external poster could not be fetched or is not an image"""
+
+
+class PosterProxyBusy(Exception):
+    """Every upstream fetch slot stayed taken for the whole wait"""
+
+
+def _check_public(address):
+    if not ipaddress.ip_address(address.split('%')[0]).is_global:
+        raise PosterFetchError(f'Refusing to fetch from non-public address {address}')
+
+
+class ConnectionPool:
+    """
+    Keep-alive connections to poster hosts: at most max_idle idle ones are
+    kept per host for reuse, and at most max_active fetches run at once
+    across all hosts, so slow hosts cannot tie up every worker thread.
+    """
+
+    def __init__(self, max_active, max_idle, timeout):
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._active = threading.BoundedSemaphore(max_active)
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def _checkout(self, origin):
+        with self._lock:
+            if self._idle[origin]:
+                return self._idle[origin].pop(), True
+        scheme, host, port = origin
+        connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return connection_class(host, port, timeout=self.timeout), False
+
+    def _checkin(self, origin, connection, response):
+        # Only connections whose response was read to the end can carry another request
+        if response.isclosed() and not response.will_close:
+            with self._lock:
+                if len(self._idle[origin]) < self.max_idle:
+                    self._idle[origin].append(connection)
+                    return
+        connection.close()
+
+    def _request(self, origin, path, allow_private):
+        while True:
+            connection, reused = self._checkout(origin)
+            try:
+                if connection.sock is None:
+                    connection.connect()
+                # Checked on the connected socket, so DNS cannot point elsewhere after the check
+                if not allow_private:
+                    _check_public(connection.sock.getpeername()[0])
+                connection.request('GET', path, headers={'User-Agent': USER_AGENT, 'Accept': 'image/*'})
+                return connection, connection.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError) as e:
+                connection.close()
+                if not reused:
+                    raise PosterFetchError(str(e))
+                # The host closed an idle connection, retry on a fresh one
+            except (OSError, http.client.HTTPException, PosterFetchError) as e:
+                connection.close()
+                raise PosterFetchError(str(e))
+
+    def get(self, url, max_bytes, allow_private=False):
+        """
+        Body of a 200 response to GET url, following a few redirects;
+        waits up to the timeout for a free fetch slot
+        """
+        if not self._active.acquire(timeout=self.timeout):
+            raise PosterProxyBusy
+        try:
+            for _ in range(MAX_REDIRECTS + 1):
+                parts = urlsplit(url)
+                if parts.scheme not in ('http', 'https') or not parts.hostname:
+                    raise PosterFetchError(f'Unsupported poster URL {url}')
+                try:
+                    port = parts.port
+                except ValueError:
+                    raise PosterFetchError(f'Invalid port in poster URL {url}')
+                origin = (parts.scheme, parts.hostname, port or (443 if parts.scheme == 'https' else 80))
+                path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+                connection, response = self._request(origin, path, allow_private)
+                try:
+                    location = response.getheader('Location')
+                    if response.status in REDIRECT_STATUSES and location:
+                        response.read(64 * 1024)
+                        url = urljoin(url, location)
+                        continue
+                    if response.status != 200:
+                        raise PosterFetchError(f'{url} returned {response.status}')
+                    length = response.getheader('Content-Length')
+                    if length and length.isdigit() and int(length) > max_bytes:
+                        raise PosterFetchError(f'{url} is larger than {max_bytes} bytes')
+                    body = response.read(max_bytes + 1)
+                    if len(body) > max_bytes:
+                        raise PosterFetchError(f'{url} is larger than {max_bytes} bytes')
+                    return body
+                except (OSError, http.client.HTTPException) as e:
+                    raise PosterFetchError(str(e))
+                finally:
+                    self._checkin(origin, connection, response)
+            raise PosterFetchError(f'Too many redirects from {url}')
+        finally:
+            self._active.release()
+
+
+class PosterCache:
+    """
+    Fetched posters and their resized variants on disk, evicting the least
+    recently used files once they add up to more than max_bytes. Workers
+    sharing the directory each keep an estimate of its size and rescan it
+    when theirs goes over, evicting down to 90% of max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """Path of the cached file, marking it recently used, or None"""
+        path = self.path(key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if time.time() - stat.st_mtime > TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                return None  # evicted meanwhile
+        return path
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, partial = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.partial-')
+        with os.fdopen(fd, 'wb') as out:
+            out.write(data)
+        os.replace(partial, path)
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan()[0]
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict(keep=path)
+        return path
+
+    def _scan(self):
+        entries = []
+        for subdirectory in os.scandir(self.directory):
+            if not subdirectory.is_dir():
+                continue
+            for entry in os.scandir(subdirectory.path):
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return sum(size for _, size, _ in entries), entries
+
+    def _evict(self, keep):
+        total, entries = self._scan()
+        target = self.max_bytes * 0.9
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
+
+
+_pool = None
+_caches = {}
+_setup_lock = threading.Lock()
+
+
+def connection_pool():
+    global _pool
+    with _setup_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                getattr(settings, 'POSTER_PROXY_MAX_CONCURRENCY', 8),
+                getattr(settings, 'POSTER_PROXY_POOL_SIZE', 4),
+                getattr(settings, 'POSTER_PROXY_TIMEOUT', 5),
+            )
+        return _pool
+
+
+def poster_cache():
+    directory = str(getattr(settings, 'POSTER_PROXY_CACHE_DIR', settings.BASE_DIR / 'poster_cache'))
+    max_bytes = getattr(settings, 'POSTER_PROXY_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+    with _setup_lock:
+        return _caches.setdefault((directory, max_bytes), PosterCache(directory, max_bytes))
+
+
+def _image_format(data):
+    # Imported on first use, API workers do not load Pillow at startup
+    from PIL import Image
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.verify()
+            image_format = image.format
+    except Exception as e:
+        raise PosterFetchError(f'Not an image: {e}')
+    if image_format not in IMAGE_FORMATS:
+        raise PosterFetchError(f'Unsupported image format {image_format}')
+    return image_format
+
+
+def resize(data, width):
+    """The image scaled down to width, keeping its aspect ratio; GIFs become PNGs"""
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as image:
+        image_format = image.format
+        if image.width <= width:
+            return data
+        height = max(1, round(image.height * width / image.width))
+        mode = 'RGB' if image_format == 'JPEG' else 'RGBA'
+        if image.mode not in ('RGB', 'L', mode):
+            image = image.convert(mode)
+        resized = image.resize((width, height), Image.LANCZOS)
+    out = io.BytesIO()
+    if image_format == 'JPEG':
+        resized.save(out, 'JPEG', quality=85, optimize=True)
+    else:
+        resized.save(out, 'PNG' if image_format == 'GIF' else image_format)
+    return out.getvalue()
+
+
+def _content_type(f):
+    head = f.read(12)
+    f.seek(0)
+    for magic, content_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return content_type
+    return 'application/octet-stream'
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def cached_poster(url, width=None):
+    """
+    (key, path) of the cached poster at url, or of its variant width pixels
+    wide, fetching the original on a miss. Concurrent misses in a worker
+    share one fetch, and failed fetches are remembered for
+    POSTER_PROXY_FAILURE_TTL so a broken host is not asked on every request.
+    """
+    posters = poster_cache()
+    digest = hashlib.sha256(url.encode()).hexdigest()[:40]
+    key = digest if width is None else f'{digest}-w{width}'
+    path = posters.get(key)
+    if path is not None:
+        return key, path
+
+    def fetch():
+        original = posters.get(digest)
+        if original is not None:  # stored by a fetch that finished since the check above
+            return original, _read(original)
+        failure_key = f'poster-proxy-failed:{digest}'
+        if cache.get(failure_key):
+            raise PosterFetchError(f'{url} failed recently')
+        try:
+            data = connection_pool().get(
+                url, getattr(settings, 'POSTER_PROXY_MAX_BYTES', 10 * 1024 * 1024),
+                allow_private=getattr(settings, 'POSTER_PROXY_ALLOW_PRIVATE', False),
+            )
+            _image_format(data)
+        except PosterFetchError:
+            cache.set(failure_key, True, getattr(settings, 'POSTER_PROXY_FAILURE_TTL', 300))
+            raise
+        return posters.put(digest, data), data
+
+    original = posters.get(digest)
+    if original is not None:
+        data = _read(original)
+    else:
+        (original, data), _ = flights.do(f'poster:{digest}', fetch)
+    if width is None:
+        return key, original
+    variant, _ = flights.do(f'poster:{key}', lambda: posters.put(key, resize(data, width)))
+    return key, variant
+
+
+def open_poster(url, width=None):
+    """(key, open file) of the cached poster; once open, eviction cannot take it away"""
+    for _ in range(2):
+        key, path = cached_poster(url, width)
+        try:
+            return key, open(path, 'rb')
+        except FileNotFoundError:
+            continue  # another worker evicted it just now
+    raise PosterFetchError(f'{url} was evicted while being served')
+
+
+def proxy_url(movie_id, width=None):
+    """Local URL of a movie's external poster"""
+    return f'{settings.MEDIA_URL}proxy/{movie_id}/' + (f'?w={width}' if width else '')
+
+
+@require_safe
+def serve_poster(request, movie_id):
+    """
+    Serve a movie's external poster_url from the local poster cache,
+    optionally scaled down to one of POSTER_PROXY_WIDTHS with ?w=.
+    Uploaded posters redirect to their media URL. Staff also see the
+    posters of soft-deleted movies, which the admin still lists.
+    """
+    width = request.GET.get('w')
+    if width is not None:
+        widths = getattr(settings, 'POSTER_PROXY_WIDTHS', (100, 300, 600))
+        if not width.isdigit() or int(width) not in widths:
+            return HttpResponseBadRequest(f'w must be one of {", ".join(map(str, widths))}')
+        width = int(width)
+
+    user = getattr(request, 'user', None)
+    movies = Movie.all_objects if user is not None and user.is_staff else Movie.objects
+    movie = movies.only('poster_url', 'poster_image').filter(pk=movie_id).first()
+    if movie is None:
+        raise Http404('Movie not found')
+    if movie.poster_image:
+        return HttpResponseRedirect(movie.poster_image.url)
+    if not movie.poster_url:
+        raise Http404('Movie has no poster')
+
+    try:
+        key, poster = open_poster(movie.poster_url, width)
+    except PosterProxyBusy:
+        response = HttpResponse('Poster proxy busy', status=503, content_type='text/plain')
+        response['Retry-After'] = '1'
+        return response
+    except PosterFetchError:
+        return HttpResponse('Poster could not be fetched', status=502, content_type='text/plain')
+
+    # The key is derived from poster_url, so a cached file never changes
+    etag = f'"{key}"'
+    if _not_modified(request, etag, os.fstat(poster.fileno()).st_mtime):
+        poster.close()
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(poster, content_type=_content_type(poster))
+    response['ETag'] = etag
+    response['Cache-Control'] = f'public, max-age={getattr(settings, "POSTER_PROXY_MAX_AGE", 24 * 60 * 60)}'
+    return response
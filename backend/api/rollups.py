@@ -0,0 +1,250 @@
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import chain, takewhile
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .models import MovieGenre, Rating, RatingRollup, RollupWatermark, SignupRollup
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, the pure Python grouping gives the same totals
+    np = None
+
+
+PERIOD_SECONDS = {RatingRollup.HOUR: 60 * 60, RatingRollup.DAY: 24 * 60 * 60}
+RATING_FIELDS = ['rating_count', 'rating_sum', 'new_user_count']
+
+
+def bucket_start(moment, period):
+    """Start of the UTC hour or day containing moment"""
+    epoch = int(moment.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % PERIOD_SECONDS[period], tz=dt_timezone.utc)
+
+
+def _column(values):
+    values = list(values)
+    return np.array(values, dtype=np.int64) if np is not None else values
+
+
+def _floor(column, seconds):
+    if np is not None:
+        return column - column % seconds
+    return [value - value % seconds for value in column]
+
+
+def group_sums(keys, values):
+    """
+    Sum value columns per distinct combination of key columns (all
+    integer columns of one length); returns {key tuple: [sums]}. With
+    NumPy the grouping is one np.unique and a bincount per value column.
+    """
+    if np is not None:
+        if not len(keys[0]):
+            return {}
+        # Number each column's distinct values and combine the numbers into
+        # one integer per row, so the grouping is a 1-D unique
+        distinct, composite = [], np.zeros(len(keys[0]), dtype=np.int64)
+        for column in keys:
+            uniques, inverse = np.unique(column, return_inverse=True)
+            distinct.append(uniques)
+            composite = composite * len(uniques) + inverse.reshape(-1)
+        groups, inverse = np.unique(composite, return_inverse=True)
+        sums = [np.bincount(inverse.reshape(-1), weights=column, minlength=len(groups)).round().astype(np.int64).tolist()
+                for column in values]
+        key_columns = []
+        for uniques in reversed(distinct):
+            groups, position = np.divmod(groups, len(uniques))
+            key_columns.append(uniques[position].tolist())
+        return dict(zip(zip(*reversed(key_columns)), (list(totals) for totals in zip(*sums))))
+    totals = defaultdict(lambda: [0] * len(values))
+    for i, key in enumerate(zip(*keys)):
+        row = totals[key]
+        for j, column in enumerate(values):
+            row[j] += column[i]
+    return dict(totals)
+
+
+def aggregate_ratings(rows, genres_by_movie, new_user_seconds):
+    """
+    Rollup totals for (movie_id, score, created_at, date_joined) rows as
+    {(period, dimension, key, bucket epoch): [count, sum, new user count]}
+    """
+    movie = _column(row[0] for row in rows)
+    score = _column(row[1] for row in rows)
+    created = _column(int(row[2].timestamp()) for row in rows)
+    joined = _column(int(row[3].timestamp()) for row in rows)
+    ones = _column([1] * len(rows))
+    if np is not None:
+        new_user = ((created - joined) <= new_user_seconds).astype(np.int64)
+    else:
+        new_user = [int(c - j <= new_user_seconds) for c, j in zip(created, joined)]
+
+    # One row per (rating, genre) of the rated movie
+    genre_lists = [genres_by_movie.get(movie_id, ()) for movie_id in (row[0] for row in rows)]
+    if np is not None:
+        index = np.repeat(np.arange(len(rows)), [len(genres) for genres in genre_lists])
+        genre = np.fromiter(chain.from_iterable(genre_lists), dtype=np.int64, count=len(index))
+        genre_rows = (genre, created[index], ones[index], score[index], new_user[index])
+    else:
+        index = [i for i, genres in enumerate(genre_lists) for _ in genres]
+        genre = list(chain.from_iterable(genre_lists))
+        genre_rows = (genre, [created[i] for i in index], [1] * len(index),
+                      [score[i] for i in index], [new_user[i] for i in index])
+
+    result = {}
+    for period, seconds in PERIOD_SECONDS.items():
+        bucket = _floor(created, seconds)
+        values = [ones, score, new_user]
+        for (bucket_epoch,), totals in group_sums([bucket], values).items():
+            result[period, RatingRollup.TOTAL, 0, bucket_epoch] = totals
+        for (key, bucket_epoch), totals in group_sums([movie, bucket], values).items():
+            result[period, RatingRollup.MOVIE, key, bucket_epoch] = totals
+        genre_key, genre_created, genre_ones, genre_score, genre_new = genre_rows
+        genre_values = [genre_ones, genre_score, genre_new]
+        for (key, bucket_epoch), totals in group_sums([genre_key, _floor(genre_created, seconds)], genre_values).items():
+            result[period, RatingRollup.GENRE, key, bucket_epoch] = totals
+    return result
+
+
+def _epoch_to_datetime(epoch):
+    return datetime.fromtimestamp(epoch, tz=dt_timezone.utc)
+
+
+def _merge(model, totals, unique_fields, value_fields):
+    """
+    Add grouped totals to the rollup rows with one read of the affected
+    rows and one upsert; totals maps unique field values to value deltas.
+    Callers hold the watermark lock, so no one else writes rollups meanwhile.
+    """
+    if not totals:
+        return
+    # Narrowed on every unique field, so the read follows the unique index to
+    # the batch's rows instead of loading whole buckets of other movies
+    values = {field: sorted({key[i] for key in totals}) for i, field in enumerate(unique_fields)}
+    widest = max(unique_fields, key=lambda field: len(values[field]))
+    existing = {}
+    for start in range(0, len(values[widest]), 5000):  # within SQLite's parameter limit
+        lookup = {f'{field}__in': values[field] for field in unique_fields}
+        lookup[f'{widest}__in'] = values[widest][start:start + 5000]
+        for row in model.objects.filter(**lookup).values_list(*unique_fields, *value_fields):
+            existing[tuple(row[:len(unique_fields)])] = row[len(unique_fields):]
+    objs = []
+    for key, deltas in totals.items():
+        current = existing.get(key, [0] * len(value_fields))
+        values = {field: old + delta for field, old, delta in zip(value_fields, current, deltas)}
+        objs.append(model(**dict(zip(unique_fields, key)), **values))
+    model.objects.bulk_create(objs, batch_size=500, update_conflicts=True,
+                              unique_fields=unique_fields, update_fields=value_fields)
+
+
+def _pending(queryset, watermark, batch_size, cutoff, timestamp_index):
+    """
+    The next rows past the watermark, stopping at the first one younger
+    than cutoff: rows numbered just before it may not have committed yet
+    """
+    rows = queryset.filter(pk__gt=watermark.last_id).order_by('pk')[:batch_size]
+    return list(takewhile(lambda row: row[timestamp_index] <= cutoff, rows))
+
+
+def _cutoff():
+    return timezone.now() - timedelta(seconds=getattr(settings, 'ROLLUP_SETTLE_SECONDS', 60))
+
+
+def rollup_ratings(batch_size=None):
+    """
+    Fold ratings added since the last run into RatingRollup, a batch per
+    transaction together with the watermark; returns how many were added
+    """
+    batch_size = batch_size or getattr(settings, 'ROLLUP_BATCH_SIZE', 50000)
+    new_user_seconds = getattr(settings, 'ANALYTICS_NEW_USER_DAYS', 7) * 24 * 60 * 60
+    ratings = Rating.all_objects.values_list('pk', 'movie_id', 'score', 'created_at', 'user__date_joined')
+    cutoff = _cutoff()
+    processed = 0
+    while True:
+        with transaction.atomic():
+            watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name='ratings')
+            rows = _pending(ratings, watermark, batch_size, cutoff, 3)
+            if not rows:
+                return processed
+            genres_by_movie = defaultdict(list)
+            movie_ids = sorted({row[1] for row in rows})
+            for start in range(0, len(movie_ids), 5000):  # within SQLite's parameter limit
+                links = MovieGenre.objects.filter(movie_id__in=movie_ids[start:start + 5000])
+                for movie_id, genre_id in links.values_list('movie_id', 'genre_id'):
+                    genres_by_movie[movie_id].append(genre_id)
+            totals = aggregate_ratings([row[1:] for row in rows], genres_by_movie, new_user_seconds)
+            _merge(RatingRollup, {
+                (period, dimension, key, _epoch_to_datetime(bucket)): values
+                for (period, dimension, key, bucket), values in totals.items()
+            }, ['period', 'dimension', 'key', 'bucket'], RATING_FIELDS)
+            watermark.last_id = rows[-1][0]
+            watermark.save(update_fields=['last_id'])
+        processed += len(rows)
+        if len(rows) < batch_size:
+            return processed
+
+
+def rollup_signups(batch_size=None):
+    """Fold users who joined since the last run into SignupRollup; returns how many were added"""
+    batch_size = batch_size or getattr(settings, 'ROLLUP_BATCH_SIZE', 50000)
+    users = User.objects.values_list('pk', 'date_joined')
+    cutoff = _cutoff()
+    processed = 0
+    while True:
+        with transaction.atomic():
+            watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name='signups')
+            rows = _pending(users, watermark, batch_size, cutoff, 1)
+            if not rows:
+                return processed
+            joined = _column(int(row[1].timestamp()) for row in rows)
+            totals = {}
+            for period, seconds in PERIOD_SECONDS.items():
+                for (bucket,), (count,) in group_sums([_floor(joined, seconds)], [_column([1] * len(rows))]).items():
+                    totals[period, _epoch_to_datetime(bucket)] = [count]
+            _merge(SignupRollup, totals, ['period', 'bucket'], ['user_count'])
+            watermark.last_id = rows[-1][0]
+            watermark.save(update_fields=['last_id'])
+        processed += len(rows)
+        if len(rows) < batch_size:
+            return processed
+
+
+def _buckets(period, start, end):
+    step = timedelta(seconds=PERIOD_SECONDS[period])
+    bucket, last = bucket_start(start, period), bucket_start(end, period)
+    while bucket <= last:
+        yield bucket
+        bucket += step
+
+
+def rating_series(period, start, end, dimension=RatingRollup.TOTAL, key=0):
+    """Ratings, average score and ratings by new users per bucket from start to end, zero-filled"""
+    rows = {
+        bucket: (count, total, new)
+        for bucket, count, total, new in RatingRollup.objects.filter(
+            period=period, dimension=dimension, key=key,
+            bucket__gte=bucket_start(start, period), bucket__lte=end,
+        ).values_list('bucket', *RATING_FIELDS)
+    }
+    series = []
+    for bucket in _buckets(period, start, end):
+        count, total, new = rows.get(bucket, (0, 0, 0))
+        series.append({'bucket': bucket, 'ratings': count,
+                       'average_score': total / count if count else None, 'new_user_ratings': new})
+    return series
+
+
+def signup_series(period, start, end):
+    """New users and the ratings they gave per bucket from start to end, zero-filled"""
+    signups = dict(SignupRollup.objects.filter(
+        period=period, bucket__gte=bucket_start(start, period), bucket__lte=end,
+    ).values_list('bucket', 'user_count'))
+    return [
+        {'bucket': point['bucket'], 'new_users': signups.get(point['bucket'], 0),
+         'new_user_ratings': point['new_user_ratings']}
+        for point in rating_series(period, start, end)
+    ]
@@ -0,0 +1,111 @@
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+
+
+PRIMARY = 'default'
+
+
+class RoutingState:
+    """
+    Database routing decisions for one request: the replica its reads go
+    to (None to read from the primary), the user it claims to come from,
+    whether that client wrote within REPLICA_STICKY_SECONDS and the
+    queries it ran per alias.
+    """
+
+    def __init__(self, replica=None):
+        self.replica = replica
+        self.requester = None
+        self.sticky = False
+        self.wrote = False
+        self.queries = {}  # alias -> [count, seconds]
+
+    def record(self, alias, seconds):
+        totals = self.queries.setdefault(alias, [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+
+
+# Set by api.middleware.ReplicaRoutingMiddleware; None outside requests, so
+# management commands and background work always use the primary.
+current_state = ContextVar('db_routing_state', default=None)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends reads of safe requests to the replica chosen for the request and
+    everything else to the primary. Once a request writes, its remaining
+    reads go to the primary too so it sees its own changes.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = current_state.get()
+        if state is None or state.replica is None:
+            return PRIMARY
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = current_state.get()
+        if state is not None:
+            state.replica = None
+            state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
+
+
+class QueryMetrics:
+    """Process-wide query count and time per database alias"""
+
+    def __init__(self):
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def record(self, alias, seconds):
+        with self._lock:
+            totals = self._totals.setdefault(alias, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {alias: {'queries': count, 'seconds': seconds}
+                    for alias, (count, seconds) in self._totals.items()}
+
+    def clear(self):
+        with self._lock:
+            self._totals.clear()
+
+
+query_metrics = QueryMetrics()
+
+
+def timed_execute(execute, sql, params, many, context):
+    """Connection execute wrapper feeding query_metrics and the request's state"""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        alias = context['connection'].alias
+        query_metrics.record(alias, elapsed)
+        state = current_state.get()
+        if state is not None:
+            state.record(alias, elapsed)
+
+
+def install_metrics(connection):
+    if timed_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(timed_execute)
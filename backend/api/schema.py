@@ -0,0 +1,153 @@
+import hashlib
+import threading
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.urls import include, path
+from django.utils.http import parse_etags
+from rest_framework import permissions
+from drf_yasg import openapi
+from drf_yasg.generators import OpenAPISchemaGenerator
+from drf_yasg.renderers import OpenAPIRenderer, SwaggerJSONRenderer, SwaggerYAMLRenderer
+from drf_yasg.views import get_schema_view
+
+
+API_INFO = openapi.Info(
+    title="Movie Rating Platform API",
+    default_version='v1',
+    description="API for managing movies and ratings",
+    terms_of_service="https://www.google.com/policies/terms/",
+    contact=openapi.Contact(email="contact@movierating.local"),
+    license=openapi.License(name="BSD License"),
+)
+
+# Renderers of the spec documents themselves, as opposed to the UI pages
+SPEC_RENDERERS = (OpenAPIRenderer, SwaggerJSONRenderer, SwaggerYAMLRenderer)
+
+# Source trees whose contents determine the generated schema
+SCHEMA_SOURCE_DIRS = ('api', 'movie_platform')
+
+
+@lru_cache(maxsize=None)
+def code_fingerprint():
+    """
+    Digest of the Python sources the schema is generated from. Computed once
+    per process, since a code change always means a new process.
+    """
+    import drf_yasg
+    import rest_framework
+
+    digest = hashlib.sha256()
+    digest.update(f'{drf_yasg.__version__}:{rest_framework.__version__}'.encode())
+    digest.update(repr(getattr(settings, 'SWAGGER_SETTINGS', None)).encode())
+    for directory in SCHEMA_SOURCE_DIRS:
+        for path in sorted((Path(settings.BASE_DIR) / directory).rglob('*.py')):
+            digest.update(str(path.relative_to(settings.BASE_DIR)).encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()[:32]
+
+
+def schema_file_paths():
+    path = Path(getattr(settings, 'OPENAPI_SCHEMA_FILE', Path(settings.BASE_DIR) / 'openapi.json'))
+    return path, path.with_name(path.name + '.fingerprint')
+
+
+def generate_schema():
+    """
+    Walk every view and serializer to build the schema (slow). The API
+    URLconf is passed explicitly: docs workers do not mount it.
+    """
+    generator = OpenAPISchemaGenerator(API_INFO, patterns=[path('api/', include('api.urls'))])
+    return generator.get_schema(request=None, public=True)
+
+
+def write_schema_file():
+    """Generate the schema and store it as a build artifact, returning its path"""
+    path, fingerprint_path = schema_file_paths()
+    content = OpenAPIRenderer().render(generate_schema())
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    fingerprint_path.write_text(code_fingerprint())
+    return path
+
+
+class SchemaCache:
+    """
+    Rendered schema documents, one per spec format, for the current code
+    fingerprint. The JSON document is read from the artifact written by
+    ``manage.py generate_openapi_schema`` when it is up to date; otherwise
+    the schema is generated on first use.
+    """
+
+    json_formats = ('openapi', 'json')
+
+    def __init__(self):
+        self._documents = {}
+        self._swagger = None
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._documents = {}
+            self._swagger = None
+
+    def _load_file(self):
+        path, fingerprint_path = schema_file_paths()
+        try:
+            if fingerprint_path.read_text().strip() != code_fingerprint():
+                return None
+            return path.read_bytes()
+        except OSError:
+            return None
+
+    def get(self, renderer):
+        document = self._documents.get(renderer.format)
+        if document is not None:
+            return document
+        with self._lock:
+            document = self._documents.get(renderer.format)
+            if document is None:
+                if renderer.format in self.json_formats:
+                    document = self._load_file()
+                if document is None:
+                    if self._swagger is None:
+                        self._swagger = generate_schema()
+                    document = renderer.render(self._swagger)
+                self._documents[renderer.format] = document
+        return document
+
+
+schema_cache = SchemaCache()
+
+BaseSchemaView = get_schema_view(
+    API_INFO,
+    public=True,
+    permission_classes=[permissions.AllowAny],
+)
+
+
+class CachedSchemaView(BaseSchemaView):
+    """
+    Schema view that serves spec documents from ``schema_cache`` with an
+    ETag derived from the code fingerprint. The Swagger/ReDoc HTML shells
+    are cheap to build and are left to drf_yasg.
+    """
+
+    def get(self, request, version='', format=None):
+        renderer = request.accepted_renderer
+        if not isinstance(renderer, SPEC_RENDERERS):
+            return super().get(request, version, format)
+
+        etag = f'"{code_fingerprint()}-{renderer.format}"'
+        # Weak comparison: CompressionMiddleware turns the ETag into W/"..."
+        client_etags = {tag.removeprefix('W/') for tag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))}
+        if etag in client_etags or '*' in client_etags:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(schema_cache.get(renderer),
+                                    content_type=f'{renderer.media_type}; charset=utf-8')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, max-age=0, must-revalidate'
+        return response
@@ -1,7 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
-from .models import Movie, Rating
+from .models import Movie, Rating, UserRatingStats
 
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
@@ -36,7 +36,8 @@ class RatingSerializer(serializers.ModelSerializer):
     class Meta:
         model = Rating
         fields = ('id', 'movie', 'user', 'username', 'score', 'comment', 'created_at', 'updated_at')
-        read_only_fields = ('id', 'user', 'username', 'created_at', 'updated_at')
+        # The movie comes from the URL; moving a rating would skip the aggregate signals
+        read_only_fields = ('id', 'movie', 'user', 'username', 'created_at', 'updated_at')
 
     def validate_score(self, value):
         if value < 1 or value > 5:
@@ -71,3 +72,30 @@ class MovieDetailSerializer(serializers.ModelSerializer):
                   'imdb_id', 'imdb_rank', 'actors', 'aka', 'imdb_url', 'imdb_iv',
                   'poster_url', 'poster_image', 'photo_width', 'photo_height')
         read_only_fields = ('id', 'created_by', 'created_at', 'updated_at')
+
+
+class MovieSummarySerializer(serializers.ModelSerializer):
+    average_rating = serializers.ReadOnlyField()
+    ratings_count = serializers.ReadOnlyField()
+
+    class Meta:
+        model = Movie
+        fields = ('id', 'title', 'release_year', 'imdb_id', 'poster_url', 'average_rating', 'ratings_count')
+        read_only_fields = fields
+
+
+class RatingWithMovieSerializer(RatingSerializer):
+    movie_summary = MovieSummarySerializer(source='movie', read_only=True)
+
+    class Meta(RatingSerializer.Meta):
+        fields = RatingSerializer.Meta.fields + ('movie_summary',)
+
+
+class UserRatingStatsSerializer(serializers.ModelSerializer):
+    average_rating = serializers.ReadOnlyField()
+    histogram = serializers.ReadOnlyField()
+
+    class Meta:
+        model = UserRatingStats
+        fields = ('user', 'rating_count', 'average_rating', 'histogram', 'last_rated_at', 'favourite_genres')
+        read_only_fields = fields
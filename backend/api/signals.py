@@ -0,0 +1,199 @@
+import threading
+
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import coalesce, duplicates, facets, live, routing, stats, suggest
+from .models import FacetCount, Genre, Movie, Person, Rating, UserDeletion, UserGenreStats
+from .text import normalize_text, split_names
+
+
+# Free-text Movie field -> (M2M field, lookup model) it is normalized into
+CREDIT_FIELDS = {
+    'genre': ('genres', Genre),
+    'director': ('directors', Person),
+    'actors': ('cast', Person),
+}
+
+# Movies whose deletion is in progress on this thread, with their genre ids;
+# their cascaded ratings must not adjust aggregates that are being removed
+# wholesale, and may outlive the movie's genre links.
+_deleting = threading.local()
+
+
+def _deleting_movies():
+    if not hasattr(_deleting, 'movies'):
+        _deleting.movies = {}
+    return _deleting.movies
+
+
+def get_or_create_named(model, names):
+    """Fetch rows for the given names, creating the missing ones in bulk"""
+    by_key = {normalize_text(name): name for name in names}
+    existing = {obj.normalized_name: obj for obj in model.objects.filter(normalized_name__in=by_key)}
+    missing = [model(name=name, normalized_name=key) for key, name in by_key.items() if key not in existing]
+    if missing:
+        model.objects.bulk_create(missing, ignore_conflicts=True)
+        existing = {obj.normalized_name: obj for obj in model.objects.filter(normalized_name__in=by_key)}
+    return [existing[key] for key in by_key]
+
+
+def sync_movie_credits(movie, fields=None):
+    """Bring the genre/director/cast relations in line with the text fields"""
+    for field in fields or CREDIT_FIELDS:
+        relation, model = CREDIT_FIELDS[field]
+        getattr(movie, relation).set(get_or_create_named(model, split_names(getattr(movie, field))))
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    routing.install_metrics(connection)
+
+
+@receiver(pre_save, sender=Movie)
+def movie_pre_save(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding or hasattr(instance, '_loaded_release_year'):
+        return
+    # Instance was not loaded from the database, so look up what it replaces
+    instance._loaded_release_year = (
+        Movie.objects.filter(pk=instance.pk).values_list('release_year', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Movie)
+def movie_saved(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        facets.bump(facets.DECADE, facets.decade(instance.release_year), 1)
+        facets.bump(facets.SCORE, facets.score_band(instance.rating_count, instance.rating_sum), 1)
+    elif instance._loaded_release_year is not None:
+        facets.move(facets.DECADE, facets.decade(instance._loaded_release_year),
+                    facets.decade(instance.release_year))
+    instance._loaded_release_year = instance.release_year
+    suggest.on_movie_saved(instance)
+    # Every save moves updated_at, which list pages show
+    coalesce.invalidate(f'movie:{instance.pk}', 'movies')
+    titles = (instance.title, instance.aka)
+    if created or titles != getattr(instance, '_loaded_titles', None):
+        duplicates.index_movie(instance)
+        instance._loaded_titles = titles
+
+    fields = None
+    if update_fields is not None:
+        fields = [field for field in CREDIT_FIELDS if field in update_fields]
+        if not fields:
+            return
+    sync_movie_credits(instance, fields)
+
+
+@receiver(pre_delete, sender=Movie)
+def movie_pre_delete(sender, instance, **kwargs):
+    _deleting_movies()[instance.pk] = list(Genre.objects.filter(movies=instance.pk).values_list('pk', flat=True))
+    current = Movie.objects.filter(pk=instance.pk).values_list('release_year', 'rating_count', 'rating_sum').first()
+    if current is None:
+        return
+    release_year, rating_count, rating_sum = current
+    facets.bump(facets.DECADE, facets.decade(release_year), -1)
+    facets.bump(facets.SCORE, facets.score_band(rating_count, rating_sum), -1)
+    for name in Genre.objects.filter(movies=instance.pk).values_list('name', flat=True):
+        facets.bump(facets.GENRE, name, -1)
+
+
+@receiver(post_delete, sender=Movie)
+def movie_deleted(sender, instance, **kwargs):
+    _deleting_movies().pop(instance.pk, None)
+    suggest.on_movie_deleted(instance.pk)
+    coalesce.invalidate(f'movie:{instance.pk}', 'movies')
+
+
+@receiver(m2m_changed, sender=Movie.genres.through)
+def movie_genres_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'pre_remove', 'pre_clear'):
+        return
+    delta = 1 if action == 'post_add' else -1
+    if reverse:
+        # genre.movies.add/remove/clear(): instance is the Genre
+        movie_ids = list(pk_set) if pk_set is not None else list(instance.movies.values_list('pk', flat=True))
+        facets.bump(facets.GENRE, instance.name, delta * len(movie_ids))
+        stats.movie_genres_changed(movie_ids, [instance.pk], delta)
+        return
+    genres = Genre.objects.filter(movies=instance.pk) if pk_set is None else Genre.objects.filter(pk__in=pk_set)
+    genre_ids = []
+    for genre_id, name in genres.values_list('pk', 'name'):
+        facets.bump(facets.GENRE, name, delta)
+        genre_ids.append(genre_id)
+    stats.movie_genres_changed([instance.pk], genre_ids, delta)
+
+
+@receiver(pre_delete, sender=Genre)
+def genre_pre_delete(sender, instance, **kwargs):
+    # Users whose favourite genres may include this one
+    instance._rated_by = list(UserGenreStats.objects.filter(genre=instance).values_list('user_id', flat=True))
+
+
+@receiver(post_delete, sender=Genre)
+def genre_deleted(sender, instance, **kwargs):
+    FacetCount.objects.filter(facet=facets.GENRE, value=instance.name).delete()
+    stats.refresh_favourites(getattr(instance, '_rated_by', ()))
+
+
+def publish_rating_change(rating, name, totals):
+    """Send a rating delta to live subscribers of its movie once the write commits"""
+    movie_id = rating.movie_id
+    if not live.broker.has_subscribers(movie_id):
+        return
+    if totals is None:
+        totals = Movie.objects.filter(pk=movie_id).values_list('rating_count', 'rating_sum').first() or (0, 0)
+    count, total = totals
+    data = {
+        'movie': movie_id,
+        'average_rating': total / count if count else 0,
+        'ratings_count': count,
+        'rating': live.rating_payload(rating) if name == 'rating' else {'id': rating.pk},
+    }
+    transaction.on_commit(lambda: live.broker.publish(movie_id, name, data))
+
+
+@receiver(post_save, sender=Rating)
+def rating_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    score = instance.score
+    if created:
+        totals = facets.adjust_movie_ratings(instance.movie_id, 1, score)
+        stats.rating_added(instance)
+        suggest.on_rating_count_changed(instance.movie_id, 1)
+    else:
+        previous = getattr(instance, '_loaded_score', None)
+        if previous is None:
+            totals = facets.recount_movie_ratings(instance.movie_id)
+            stats.recount_user(instance.user_id)
+        else:
+            totals = facets.adjust_movie_ratings(instance.movie_id, 0, score - previous)
+            stats.rating_changed(instance, previous)
+    instance._loaded_score = score
+    # List pages show the aggregates too, but are left to expire after
+    # COALESCE_CACHE_TTL: bumping 'movies' on every rating would leave them
+    # nothing to share
+    coalesce.invalidate(f'movie:{instance.movie_id}')
+    publish_rating_change(instance, 'rating', totals)
+
+
+@receiver(post_delete, sender=Rating)
+def rating_deleted(sender, instance, **kwargs):
+    score = getattr(instance, '_loaded_score', None)
+    score = int(instance.score if score is None else score)
+    deleting = _deleting_movies()
+    stats.rating_removed(instance.user_id, instance.movie_id, score, deleting.get(instance.movie_id))
+    if instance.movie_id in deleting:
+        return
+    if UserDeletion.objects.filter(user_id=instance.user_id).exists():
+        # Left the movie's aggregates when the user was deleted (api.deletion.soft_delete_user)
+        return
+    totals = facets.adjust_movie_ratings(instance.movie_id, -1, -score)
+    suggest.on_rating_count_changed(instance.movie_id, -1)
+    coalesce.invalidate(f'movie:{instance.movie_id}')
+    publish_rating_change(instance, 'rating_deleted', totals)
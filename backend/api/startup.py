@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+from typing import NamedTuple
+
+from django.conf import settings
+
+
+# Executed in a fresh interpreter: set Django up and load the URLconf, which
+# is everything a worker does before it can serve its first request.
+STARTUP_SCRIPT = (
+    'import django; django.setup(); '
+    'from django.urls import get_resolver; get_resolver().url_patterns'
+)
+
+
+class ImportProfile(NamedTuple):
+    total_ms: float
+    modules: dict  # module name -> cumulative import time in ms
+
+
+def parse_importtime(output):
+    """Parse ``python -X importtime`` stderr into an ImportProfile"""
+    modules = {}
+    total_us = 0
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        try:
+            _, cumulative_us, name = line.split('|', 2)
+            cumulative_us = int(cumulative_us)
+        except ValueError:
+            continue  # the header line
+        stripped = name.lstrip()
+        modules[stripped] = cumulative_us / 1000
+        # Top level imports are indented by a single space
+        if len(name) - len(stripped) == 1:
+            total_us += cumulative_us
+    return ImportProfile(total_us / 1000, modules)
+
+
+def measure_startup(roles='all', settings_module=None):
+    """
+    Profile the imports of a fresh worker for the given server roles.
+
+    Runs in a subprocess so modules already imported by this process do
+    not hide their cost.
+    """
+    env = dict(os.environ)
+    env['DJANGO_SERVER_ROLES'] = roles
+    env['DJANGO_SETTINGS_MODULE'] = settings_module or os.environ.get(
+        'DJANGO_SETTINGS_MODULE', 'movie_platform.settings')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    return parse_importtime(result.stderr)
@@ -0,0 +1,152 @@
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery, Sum
+
+from .models import MovieGenre, Rating, UserGenreStats, UserRatingStats
+
+
+FAVOURITE_GENRES = 3
+SCORES = range(1, 6)
+
+
+def _increment(model, lookup, deltas, create=True, **values):
+    """
+    Add deltas to a stats row with F() expressions and set values; when the
+    row is missing and create is set, insert it with the deltas as counts.
+    """
+    changes = {name: F(name) + delta for name, delta in deltas.items() if delta}
+    changes.update(values)
+    if not changes or model.objects.filter(**lookup).update(**changes) or not create:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas, **values)
+    except IntegrityError:
+        # Created concurrently by another writer
+        model.objects.filter(**lookup).update(**changes)
+
+
+def _movie_genre_ids(movie_id):
+    return list(MovieGenre.objects.filter(movie_id=movie_id).values_list('genre_id', flat=True))
+
+
+def _bump_genres(user_id, genre_ids, count_delta, sum_delta):
+    for genre_id in genre_ids:
+        _increment(UserGenreStats, {'user_id': user_id, 'genre_id': genre_id},
+                   {'rating_count': count_delta, 'rating_sum': sum_delta}, create=count_delta > 0)
+    if count_delta < 0:
+        UserGenreStats.objects.filter(user_id=user_id, rating_count__lte=0).delete()
+
+
+def refresh_favourites(user_ids):
+    """Recompute the stored favourite genres: those a user gave the most stars"""
+    for user_id in user_ids:
+        names = (UserGenreStats.objects.filter(user_id=user_id, rating_count__gt=0)
+                 .order_by('-rating_sum', '-rating_count', 'genre__name')
+                 .values_list('genre__name', flat=True)[:FAVOURITE_GENRES])
+        UserRatingStats.objects.filter(user_id=user_id).update(favourite_genres=list(names))
+
+
+def rating_added(rating):
+    score = int(rating.score)
+    with transaction.atomic():
+        _increment(UserRatingStats, {'user_id': rating.user_id},
+                   {'rating_count': 1, 'rating_sum': score, f'score_{score}': 1},
+                   last_rated_at=rating.updated_at)
+        _bump_genres(rating.user_id, _movie_genre_ids(rating.movie_id), 1, score)
+        refresh_favourites([rating.user_id])
+
+
+def rating_changed(rating, previous):
+    score = int(rating.score)
+    deltas = {'rating_sum': score - previous}
+    if score != previous:
+        deltas[f'score_{previous}'] = -1
+        deltas[f'score_{score}'] = 1
+    with transaction.atomic():
+        _increment(UserRatingStats, {'user_id': rating.user_id}, deltas, create=False,
+                   last_rated_at=rating.updated_at)
+        if score != previous:
+            _bump_genres(rating.user_id, _movie_genre_ids(rating.movie_id), 0, score - previous)
+            refresh_favourites([rating.user_id])
+
+
+def rating_removed(user_id, movie_id, score, genre_ids=None):
+    """Remove a deleted rating; genre_ids is given when the movie's genres are already gone"""
+    latest = Rating.all_objects.filter(user_id=OuterRef('user_id')).order_by('-updated_at').values('updated_at')[:1]
+    with transaction.atomic():
+        # Never creates rows: a missing one belongs to a user being deleted
+        _increment(UserRatingStats, {'user_id': user_id},
+                   {'rating_count': -1, 'rating_sum': -score, f'score_{score}': -1}, create=False,
+                   last_rated_at=Subquery(latest))
+        _bump_genres(user_id, _movie_genre_ids(movie_id) if genre_ids is None else genre_ids, -1, -score)
+        refresh_favourites([user_id])
+
+
+def movie_genres_changed(movie_ids, genre_ids, sign):
+    """Move the ratings of movies into (sign=1) or out of (sign=-1) genres"""
+    totals = (Rating.all_objects.filter(movie_id__in=movie_ids).values('user_id')
+              .annotate(n=Count('pk'), total=Sum('score')).order_by())
+    user_ids = []
+    with transaction.atomic():
+        for row in totals:
+            _bump_genres(row['user_id'], genre_ids, sign * row['n'], sign * row['total'])
+            user_ids.append(row['user_id'])
+        refresh_favourites(user_ids)
+
+
+def populate(rating_model, stats_model, genre_stats_model, user_ids=None):
+    """
+    Recompute stats rows from the ratings, for the given users or everyone.
+    Hidden ratings still count until they are purged (see api.deletion).
+    """
+    ratings = rating_model._base_manager.all()
+    stats = stats_model.objects.all()
+    genre_stats = genre_stats_model.objects.all()
+    if user_ids is not None:
+        ratings = ratings.filter(user_id__in=user_ids)
+        stats = stats.filter(user_id__in=user_ids)
+        genre_stats = genre_stats.filter(user_id__in=user_ids)
+    stats.delete()
+    genre_stats.delete()
+
+    totals = ratings.values('user_id').annotate(
+        n=Count('pk'), total=Sum('score'), last=Max('updated_at'),
+        **{f'score_{score}': Count('pk', filter=Q(score=score)) for score in SCORES},
+    ).order_by()
+    stats_model.objects.bulk_create((
+        stats_model(user_id=row['user_id'], rating_count=row['n'], rating_sum=row['total'],
+                    last_rated_at=row['last'], **{f'score_{score}': row[f'score_{score}'] for score in SCORES})
+        for row in totals.iterator(chunk_size=2000)
+    ), batch_size=500)
+
+    by_genre = (ratings.filter(movie__genres__isnull=False).values('user_id', 'movie__genres')
+                .annotate(n=Count('pk'), total=Sum('score')).order_by())
+    genre_stats_model.objects.bulk_create((
+        genre_stats_model(user_id=row['user_id'], genre_id=row['movie__genres'],
+                          rating_count=row['n'], rating_sum=row['total'])
+        for row in by_genre.iterator(chunk_size=2000)
+    ), batch_size=500)
+
+    favourites = defaultdict(list)
+    ranked = genre_stats.order_by('user_id', '-rating_sum', '-rating_count', 'genre__name')
+    for user_id, name in ranked.values_list('user_id', 'genre__name').iterator(chunk_size=2000):
+        if len(favourites[user_id]) < FAVOURITE_GENRES:
+            favourites[user_id].append(name)
+    stats_model.objects.bulk_update(
+        [stats_model(user_id=user_id, favourite_genres=names) for user_id, names in favourites.items()],
+        ['favourite_genres'], batch_size=500,
+    )
+
+
+def recount_user(user_id):
+    """Recompute one user's stats when the size of a change is unknown"""
+    with transaction.atomic():
+        populate(Rating, UserRatingStats, UserGenreStats, [user_id])
+
+
+def rebuild():
+    """Recompute every user's stats from scratch"""
+    with transaction.atomic():
+        populate(Rating, UserRatingStats, UserGenreStats)
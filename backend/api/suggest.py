@@ -0,0 +1,325 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db.models import Max, Q
+
+from .models import Movie
+from .text import normalize_text, split_names
+
+
+# Upper bound for normalized keys, sorts after every real continuation
+KEY_END = '\U0010ffff'
+
+
+def title_keys(title, aka=None, max_word_starts=4):
+    """
+    Normalized index keys for a movie: the full title, the title from each
+    of its next few words on (so "matrix" finds "The Matrix"), and every
+    alternative title.
+    """
+    keys = []
+    normalized = normalize_text(title)
+    if normalized:
+        keys.append(normalized)
+        words = normalized.split(' ')
+        for i in range(1, min(len(words), max_word_starts)):
+            keys.append(' '.join(words[i:]))
+    for name in split_names(aka):
+        keys.append(normalize_text(name))
+    return tuple(dict.fromkeys(key for key in keys if key))
+
+
+class PrefixIndex:
+    """
+    In-memory typeahead index: a sorted array of normalized keys with a
+    parallel array of movie ids, searched with bisect. Matches are ranked
+    by popularity (number of ratings). Top-k results for wide prefixes,
+    whose key ranges are too long to rank per query, are precomputed when
+    the index is loaded and kept up to date as movies change.
+    """
+
+    def __init__(self, top_k=10, wide_range=128, rebuild_edits=128):
+        self.top_k = top_k
+        self.wide_range = wide_range
+        self.rebuild_edits = rebuild_edits
+        self._keys = []
+        self._ids = []
+        self._movies = {}  # id -> [title, release_year, popularity, keys]
+        self._top = {}  # wide prefix -> ids, most popular first
+        self._lock = threading.RLock()
+        self.watermark = None
+        self.refreshed_at = 0.0
+
+    def __len__(self):
+        return len(self._movies)
+
+    def load(self, rows):
+        """Replace the contents with (id, title, aka, release_year, popularity) rows"""
+        movies = {}
+        entries = []
+        for movie_id, title, aka, release_year, popularity in rows:
+            keys = title_keys(title, aka)
+            movies[movie_id] = [title, release_year, popularity, keys]
+            entries.extend((key, movie_id) for key in keys)
+        entries.sort()
+        with self._lock:
+            self._movies = movies
+            self._keys = [key for key, _ in entries]
+            self._ids = [movie_id for _, movie_id in entries]
+            self._top = {}
+            if len(self._keys) > self.wide_range:
+                self._build_top(0, len(self._keys), 0, '')
+
+    def _build_top(self, lo, hi, depth, prefix):
+        """
+        Cache the top-k for prefix, whose keys are keys[lo:hi], and for every
+        wide prefix below it. Each node merges its children's top-k lists,
+        so every key is ranked only once, in the narrow range it falls in.
+        """
+        keys = self._keys
+        candidates = []
+        i = lo
+        while i < hi and len(keys[i]) == depth:
+            # The prefix itself is a key, and sorts first
+            candidates.append(self._ids[i])
+            i += 1
+        while i < hi:
+            child = keys[i][:depth + 1]
+            j = bisect_left(keys, child + KEY_END, i, hi)
+            if j - i > self.wide_range:
+                candidates.extend(self._build_top(i, j, depth + 1, child))
+            else:
+                candidates.extend(self._ids[i:j])
+            i = j
+        top = self._top[prefix] = heapq.nlargest(self.top_k, set(candidates), key=self._popularity)
+        return top
+
+    def _popularity(self, movie_id):
+        return self._movies[movie_id][2]
+
+    def _cached_prefixes(self, keys):
+        return {key[:n] for key in keys for n in range(1, len(key) + 1) if key[:n] in self._top}
+
+    def _position(self, key, movie_id):
+        i = bisect_left(self._keys, key)
+        while self._ids[i] != movie_id:
+            i += 1
+        return i
+
+    def _edit_keys(self, dropped, added):
+        """
+        Remove the {id: keys} in dropped and insert the (key, id) pairs in
+        added. Every position is found with bisect first. A few edits are
+        applied in place, last position first; past rebuild_edits, both
+        arrays are rebuilt once from the runs in between, which costs one
+        copy of the arrays instead of one shift per key.
+        """
+        keys, ids = self._keys, self._ids
+        edits = [(self._position(key, movie_id), 1, key, movie_id)
+                 for movie_id, old_keys in dropped.items() for key in old_keys]
+        # Insertions sort before a removal at the same position, and by key among themselves
+        edits.extend((bisect_left(keys, key), 0, key, movie_id) for key, movie_id in added)
+        edits.sort()
+        if len(edits) <= self.rebuild_edits:
+            for i, removal, key, movie_id in reversed(edits):
+                if removal:
+                    del keys[i]
+                    del ids[i]
+                else:
+                    keys.insert(i, key)
+                    ids.insert(i, movie_id)
+            return
+        new_keys, new_ids = [], []
+        start = 0
+        for i, removal, key, movie_id in edits:
+            new_keys += keys[start:i]
+            new_ids += ids[start:i]
+            if removal:
+                start = i + 1
+            else:
+                start = i
+                new_keys.append(key)
+                new_ids.append(movie_id)
+        new_keys += keys[start:]
+        new_ids += ids[start:]
+        self._keys, self._ids = new_keys, new_ids
+
+    def _withdraw(self, movie_id, keys):
+        # Cached lists holding the movie need a rescan to find its replacement
+        for prefix in self._cached_prefixes(keys):
+            top = self._top.get(prefix)
+            if top is not None and movie_id in top:
+                del self._top[prefix]
+
+    def _offer(self, movie_id, keys):
+        # Place the movie into cached lists it now ranks in
+        popularity = self._popularity(movie_id)
+        for prefix in self._cached_prefixes(keys):
+            top = self._top.get(prefix)
+            if top is None:
+                continue
+            if movie_id in top or len(top) < self.top_k or popularity > self._popularity(top[-1]):
+                if movie_id not in top:
+                    top.append(movie_id)
+                top.sort(key=self._popularity, reverse=True)
+                del top[self.top_k:]
+
+    def update(self, rows, removed=()):
+        """
+        Add or replace (id, title, aka, release_year, popularity) rows and
+        drop the removed ids in one batch; popularity=None keeps the indexed
+        value. Movies whose keys are unchanged only have their rank moved.
+        """
+        dropped = {}
+        added = []
+        offered = []
+        with self._lock:
+            for movie_id, title, aka, release_year, popularity in rows:
+                keys = title_keys(title, aka)
+                old = self._movies.get(movie_id)
+                if old is not None:
+                    if popularity is None:
+                        popularity = old[2]
+                    if old[3] == keys and popularity == old[2]:
+                        old[0], old[1] = title, release_year
+                        continue
+                    if old[3] != keys or popularity < old[2]:
+                        self._withdraw(movie_id, old[3])
+                    if old[3] != keys:
+                        dropped[movie_id] = old[3]
+                        added.extend((key, movie_id) for key in keys)
+                else:
+                    added.extend((key, movie_id) for key in keys)
+                self._movies[movie_id] = [title, release_year, popularity or 0, keys]
+                offered.append(movie_id)
+            for movie_id in removed:
+                old = self._movies.pop(movie_id, None)
+                if old is not None:
+                    self._withdraw(movie_id, old[3])
+                    dropped[movie_id] = old[3]
+            if dropped or added:
+                self._edit_keys(dropped, added)
+            for movie_id in offered:
+                if movie_id in self._movies:
+                    self._offer(movie_id, self._movies[movie_id][3])
+
+    def upsert(self, movie_id, title, aka, release_year, popularity=None):
+        """Add or replace a movie; popularity=None keeps the indexed value"""
+        self.update([(movie_id, title, aka, release_year, popularity)])
+
+    def remove(self, movie_id):
+        self.update([], [movie_id])
+
+    def bump_popularity(self, movie_id, delta):
+        with self._lock:
+            movie = self._movies.get(movie_id)
+            if movie is None:
+                return
+            if delta < 0:
+                self._withdraw(movie_id, movie[3])
+            movie[2] += delta
+            if delta > 0:
+                self._offer(movie_id, movie[3])
+
+    def _scan(self, lo, hi, limit):
+        return heapq.nlargest(limit, set(self._ids[lo:hi]), key=self._popularity)
+
+    def search(self, query, limit=None):
+        """Movies whose title or alternative title starts with query, most popular first"""
+        limit = min(limit or self.top_k, self.top_k)
+        key = normalize_text(query)
+        if not key:
+            return []
+        with self._lock:
+            ids = self._top.get(key)
+            if ids is None:
+                lo = bisect_left(self._keys, key)
+                hi = bisect_left(self._keys, key + KEY_END, lo)
+                if hi - lo > self.wide_range:
+                    # Cached list was dropped by an update; rebuild it once
+                    ids = self._top[key] = self._scan(lo, hi, self.top_k)
+                else:
+                    ids = self._scan(lo, hi, limit)
+            return [
+                {'id': movie_id, 'title': self._movies[movie_id][0],
+                 'release_year': self._movies[movie_id][1], 'ratings_count': self._movies[movie_id][2]}
+                for movie_id in ids[:limit]
+            ]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _movie_rows(queryset):
+    return queryset.values_list('id', 'title', 'aka', 'release_year', 'rating_count').iterator(chunk_size=5000)
+
+
+def _latest_change(queryset):
+    # Edits move updated_at, rating writes move popularity_updated_at
+    latest = queryset.aggregate(edited=Max('updated_at'), rated=Max('popularity_updated_at'))
+    return max((value for value in latest.values() if value is not None), default=None)
+
+
+def get_index():
+    """
+    The process-wide index, built from the database on first use and
+    topped up with movies changed by other workers every
+    SUGGEST_INDEX_REFRESH_SECONDS. Changes made by this worker arrive
+    immediately through api.signals.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            index = PrefixIndex(top_k=getattr(settings, 'SUGGEST_TOP_K', 10))
+            index.watermark = _latest_change(Movie.all_objects.all())
+            index.load(_movie_rows(Movie.objects.all()))
+            index.refreshed_at = time.monotonic()
+            _index = index
+            return _index
+        index = _index
+        if time.monotonic() - index.refreshed_at < getattr(settings, 'SUGGEST_INDEX_REFRESH_SECONDS', 30):
+            return index
+        index.refreshed_at = time.monotonic()
+
+    changed = Movie.all_objects.all()
+    if index.watermark is not None:
+        changed = changed.filter(Q(updated_at__gt=index.watermark) | Q(popularity_updated_at__gt=index.watermark))
+    index.update(list(_movie_rows(changed.filter(deleted_at__isnull=True))),
+                 list(changed.filter(deleted_at__isnull=False).values_list('pk', flat=True)))
+    latest = _latest_change(changed)
+    if latest is not None:
+        index.watermark = latest
+    return index
+
+
+def built_index():
+    """The index if this process has built it, else None (nothing to maintain)"""
+    return _index
+
+
+def reset_index():
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def on_movie_saved(movie, popularity=None):
+    index = built_index()
+    if index is not None:
+        index.upsert(movie.pk, movie.title, movie.aka, movie.release_year, popularity)
+
+
+def on_movie_deleted(movie_id):
+    index = built_index()
+    if index is not None:
+        index.remove(movie_id)
+
+
+def on_rating_count_changed(movie_id, delta):
+    index = built_index()
+    if index is not None:
+        index.bump_popularity(movie_id, delta)
@@ -1,11 +1,48 @@
-from django.test import TestCase
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.contrib.admin import site as admin_site
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
 from rest_framework.test import APITestCase, APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework import status
-from .models import Movie, Rating
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.db import connection, router
+from django.http import HttpResponse
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from . import coalesce, deletion, duplicates, facets, rollups
+from .admin import MovieAdmin
+from .live import RatingBroker, broker
+from .middleware import ReplicaRoutingMiddleware, STICKY_COOKIE, choose_encoding, payload_cache
+from .poster_proxy import ConnectionPool, PosterCache, PosterProxyBusy, cached_poster, proxy_url
+from .models import (Genre, IdempotencyKey, Movie, Person, Rating, RatingRollup, UserDeletion, UserGenreStats,
+                     UserRatingStats)
+from .routing import PRIMARY, RoutingState, current_state, query_metrics
+from .pagination import ApproximateCountPaginator, estimated_row_count
+from .schema import generate_schema, schema_cache
+from .startup import measure_startup, parse_importtime
+from .suggest import PrefixIndex, reset_index
+from .text import split_names
+from asgiref.sync import async_to_sync, sync_to_async
 from PIL import Image
+import asyncio
+import gzip
 import io
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
 
 class UserAuthenticationTestCase(APITestCase):
@@ -210,6 +247,58 @@ class RatingTestCase(APITestCase):
         response = self.client.post(self.rating_url, data)
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
+    def test_movie_cannot_be_changed(self):
+        """Test a movie in the body is ignored, so ratings and aggregates stay on the movie in the URL"""
+        other = Movie.objects.create(title='Other Movie', description='Description', release_year=2023,
+                                     genre='Drama', director='Director', created_by=self.user1)
+        self.client.force_authenticate(user=self.user1)
+        self.client.post(self.rating_url, {'score': 5})
+        response = self.client.post(self.rating_url, {'score': 3, 'movie': other.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['movie'], self.movie.id)
+        self.movie.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.movie.rating_count, self.movie.rating_sum), (1, 3))
+        self.assertEqual((other.rating_count, other.rating_sum), (0, 0))
+        self.assertEqual(list(UserGenreStats.objects.filter(user=self.user1).values_list('genre__name', flat=True)),
+                         ['Action'])
+        self.assertEqual(UserRatingStats.objects.get(pk=self.user1.pk).rating_sum, 3)
+
+    def test_invalid_score_rejected(self):
+        """Test out of range and non-numeric scores are rejected before anything is saved"""
+        self.client.force_authenticate(user=self.user1)
+        for score in (0, 6, 'abc'):
+            response = self.client.post(self.rating_url, {'score': score})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, score)
+            self.assertIn('score', response.data)
+        self.assertFalse(Rating.objects.filter(movie=self.movie).exists())
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.rating_count, 0)
+
+    def test_missing_score_rejected_on_create(self):
+        """Test a first rating without a score is a 400, not an integrity error"""
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.post(self.rating_url, {'comment': 'No score'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('score', response.data)
+        self.assertFalse(Rating.objects.filter(movie=self.movie).exists())
+
+    def test_invalid_score_rejected_on_update(self):
+        """Test an out of range score leaves an existing rating and the aggregates alone"""
+        self.client.force_authenticate(user=self.user1)
+        self.client.post(self.rating_url, {'score': 4})
+        response = self.client.post(self.rating_url, {'score': 9})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('score', response.data)
+        self.assertEqual(Rating.objects.get(movie=self.movie, user=self.user1).score, 4)
+        self.movie.refresh_from_db()
+        self.assertEqual((self.movie.rating_count, self.movie.rating_sum), (1, 4))
+
+        # A comment-only update keeps the score
+        response = self.client.post(self.rating_url, {'comment': 'Still good'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['score'], 4)
+
     def test_update_rating(self):
         """Test user can update their own rating"""
         self.client.force_authenticate(user=self.user1)
@@ -311,3 +400,1703 @@ class MovieImageUploadTestCase(APITestCase):
         self.assertIsNotNone(response.data.get('poster_image'))
         self.assertTrue('posters/' in response.data['poster_image'])
 
+
+class ResponseCompressionTestCase(APITestCase):
+    """Test content-negotiated compression of JSON responses"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        for i in range(10):
+            Movie.objects.create(
+                title=f'Movie {i}',
+                description='A long description ' * 20,
+                release_year=2000 + i,
+                genre='Drama',
+                director='Director',
+                created_by=self.user
+            )
+
+    def test_large_json_is_gzipped(self):
+        """Test large JSON responses are gzipped when the client accepts it"""
+        response = self.client.get('/api/movies/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        body = json.loads(gzip.decompress(response.content))
+        self.assertEqual(len(body['results']), 10)
+
+    def test_refused_codings_skipped(self):
+        """Test codings refused with q=0 are never chosen and the highest q-value wins"""
+        response = self.client.get('/api/movies/', HTTP_ACCEPT_ENCODING='gzip;q=0, deflate')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        with mock.patch('api.middleware.brotli', object()):
+            self.assertEqual(choose_encoding('br;q=0, gzip'), 'gzip')
+            self.assertEqual(choose_encoding('gzip, br'), 'br')
+            self.assertEqual(choose_encoding('br;q=0.5, gzip;q=0.8'), 'gzip')
+            self.assertEqual(choose_encoding('*;q=0.1, br;q=0'), 'gzip')
+            self.assertIsNone(choose_encoding('gzip;q=0.0, br;q=0, identity'))
+            self.assertIsNone(choose_encoding('gzip;q=bad'))
+
+    def test_no_compression_without_accept_encoding(self):
+        """Test responses are left alone when the client does not accept gzip"""
+        response = self.client.get('/api/movies/')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(len(response.json()['results']), 10)
+
+    def test_small_json_is_not_compressed(self):
+        """Test responses below the size threshold are not compressed"""
+        response = self.client.get('/api/movies/?search=nothing-matches', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    @override_settings(COMPRESSION_CACHE_MIN_LENGTH=0)
+    def test_repeated_payload_served_from_cache(self):
+        """Test large repeated payloads are compressed once and cached"""
+        payload_cache.clear()
+        first = self.client.get('/api/movies/', HTTP_ACCEPT_ENCODING='gzip')
+        cached_size = payload_cache.size
+        self.assertGreater(cached_size, 0)
+        second = self.client.get('/api/movies/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(payload_cache.size, cached_size)
+
+
+class MediaServingTestCase(APITestCase):
+    """Test media files are served with range and conditional support"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        os.makedirs(os.path.join(self.media_root, 'posters'))
+        self.data = bytes(range(256)) * 4
+        self.name = 'posters/poster.0123456789ab.png'
+        with open(os.path.join(self.media_root, self.name), 'wb') as f:
+            f.write(self.data)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.url = f'/media/{self.name}'
+
+    def test_full_file(self):
+        """Test a full media file is served with long-lived cache headers"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_range_request(self):
+        """Test a byte range request returns partial content"""
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), self.data[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.data)}')
+
+    def test_unsatisfiable_range(self):
+        """Test an out of bounds range is rejected"""
+        response = self.client.get(self.url, HTTP_RANGE='bytes=5000-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+    def test_conditional_request(self):
+        """Test a matching ETag returns 304 Not Modified"""
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_path_traversal_rejected(self):
+        """Test paths outside MEDIA_ROOT are not served"""
+        response = self.client.get('/media/../manage.py')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_unhashed_name_gets_short_cache(self):
+        """Test files without a content hash are not cached forever"""
+        with open(os.path.join(self.media_root, 'posters', 'plain.png'), 'wb') as f:
+            f.write(self.data)
+        response = self.client.get('/media/posters/plain.png')
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+
+class OpenAPISchemaTestCase(APITestCase):
+    """Test the OpenAPI schema is generated once and served from memory"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        override = override_settings(OPENAPI_SCHEMA_FILE=os.path.join(self.tmpdir, 'openapi.json'))
+        override.enable()
+        self.addCleanup(override.disable)
+        schema_cache.clear()
+        self.addCleanup(schema_cache.clear)
+
+    def test_schema_generated_once(self):
+        """Test repeated schema requests do not regenerate the document"""
+        with mock.patch('api.schema.generate_schema', wraps=generate_schema) as generate:
+            first = self.client.get('/swagger.json')
+            second = self.client.get('/swagger/?format=openapi')
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertIn('/movies/', json.loads(first.content)['paths'])
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(generate.call_count, 1)
+
+    def test_etag_not_modified(self):
+        """Test a matching ETag returns 304 Not Modified"""
+        etag = self.client.get('/swagger.json')['ETag']
+        response = self.client.get('/swagger.json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get('/swagger.json', HTTP_IF_NONE_MATCH=f'"other", W/{etag}')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        # Only whole tags match, not substrings of one
+        response = self.client.get('/swagger.json', HTTP_IF_NONE_MATCH=f'"x{etag[1:-1]}x"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_artifact_served_when_up_to_date(self):
+        """Test the pre-generated schema file is served without generating"""
+        call_command('generate_openapi_schema', stdout=io.StringIO())
+        with mock.patch('api.schema.generate_schema') as generate:
+            response = self.client.get('/swagger.json')
+        generate.assert_not_called()
+        self.assertIn('/movies/', json.loads(response.content)['paths'])
+
+    def test_stale_artifact_ignored(self):
+        """Test a schema file built from other code is not served"""
+        with open(os.path.join(self.tmpdir, 'openapi.json'), 'w') as f:
+            f.write('{"stale": true}')
+        with open(os.path.join(self.tmpdir, 'openapi.json.fingerprint'), 'w') as f:
+            f.write('outdated')
+        response = self.client.get('/swagger.json')
+        self.assertNotIn('stale', json.loads(response.content))
+
+    def test_ui_page(self):
+        """Test the Swagger UI page still renders"""
+        response = self.client.get('/swagger/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class StartupTimeTestCase(TestCase):
+    """Test workers only import what their server role needs, within budget"""
+
+    def assertImported(self, package, profile):
+        self.assertTrue(any(m == package or m.startswith(package + '.') for m in profile.modules), package)
+
+    def assertNotImported(self, package, profile):
+        self.assertFalse(any(m == package or m.startswith(package + '.') for m in profile.modules), package)
+
+    def test_api_role_startup(self):
+        """Test API workers skip the admin and docs apps and stay within budget"""
+        profile = measure_startup('api')
+        self.assertImported('api.views', profile)
+        self.assertNotImported('drf_yasg', profile)
+        self.assertNotImported('api.admin', profile)
+        self.assertNotImported('PIL', profile)
+        self.assertLess(profile.total_ms, settings.STARTUP_IMPORT_BUDGET_MS['api'])
+
+    def test_worker_role_startup(self):
+        """Test command workers load no web-facing apps and stay within budget"""
+        profile = measure_startup('worker')
+        self.assertNotImported('api.views', profile)
+        self.assertNotImported('corsheaders', profile)
+        self.assertNotImported('drf_yasg', profile)
+        self.assertLess(profile.total_ms, settings.STARTUP_IMPORT_BUDGET_MS['worker'])
+
+    def test_docs_role_startup(self):
+        """Test docs workers load drf_yasg, do not generate the schema at startup, and document every API path"""
+        profile = measure_startup('docs')
+        self.assertImported('drf_yasg', profile)
+        self.assertNotImported('api.admin', profile)
+        self.assertLess(profile.total_ms, settings.STARTUP_IMPORT_BUDGET_MS['docs'])
+        # Docs workers do not mount the API URLconf, so generate their schema in one
+        result = subprocess.run(
+            [sys.executable, '-c', 'import django, json; django.setup(); from api.schema import generate_schema; '
+                                   'schema = generate_schema(); print(json.dumps([schema["basePath"], list(schema["paths"])]))'],
+            cwd=settings.BASE_DIR, env={**os.environ, 'DJANGO_SERVER_ROLES': 'docs'},
+            capture_output=True, text=True, check=True,
+        )
+        base_path, paths = json.loads(result.stdout.strip().splitlines()[-1])
+        self.assertEqual(base_path, '/api')
+        self.assertIn('/movies/', paths)
+        self.assertIn('/movies/{movie_id}/ratings/', paths)
+
+    def test_parse_importtime(self):
+        """Test top level cumulative times are summed"""
+        output = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       100 |        100 |   child\n'
+            'import time:       200 |        300 | parent\n'
+            'import time:       500 |        500 | other\n'
+        )
+        profile = parse_importtime(output)
+        self.assertEqual(profile.total_ms, 0.8)
+        self.assertEqual(profile.modules['child'], 0.1)
+
+
+class AdminChangelistTestCase(TestCase):
+    """Test admin changelists stay cheap as tables grow"""
+
+    def setUp(self):
+        cache.clear()
+        self.admin_user = User.objects.create_superuser(username='admin', password='adminpass123')
+        self.client.force_login(self.admin_user)
+        self.movie = Movie.objects.create(
+            title='Test Movie',
+            description='Description',
+            release_year=2023,
+            genre='Action',
+            director='Director',
+            created_by=self.admin_user
+        )
+
+    def add_ratings(self, count):
+        start = User.objects.count()
+        users = User.objects.bulk_create(
+            [User(username=f'rater{start + i}') for i in range(count)]
+        )
+        Rating.objects.bulk_create([Rating(movie=self.movie, user=u, score=3) for u in users])
+
+    def count_changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(ctx)
+
+    def test_rating_changelist_queries_constant(self):
+        """Test the rating changelist does not run queries per row"""
+        self.add_ratings(3)
+        self.client.get('/admin/api/rating/')  # warm the filter choice cache
+        few = self.count_changelist_queries('/admin/api/rating/')
+        self.add_ratings(20)
+        many = self.count_changelist_queries('/admin/api/rating/')
+        self.assertEqual(few, many)
+
+    def test_filter_choices_cached(self):
+        """Test list filter choices are served from the cache"""
+        self.client.get('/admin/api/movie/')
+        self.assertEqual(cache.get('admin-filter-choices:api.movie:genre'), ['Action'])
+
+    def test_estimated_row_count(self):
+        """Test the estimate comes from sqlite_stat1 once the table is analyzed"""
+        self.add_ratings(5)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.assertEqual(estimated_row_count(Rating), 5)
+
+    def test_estimated_row_count_postgres(self):
+        """Test the Postgres estimate looks the table up by its search_path-resolved oid, not by name"""
+        cursor = mock.MagicMock()
+        cursor.__enter__.return_value.fetchone.return_value = (42,)
+        with mock.patch.object(connection, 'vendor', 'postgresql'), mock.patch.object(connection, 'cursor', return_value=cursor):
+            self.assertEqual(estimated_row_count(Rating), 42)
+        sql, params = cursor.__enter__.return_value.execute.call_args.args
+        self.assertIn('oid = %s::regclass', sql)
+        self.assertEqual(params, ['"api_rating"'])
+
+    def test_approximate_paginator(self):
+        """Test unfiltered querysets use the estimate and filtered ones count exactly"""
+        self.add_ratings(5)
+        paginator = ApproximateCountPaginator(Rating.objects.all(), 10)
+        paginator.approximate_threshold = 1
+        with mock.patch('api.pagination.estimated_row_count', return_value=1000000):
+            self.assertEqual(paginator.count, 1000000)
+            filtered = ApproximateCountPaginator(Rating.objects.filter(score=3), 10)
+            filtered.approximate_threshold = 1
+            self.assertEqual(filtered.count, 5)
+
+
+class GenrePersonTestCase(APITestCase):
+    """Test normalized genre/person relations and the filters built on them"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.movies_url = '/api/movies/'
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.matrix = Movie.objects.create(
+            title='The Matrix',
+            description='Description',
+            release_year=1999,
+            genre='Action, Sci-Fi',
+            director='Lana Wachowski, Lilly Wachowski',
+            actors='Keanu Reeves, Carrie-Anne Moss',
+            created_by=self.user
+        )
+        self.speed = Movie.objects.create(
+            title='Speed',
+            description='Description',
+            release_year=1994,
+            genre='Action',
+            director='Jan de Bont',
+            actors='Keanu Reeves, Sandra Bullock',
+            created_by=self.user
+        )
+
+    def test_split_names(self):
+        """Test free-text lists are split and deduplicated"""
+        self.assertEqual(split_names('Action/ Sci-Fi, action'), ['Action', 'Sci-Fi'])
+        self.assertEqual(split_names(None), [])
+
+    def test_relations_synced_on_save(self):
+        """Test saving a movie keeps its genres, directors and cast in sync"""
+        self.assertEqual(sorted(g.name for g in self.matrix.genres.all()), ['Action', 'Sci-Fi'])
+        self.assertEqual(self.matrix.directors.count(), 2)
+        self.assertEqual(Person.objects.filter(normalized_name='keanu reeves').count(), 1)
+
+        self.matrix.actors = 'Keanu Reeves'
+        self.matrix.save()
+        self.assertEqual([p.name for p in self.matrix.cast.all()], ['Keanu Reeves'])
+
+    def test_filter_by_actor(self):
+        """Test ?actor= matches movies case-insensitively through the index"""
+        response = self.client.get(self.movies_url, {'actor': 'keanu  REEVES'})
+        self.assertEqual({m['title'] for m in response.data['results']}, {'The Matrix', 'Speed'})
+        response = self.client.get(self.movies_url, {'actor': 'Sandra Bullock'})
+        self.assertEqual([m['title'] for m in response.data['results']], ['Speed'])
+
+    def test_filter_by_genre_and_director(self):
+        """Test ?genre= and ?director= can be combined"""
+        response = self.client.get(self.movies_url, {'genre': 'sci-fi'})
+        self.assertEqual([m['title'] for m in response.data['results']], ['The Matrix'])
+        response = self.client.get(self.movies_url, {'genre': 'Action', 'director': 'Jan de Bont'})
+        self.assertEqual([m['title'] for m in response.data['results']], ['Speed'])
+
+
+class MovieFacetsTestCase(APITestCase):
+    """Test incrementally maintained facet counts"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user1 = User.objects.create_user(username='user1', password='pass123')
+        self.user2 = User.objects.create_user(username='user2', password='pass123')
+        self.facets_url = '/api/movies/facets/'
+        self.matrix = self.create_movie('The Matrix', 1999, 'Action, Sci-Fi')
+        self.speed = self.create_movie('Speed', 1994, 'Action')
+        self.heat = self.create_movie('Heat', 1995, 'Crime')
+
+    def create_movie(self, title, year, genre):
+        return Movie.objects.create(
+            title=title,
+            description='Description',
+            release_year=year,
+            genre=genre,
+            director='Director',
+            created_by=self.user1
+        )
+
+    def get_facets(self, **params):
+        response = self.client.get(self.facets_url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_counts_after_create(self):
+        """Test new movies are counted by genre, decade and score band"""
+        data = self.get_facets()
+        self.assertEqual(data['genre'], {'Action': 2, 'Sci-Fi': 1, 'Crime': 1})
+        self.assertEqual(data['decade'], {'1990s': 3})
+        self.assertEqual(data['score'], {'unrated': 3})
+
+    def test_counts_follow_ratings(self):
+        """Test rating writes move movies between score bands"""
+        Rating.objects.create(movie=self.matrix, user=self.user1, score=5)
+        rating = Rating.objects.create(movie=self.matrix, user=self.user2, score=4)
+        Rating.objects.create(movie=self.speed, user=self.user1, score=2)
+        self.assertEqual(self.get_facets()['score'], {'4-5': 1, '2-3': 1, 'unrated': 1})
+
+        rating.score = 1
+        rating.save()
+        self.assertEqual(self.get_facets()['score'], {'3-4': 1, '2-3': 1, 'unrated': 1})
+        self.matrix.refresh_from_db()
+        self.assertEqual(self.matrix.ratings_count, 2)
+        self.assertEqual(self.matrix.average_rating, 3)
+
+        rating.delete()
+        self.assertEqual(self.get_facets()['score'], {'4-5': 1, '2-3': 1, 'unrated': 1})
+
+    def test_counts_follow_movie_updates_and_deletes(self):
+        """Test editing and deleting movies keeps the counts in sync"""
+        Rating.objects.create(movie=self.heat, user=self.user2, score=5)
+        self.speed.release_year = 2004
+        self.speed.genre = 'Thriller'
+        self.speed.save()
+        self.heat.delete()
+        data = self.get_facets()
+        self.assertEqual(data['genre'], {'Action': 1, 'Sci-Fi': 1, 'Thriller': 1})
+        self.assertEqual(data['decade'], {'1990s': 1, '2000s': 1})
+        self.assertEqual(data['score'], {'unrated': 2})
+
+    def test_scoped_by_search(self):
+        """Test counts can be scoped to the current search"""
+        data = self.get_facets(search='Matrix')
+        self.assertEqual(data['genre'], {'Action': 1, 'Sci-Fi': 1})
+        self.assertEqual(data['decade'], {'1990s': 1})
+
+    def test_rebuild_matches_incremental(self):
+        """Test a full rebuild produces the same counts"""
+        Rating.objects.create(movie=self.matrix, user=self.user1, score=3)
+        before = self.get_facets()
+        call_command('rebuild_facets', stdout=io.StringIO())
+        self.assertEqual(self.get_facets(), before)
+
+
+class MovieSuggestTestCase(APITestCase):
+    """Test the title typeahead endpoint"""
+
+    def setUp(self):
+        reset_index()
+        self.addCleanup(reset_index)
+        self.client = APIClient()
+        self.user1 = User.objects.create_user(username='user1', password='pass123')
+        self.user2 = User.objects.create_user(username='user2', password='pass123')
+        self.suggest_url = '/api/movies/suggest/'
+        self.matrix = self.create_movie('The Matrix', 1999, aka='Matriks')
+        self.reloaded = self.create_movie('The Matrix Reloaded', 2003)
+        self.amelie = self.create_movie('Amélie', 2001)
+        Rating.objects.create(movie=self.reloaded, user=self.user1, score=4)
+
+    def create_movie(self, title, year, aka=None):
+        return Movie.objects.create(
+            title=title,
+            description='Description',
+            release_year=year,
+            genre='Drama',
+            director='Director',
+            aka=aka,
+            created_by=self.user1
+        )
+
+    def suggest(self, q, **params):
+        response = self.client.get(self.suggest_url, {'q': q, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [movie['title'] for movie in response.data]
+
+    def test_matches_title_word_and_aka_prefixes(self):
+        """Test prefixes of the title, of later words and of alternative titles match"""
+        self.assertEqual(self.suggest('the mat'), ['The Matrix Reloaded', 'The Matrix'])
+        self.assertEqual(self.suggest('reLOAD'), ['The Matrix Reloaded'])
+        self.assertEqual(self.suggest('matri'), ['The Matrix Reloaded', 'The Matrix'])
+        self.assertEqual(self.suggest('ame'), ['Amélie'])
+        self.assertEqual(self.suggest('x'), [])
+        self.assertEqual(self.suggest(''), [])
+
+    def test_limit(self):
+        """Test the number of suggestions can be limited"""
+        self.assertEqual(self.suggest('the', limit=1), ['The Matrix Reloaded'])
+        response = self.client.get(self.suggest_url, {'q': 'the', 'limit': 'many'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.suggest_url, {'q': 'the', 'limit': -1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_follows_writes(self):
+        """Test created, renamed, rated and deleted movies are reflected immediately"""
+        self.suggest('the')  # build the index
+        Rating.objects.create(movie=self.matrix, user=self.user1, score=5)
+        Rating.objects.create(movie=self.matrix, user=self.user2, score=5)
+        self.assertEqual(self.suggest('the'), ['The Matrix', 'The Matrix Reloaded'])
+
+        self.create_movie('The Thing', 1982)
+        self.amelie.title = 'Le Fabuleux Destin'
+        self.amelie.save()
+        self.reloaded.delete()
+        self.assertEqual(self.suggest('the'), ['The Matrix', 'The Thing'])
+        self.assertEqual(self.suggest('fab'), ['Le Fabuleux Destin'])
+        self.assertEqual(self.suggest('ame'), [])
+
+    @override_settings(SUGGEST_INDEX_REFRESH_SECONDS=0)
+    def test_catches_up_with_other_workers(self):
+        """Test rows changed without signals are picked up by the periodic refresh"""
+        self.suggest('the')
+        Movie.objects.filter(pk=self.amelie.pk).update(title='Theory', updated_at=self.amelie.updated_at.replace(year=2100))
+        self.assertIn('Theory', self.suggest('the'))
+
+    @override_settings(SUGGEST_INDEX_REFRESH_SECONDS=0)
+    def test_catches_up_with_other_workers_ratings(self):
+        """Test rating counts changed by another worker reorder suggestions on refresh"""
+        self.assertEqual(self.suggest('the'), ['The Matrix Reloaded', 'The Matrix'])
+        # What another worker's rating signal does, without touching this worker's index
+        facets.adjust_movie_ratings(self.matrix.pk, 2, 10)
+        self.assertEqual(self.suggest('the'), ['The Matrix', 'The Matrix Reloaded'])
+        # Ratings are not edits of the movie
+        self.assertEqual(Movie.objects.get(pk=self.matrix.pk).updated_at, self.matrix.updated_at)
+
+    def test_wide_prefix_lists_stay_ranked(self):
+        """Test precomputed top-k lists for wide prefixes follow popularity changes"""
+        index = PrefixIndex(top_k=2, wide_range=2)
+        index.load([(i, f'Star {i}', None, 2000, i) for i in range(6)])
+        self.assertIn('s', index._top)
+        self.assertEqual([m['id'] for m in index.search('s')], [5, 4])
+        index.bump_popularity(1, 10)
+        self.assertEqual([m['id'] for m in index.search('st')], [1, 5])
+        index.bump_popularity(1, -10)
+        index.remove(5)
+        self.assertEqual([m['id'] for m in index.search('star')], [4, 3])
+        index.upsert(9, 'Stardust', None, 2007, 7)
+        self.assertEqual([m['title'] for m in index.search('star')], ['Stardust', 'Star 4'])
+
+    def test_batch_update_matches_fresh_load(self):
+        """Test a batch of renames, additions, removals and rank changes leaves the same index as a reload"""
+        rows = [(i, f'Star {i}', 'Stern' if i % 2 else None, 2000, i) for i in range(8)]
+        changes = [(1, 'Moon 1', None, 2000, 1), (3, 'Star 3', 'Stern', 2000, 30),
+                   (7, 'Star 7', 'Stern', 2000, 0), (9, 'Stardust', 'Sternenstaub', 2007, 9)]
+        expected = PrefixIndex(top_k=3, wide_range=2)
+        expected.load([row for row in rows if row[0] not in (0, 1, 3, 4, 7)] + changes)
+        # Edited in place, and rebuilt from runs
+        for rebuild_edits in (128, 0):
+            index = PrefixIndex(top_k=3, wide_range=2, rebuild_edits=rebuild_edits)
+            index.load(rows)
+            index.update(changes, [0, 4])
+            self.assertEqual(list(zip(index._keys, index._ids)), list(zip(expected._keys, expected._ids)))
+            for query in ('s', 'st', 'star', 'stern', 'moon'):
+                self.assertEqual(index.search(query), expected.search(query), query)
+
+
+class UserRatingStatsTestCase(APITestCase):
+    """Test materialized per-user rating statistics"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user1 = User.objects.create_user(username='user1', password='pass123')
+        self.user2 = User.objects.create_user(username='user2', password='pass123')
+        self.stats_url = f'/api/users/{self.user1.id}/stats/'
+        self.matrix = self.create_movie('The Matrix', 'Action, Sci-Fi')
+        self.speed = self.create_movie('Speed', 'Action')
+        self.heat = self.create_movie('Heat', 'Crime')
+
+    def create_movie(self, title, genre):
+        return Movie.objects.create(
+            title=title,
+            description='Description',
+            release_year=1999,
+            genre=genre,
+            director='Director',
+            created_by=self.user2
+        )
+
+    def get_stats(self):
+        response = self.client.get(self.stats_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_empty_stats(self):
+        """Test users without ratings get zeroed stats and unknown users 404"""
+        data = self.get_stats()
+        self.assertEqual(data['rating_count'], 0)
+        self.assertEqual(data['histogram'], {'1': 0, '2': 0, '3': 0, '4': 0, '5': 0})
+        self.assertIsNone(data['last_rated_at'])
+        response = self.client.get('/api/users/9999/stats/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_stats_follow_rating_upserts(self):
+        """Test ratings posted through the API update count, histogram and favourites"""
+        self.client.force_authenticate(user=self.user1)
+        self.client.post(f'/api/movies/{self.matrix.id}/ratings/', {'score': 5})
+        self.client.post(f'/api/movies/{self.heat.id}/ratings/', {'score': 2})
+        self.client.post(f'/api/movies/{self.speed.id}/ratings/', {'score': 3})
+        self.client.post(f'/api/movies/{self.speed.id}/ratings/', {'score': 4})
+
+        with self.assertNumQueries(1):
+            data = self.get_stats()
+        self.assertEqual(data['rating_count'], 3)
+        self.assertAlmostEqual(data['average_rating'], 11 / 3)
+        self.assertEqual(data['histogram'], {'1': 0, '2': 1, '3': 0, '4': 1, '5': 1})
+        self.assertEqual(data['favourite_genres'], ['Action', 'Sci-Fi', 'Crime'])
+        self.assertIsNotNone(data['last_rated_at'])
+
+    def test_stats_follow_deletes_and_genre_changes(self):
+        """Test deleted ratings and movies and re-tagged genres are reflected"""
+        Rating.objects.create(movie=self.matrix, user=self.user1, score=5)
+        rating = Rating.objects.create(movie=self.heat, user=self.user1, score=4)
+        Rating.objects.create(movie=self.speed, user=self.user1, score=1)
+        self.heat.genre = 'Drama'
+        self.heat.save()
+        self.assertEqual(self.get_stats()['favourite_genres'], ['Action', 'Sci-Fi', 'Drama'])
+
+        rating.delete()
+        self.matrix.delete()
+        data = self.get_stats()
+        self.assertEqual(data['rating_count'], 1)
+        self.assertEqual(data['histogram'], {'1': 1, '2': 0, '3': 0, '4': 0, '5': 0})
+        self.assertEqual(data['favourite_genres'], ['Action'])
+
+        Genre.objects.get(name='Action').delete()
+        self.assertEqual(self.get_stats()['favourite_genres'], [])
+
+    def test_rebuild_matches_incremental(self):
+        """Test a full rebuild produces the same stats"""
+        Rating.objects.create(movie=self.matrix, user=self.user1, score=3)
+        Rating.objects.create(movie=self.heat, user=self.user1, score=5)
+        Rating.objects.create(movie=self.heat, user=self.user2, score=2)
+        before = self.get_stats()
+        UserRatingStats.objects.all().delete()
+        call_command('rebuild_user_stats', stdout=io.StringIO())
+        self.assertEqual(self.get_stats(), before)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+class ReplicaRoutingTestCase(TestCase):
+    """Test read replica routing and per-alias query metrics"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def route(self, request, write=False):
+        """Run a request through the middleware, returning it with the aliases its reads used"""
+        reads = []
+
+        def view(request):
+            reads.append(router.db_for_read(Movie))
+            if write:
+                router.db_for_write(Movie)
+                reads.append(router.db_for_read(Movie))
+            return HttpResponse()
+
+        return ReplicaRoutingMiddleware(view)(request), reads
+
+    def test_reads_outside_requests_use_primary(self):
+        """Test management commands and background work never read from replicas"""
+        self.assertEqual(router.db_for_read(Movie), PRIMARY)
+        token = current_state.set(RoutingState(replica='replica2'))
+        try:
+            self.assertEqual(router.db_for_read(Movie), 'replica2')
+        finally:
+            current_state.reset(token)
+
+    def test_safe_requests_read_from_replicas(self):
+        """Test GETs are spread over replicas and writes go to the primary"""
+        _, reads = self.route(self.factory.get('/api/movies/'))
+        self.assertIn(reads[0], ['replica1', 'replica2'])
+        _, reads = self.route(self.factory.post('/api/movies/'))
+        self.assertEqual(reads, [PRIMARY])
+
+    def test_read_after_write_is_sticky(self):
+        """Test reads after a write in the request and within the sticky window use the primary"""
+        response, reads = self.route(self.factory.get('/api/movies/'), write=True)
+        self.assertEqual(reads[1], PRIMARY)
+        cookie = response.cookies[STICKY_COOKIE]
+        self.assertEqual(cookie['max-age'], settings.REPLICA_STICKY_SECONDS)
+
+        request = self.factory.get('/api/movies/')
+        request.COOKIES[STICKY_COOKIE] = cookie.value
+        _, reads = self.route(request)
+        self.assertEqual(reads, [PRIMARY])
+
+        request.COOKIES[STICKY_COOKIE] = '1'  # window has passed
+        _, reads = self.route(request)
+        self.assertNotEqual(reads, [PRIMARY])
+
+    def test_read_after_write_is_sticky_for_token_clients(self):
+        """Test a JWT client that sends no cookies still reads its own writes from the primary"""
+        cache.clear()
+        writer = User.objects.create_user(username='writer', password='pass123')
+        other = User.objects.create_user(username='other', password='pass123')
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(writer).access_token}'}
+        self.route(self.factory.post('/api/movies/', **auth), write=True)
+
+        _, reads = self.route(self.factory.get('/api/movies/', **auth))
+        self.assertEqual(reads, [PRIMARY])
+        other_auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(other).access_token}'}
+        _, reads = self.route(self.factory.get('/api/movies/', **other_auth))
+        self.assertNotEqual(reads, [PRIMARY])
+        _, reads = self.route(self.factory.get('/api/movies/', HTTP_AUTHORIZATION='Bearer not-a-token'))
+        self.assertNotEqual(reads, [PRIMARY])
+
+    @override_settings(DATABASE_REPLICAS=[], DB_QUERY_METRICS=False)
+    def test_skipped_without_replicas(self):
+        """Test the middleware leaves the stack when it has nothing to route or report"""
+        with self.assertRaises(MiddlewareNotUsed):
+            ReplicaRoutingMiddleware(lambda request: HttpResponse())
+        # Metrics alone keep it, without decoding tokens or touching the cache
+        with override_settings(DB_QUERY_METRICS=True), \
+                mock.patch.object(ReplicaRoutingMiddleware, 'requester') as token:
+            response, reads = self.route(self.factory.get('/api/movies/', HTTP_AUTHORIZATION='Bearer x'), write=True)
+        token.assert_not_called()
+        self.assertEqual(reads, [PRIMARY, PRIMARY])
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+    def test_async_cache_calls_off_event_loop(self):
+        """Test ASGI requests check and record the sticky window outside the event loop"""
+        writer = User.objects.create_user(username='writer', password='pass123')
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(writer).access_token}'}
+        on_loop = []
+
+        def running_loop():
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return False
+            return True
+
+        def get(*args, **kwargs):
+            on_loop.append(running_loop())
+            return 0
+
+        def set(*args, **kwargs):
+            on_loop.append(running_loop())
+
+        async def view(request):
+            router.db_for_write(Movie)
+            return HttpResponse()
+
+        with mock.patch('api.middleware.cache.get', get), mock.patch('api.middleware.cache.set', set):
+            async_to_sync(ReplicaRoutingMiddleware(view))(self.factory.post('/api/movies/', **auth))
+        self.assertEqual(on_loop, [False, False])
+
+    @override_settings(DATABASE_REPLICAS=[], DB_QUERY_METRICS=True)
+    def test_query_metrics_per_alias(self):
+        """Test queries are counted per alias for the process and in Server-Timing"""
+        query_metrics.clear()
+        response = self.client.get('/api/movies/')
+        self.assertRegex(response['Server-Timing'], r'^db-default;dur=[0-9.]+;desc="[0-9]+ queries"$')
+        self.assertGreater(query_metrics.snapshot()['default']['queries'], 0)
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+
+class LiveRatingsTestCase(TestCase):
+    """Test live rating updates over server-sent events"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='pass123')
+        self.movie = Movie.objects.create(
+            title='The Matrix',
+            description='Description',
+            release_year=1999,
+            genre='Action',
+            director='Director',
+            created_by=self.user
+        )
+        self.live_url = f'/api/movies/ratings/live/?movies={self.movie.id}'
+
+    def rate(self, score):
+        with self.captureOnCommitCallbacks(execute=True):
+            rating, _ = Rating.objects.update_or_create(movie=self.movie, user=self.user, defaults={'score': score})
+        return rating
+
+    def unrate(self, rating):
+        with self.captureOnCommitCallbacks(execute=True):
+            rating.delete()
+
+    async def read_event(self, stream):
+        chunk = await asyncio.wait_for(anext(stream), 2)
+        event, data = chunk.decode().strip().split('\n')
+        return event.removeprefix('event: '), json.loads(data.removeprefix('data: '))
+
+    async def test_stream_rating_deltas(self):
+        """Test subscribers receive new, updated and deleted ratings with new aggregates"""
+        response = await self.async_client.get(self.live_url)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+        self.assertEqual(len(broker), 1)
+
+        rating = await sync_to_async(self.rate)(4)
+        event, data = await self.read_event(stream)
+        self.assertEqual(event, 'rating')
+        self.assertEqual(data['movie'], self.movie.id)
+        self.assertEqual(data['ratings_count'], 1)
+        self.assertEqual(data['rating']['score'], 4)
+        self.assertEqual(data['rating']['username'], 'user1')
+
+        await sync_to_async(self.rate)(2)
+        event, data = await self.read_event(stream)
+        self.assertEqual((event, data['average_rating'], data['ratings_count']), ('rating', 2, 1))
+
+        rating_id = rating.id
+        await sync_to_async(self.unrate)(rating)
+        event, data = await self.read_event(stream)
+        self.assertEqual((event, data['rating'], data['ratings_count']), ('rating_deleted', {'id': rating_id}, 0))
+
+        # A client disconnect cancels the pending read, which unsubscribes
+        pending = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+        self.assertEqual(len(broker), 0)
+
+    async def test_invalid_subscriptions(self):
+        """Test bad movie lists are rejected and WSGI requests are refused"""
+        response = await self.async_client.get('/api/movies/ratings/live/?movies=a,b')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = await self.async_client.get('/api/movies/ratings/live/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = await sync_to_async(self.client.get)(self.live_url)
+        self.assertEqual(response.status_code, status.HTTP_501_NOT_IMPLEMENTED)
+
+    async def test_slow_subscribers_are_bounded(self):
+        """Test a subscriber that falls behind keeps a bounded backlog and is told to resync"""
+        test_broker = RatingBroker(max_subscribers=1, max_pending=3)
+        subscription = test_broker.subscribe([1])
+        self.assertIsNone(test_broker.subscribe([1]))
+        for i in range(10):
+            test_broker.publish(1, 'rating', {'n': i})
+        await asyncio.sleep(0)
+        self.assertLessEqual(len(subscription.pending), 3)
+        self.assertIn(b'event: resync', await subscription.next_event(1))
+        self.assertIn(b'"n":9', await subscription.next_event(1))
+        self.assertIsNone(await subscription.next_event(0.01))
+        test_broker.unsubscribe(subscription)
+        self.assertFalse(test_broker.has_subscribers(1))
+
+
+class DuplicateMovieTestCase(APITestCase):
+    """Test duplicate detection on create and merging duplicates"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user1 = User.objects.create_user(username='user1', password='pass123')
+        self.user2 = User.objects.create_user(username='user2', password='pass123')
+        self.client.force_authenticate(user=self.user1)
+        self.movies_url = '/api/movies/'
+        self.duplicates_url = '/api/movies/duplicates/'
+        self.matrix = self.create_movie('The Matrix', 1999, imdb_id='tt0133093')
+        self.dune = self.create_movie('Dune', 1984)
+
+    def create_movie(self, title, year, **fields):
+        return Movie.objects.create(
+            title=title,
+            description='Description',
+            release_year=year,
+            genre='Sci-Fi',
+            director='Director',
+            created_by=self.user1,
+            **fields
+        )
+
+    def find(self, **params):
+        response = self.client.get(self.duplicates_url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(match['id'], match['match']) for match in response.data]
+
+    def test_create_refuses_duplicates_unless_forced(self):
+        """Test creating a movie with the same normalized title and year returns 409 with candidates"""
+        data = {'title': 'the  MATRIX', 'description': 'Again', 'release_year': 1999,
+                'genre': 'Sci-Fi', 'director': 'Director'}
+        response = self.client.post(self.movies_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['duplicates'][0]['id'], self.matrix.id)
+        self.assertEqual(response.data['duplicates'][0]['match'], 'title_year')
+
+        response = self.client.post(f'{self.movies_url}?force=true', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        data.update(title='Dune', release_year=2021)
+        response = self.client.post(self.movies_url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_match_kinds(self):
+        """Test matches by imdb_id, by title and year, and by similar titles within a year"""
+        self.assertEqual(self.find(title='Something Else', release_year=2000, imdb_id='tt0133093'),
+                         [(self.matrix.id, 'imdb_id')])
+        self.assertEqual(self.find(title='Matrix, The', release_year=2000), [(self.matrix.id, 'similar')])
+        self.assertEqual(self.find(title='The Matrx', release_year=1999), [(self.matrix.id, 'similar')])
+        self.assertEqual(self.find(title='Die Matrix', release_year=1999, aka='The Matrix'),
+                         [(self.matrix.id, 'similar')])
+        self.assertEqual(self.find(title='The Matrix Reloaded', release_year=1999), [])
+        self.assertEqual(self.find(title='The Matrix', release_year=2003), [])
+        self.assertEqual(self.find(title='The Matrix', release_year=1999, exclude=self.matrix.id), [])
+        response = self.client.get(self.duplicates_url, {'title': 'Dune'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.duplicates_url, {'title': 'Dune', 'release_year': 2021, 'exclude': 'x'})
+        self.assertEqual(response.data, {'error': 'exclude must be a movie id'})
+
+    def test_index_follows_title_changes(self):
+        """Test renamed movies are matched under their new title only"""
+        self.dune.title = 'Arrakis'
+        self.dune.aka = 'Dune: Part Zero'
+        self.dune.save()
+        self.assertEqual(self.find(title='Arakis', release_year=1984), [(self.dune.id, 'similar')])
+        self.assertEqual(self.find(title='Dune Part Zero', release_year=1984), [(self.dune.id, 'similar')])
+        self.assertEqual(self.find(title='Dune', release_year=1984), [])
+
+    def test_merge_moves_ratings(self):
+        """Test merging moves ratings in bulk, keeps a user's latest rating and fixes aggregates"""
+        copy = self.create_movie('Matrix, The', 1999, poster_url='https://example.com/p.jpg')
+        Rating.objects.create(movie=self.matrix, user=self.user1, score=2)
+        Rating.objects.create(movie=copy, user=self.user1, score=5)
+        Rating.objects.create(movie=copy, user=self.user2, score=4)
+
+        out = io.StringIO()
+        call_command('find_duplicate_movies', stdout=out)
+        self.assertIn(f'{copy.id}: Matrix, The (1999) [similar', out.getvalue())
+        call_command('merge_movies', str(self.matrix.id), str(copy.id), stdout=out)
+
+        self.assertFalse(Movie.objects.filter(pk=copy.id).exists())
+        self.matrix.refresh_from_db()
+        self.assertEqual(self.matrix.poster_url, 'https://example.com/p.jpg')
+        self.assertEqual((self.matrix.ratings_count, self.matrix.average_rating), (2, 4.5))
+        self.assertEqual(sorted(self.matrix.ratings.values_list('user__username', 'score')),
+                         [('user1', 5), ('user2', 4)])
+        self.assertEqual(UserRatingStats.objects.get(user=self.user1).rating_count, 1)
+        response = self.client.get('/api/movies/facets/')
+        self.assertEqual(response.data['score'], {'4-5': 1, 'unrated': 1})
+
+    def test_merge_keeps_deleted_users_ratings_hidden(self):
+        """Test a deleted user's rating moves with the rest and stays out of the aggregates until purged"""
+        copy = self.create_movie('Matrix, The', 1999)
+        Rating.objects.create(movie=copy, user=self.user2, score=1)
+        leaving = User.objects.create_user(username='leaving', password='pass123')
+        Rating.objects.create(movie=copy, user=leaving, score=5)
+        deletion.soft_delete_user(leaving)
+        duplicates.merge_movies(self.matrix, [copy])
+        self.assertEqual(Rating.all_objects.filter(movie=self.matrix, user=leaving).count(), 1)
+        self.matrix.refresh_from_db()
+        self.assertEqual((self.matrix.rating_count, self.matrix.rating_sum), (1, 1))
+        deletion.purge()
+        self.matrix.refresh_from_db()
+        self.assertEqual((self.matrix.rating_count, self.matrix.rating_sum), (1, 1))
+
+    def test_sequels_not_flagged(self):
+        """Test titles that differ only by a trailing sequel number are not duplicates"""
+        movie = self.create_movie('Movie 1', 2000)
+        self.assertEqual(self.find(title='Movie 2', release_year=2001), [])
+        self.assertEqual(self.find(title='Movie II', release_year=2000), [])
+        self.assertEqual(self.find(title='Movie  1', release_year=2001), [(movie.id, 'similar')])
+
+
+class IdempotencyKeyTestCase(APITestCase):
+    """Test Idempotency-Key handling on movie and rating writes"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user1', password='pass123')
+        self.client.force_authenticate(user=self.user)
+        self.movies_url = '/api/movies/'
+        self.movie_data = {'title': 'Heat', 'description': 'Description', 'release_year': 1995,
+                           'genre': 'Crime', 'director': 'Michael Mann'}
+
+    def post(self, url, data, key):
+        return self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_stored_response(self):
+        """Test a retried create returns the first response without writing again"""
+        first = self.post(self.movies_url, self.movie_data, 'key-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        with self.assertNumQueries(1):
+            retry = self.post(self.movies_url, self.movie_data, 'key-1')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Movie.objects.count(), 1)
+
+        other = User.objects.create_user(username='user2', password='pass123')
+        self.client.force_authenticate(user=other)
+        response = self.post(self.movies_url, self.movie_data, 'key-1')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)  # a duplicate, not a replay
+
+    def test_rating_retry(self):
+        """Test a retried rating is applied once"""
+        movie = Movie.objects.create(created_by=self.user, **self.movie_data)
+        url = f'/api/movies/{movie.id}/ratings/'
+        self.assertEqual(self.post(url, {'score': 4}, 'rate-1').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.post(url, {'score': 4}, 'rate-1').status_code, status.HTTP_201_CREATED)
+        movie.refresh_from_db()
+        self.assertEqual(movie.ratings_count, 1)
+
+    def test_anonymous_request_ignores_key(self):
+        """Test registration with an Idempotency-Key runs normally"""
+        self.client.force_authenticate(user=None)
+        data = {'username': 'newuser', 'email': 'new@example.com', 'password': 'Str0ng-pass!', 'password2': 'Str0ng-pass!'}
+        response = self.post('/api/auth/register/', data, 'register-1')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_key_reused_for_different_request(self):
+        """Test a key sent with a different body is rejected"""
+        self.post(self.movies_url, self.movie_data, 'key-1')
+        response = self.post(self.movies_url, {**self.movie_data, 'title': 'Ronin'}, 'key-1')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_concurrent_duplicate_is_refused(self):
+        """Test a duplicate arriving while the first request holds the key does not write"""
+        response = self.post(self.movies_url, self.movie_data, 'key-1')
+        IdempotencyKey.objects.filter(key='key-1').update(status_code=None, response_body=None)
+        Movie.objects.all().delete()
+        response = self.post(self.movies_url, self.movie_data, 'key-1')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(Movie.objects.exists())
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_large_upload_with_key(self):
+        """Test an upload larger than the in-memory body limit can carry a key"""
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        def upload(content):
+            out = io.BytesIO()
+            Image.new('RGB', (64, 64), content).save(out, 'BMP')
+            poster = SimpleUploadedFile('poster.bmp', out.getvalue(), content_type='image/bmp')
+            return self.client.post(self.movies_url, {**self.movie_data, 'poster_image': poster},
+                                    format='multipart', HTTP_IDEMPOTENCY_KEY='upload-1')
+
+        first = upload((10, 20, 30))
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(upload((10, 20, 30))['Idempotent-Replayed'], 'true')
+        self.assertEqual(upload((200, 20, 30)).status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Movie.objects.count(), 1)
+
+    def test_failed_writes_release_the_key(self):
+        """Test a server error frees the key for the retry"""
+        with mock.patch('api.views.MovieListCreateView.perform_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.post(self.movies_url, self.movie_data, 'key-1')
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.post(self.movies_url, self.movie_data, 'key-1').status_code, status.HTTP_201_CREATED)
+
+    def test_expired_keys_are_purged(self):
+        """Test keys past their TTL are deleted and can be reused"""
+        self.post(self.movies_url, self.movie_data, 'key-1')
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+        call_command('purge_idempotency_keys', stdout=io.StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class MovieBatchTestCase(APITestCase):
+    """Test batch movie lookup and inline movie summaries on user ratings"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user1', password='pass123')
+        self.movies = [
+            Movie.objects.create(title=f'Movie {i}', description='Description', release_year=2000 + i,
+                                 genre='Drama', director='Director', imdb_id=f'tt{i:07d}', created_by=self.user)
+            for i in range(5)
+        ]
+
+    def test_batch_by_ids_and_imdb_ids(self):
+        """Test movies come back in the requested order from a single query"""
+        a, b, c = self.movies[3], self.movies[0], self.movies[4]
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/movies/batch/?ids={a.id},{b.id},999999,{a.id}&imdb_ids={c.imdb_id},tt404')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([movie['id'] for movie in response.data], [a.id, b.id, c.id])
+        self.assertEqual(response.data[0]['created_by']['username'], 'user1')
+
+    def test_batch_validation(self):
+        """Test missing, malformed and oversized id lists are rejected"""
+        self.assertEqual(self.client.get('/api/movies/batch/').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/api/movies/batch/?ids=1,x').status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(MOVIE_BATCH_MAX_IDS=2):
+            response = self.client.get('/api/movies/batch/?ids=1,2,3')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_user_ratings_include_movie(self):
+        """Test ?include=movie inlines movie summaries without a query per rating"""
+        for movie in self.movies:
+            Rating.objects.create(movie=movie, user=self.user, score=4)
+        url = f'/api/users/{self.user.id}/ratings/'
+        self.assertNotIn('movie_summary', self.client.get(url).data['results'][0])
+        with self.assertNumQueries(2):  # count and page
+            response = self.client.get(url, {'include': 'movie'})
+        summary = response.data['results'][0]['movie_summary']
+        self.assertEqual(summary['id'], response.data['results'][0]['movie'])
+        self.assertEqual(summary['average_rating'], 4)
+
+
+class SoftDeleteTestCase(APITestCase):
+    """Test soft-deleted movies and users are hidden at once and purged in batches"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = User.objects.create_user(username='owner', password='pass123')
+        self.raters = User.objects.bulk_create([User(username=f'rater{i}') for i in range(5)])
+        self.heat = Movie.objects.create(title='Heat', description='Description', release_year=1995,
+                                         genre='Crime', director='Michael Mann', created_by=self.owner)
+        self.alien = Movie.objects.create(title='Alien', description='Description', release_year=1979,
+                                          genre='Horror', director='Ridley Scott', created_by=self.raters[0])
+        for rater in self.raters:
+            Rating.objects.create(movie=self.heat, user=rater, score=4)
+        Rating.objects.create(movie=self.alien, user=self.raters[1], score=2)
+
+    def test_deleted_movie_hidden_until_purged(self):
+        """Test a deleted movie disappears from reads and its ratings are purged in batches"""
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.delete(f'/api/movies/{self.heat.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        self.assertEqual(self.client.get(f'/api/movies/{self.heat.id}/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual([movie['id'] for movie in self.client.get('/api/movies/').data['results']], [self.alien.id])
+        self.assertEqual(self.client.get(f'/api/users/{self.raters[1].id}/ratings/').data['count'], 1)
+        self.assertNotIn('Crime', self.client.get('/api/movies/facets/').data['genre'])
+        self.assertEqual(Rating.all_objects.filter(movie=self.heat).count(), 5)
+        self.assertEqual(UserRatingStats.objects.get(pk=self.raters[1].id).rating_count, 2)
+
+        with CaptureQueriesContext(connection) as ctx:
+            call_command('purge_deleted', '--batch-size', '2', stdout=io.StringIO())
+        rating_deletes = [q for q in ctx.captured_queries if q['sql'].startswith('DELETE FROM "api_rating"')]
+        self.assertEqual(len(rating_deletes), 3)
+        self.assertFalse(Movie.all_objects.filter(pk=self.heat.id).exists())
+        self.assertFalse(Rating.all_objects.filter(movie_id=self.heat.id).exists())
+        stats = UserRatingStats.objects.get(pk=self.raters[1].id)
+        self.assertEqual((stats.rating_count, stats.rating_sum), (1, 2))
+
+    def test_deleted_user_hidden_until_purged(self):
+        """Test a deleted user's movies and ratings are hidden and later removed with the account"""
+        author = self.raters[0]
+        self.client.force_login(User.objects.create_superuser(username='admin', password='adminpass123'))
+        response = self.client.post(f'/admin/auth/user/{author.id}/delete/', {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+
+        author.refresh_from_db()
+        self.assertFalse(author.is_active)
+        self.assertTrue(UserDeletion.objects.filter(user=author).exists())
+        self.assertFalse(Movie.objects.filter(pk=self.alien.id).exists())
+        self.assertEqual(len(self.client.get(f'/api/movies/{self.heat.id}/ratings/').data), 4)
+        self.assertEqual(self.client.get(f'/api/users/{author.id}/stats/').status_code, status.HTTP_404_NOT_FOUND)
+        self.heat.refresh_from_db()
+        self.assertEqual((self.heat.ratings_count, self.heat.rating_sum), (4, 16))
+        self.assertEqual(self.client.get(f'/api/movies/{self.heat.id}/').data['ratings_count'], 4)
+
+        call_command('purge_deleted', stdout=io.StringIO())
+        self.assertFalse(User.objects.filter(pk=author.id).exists())
+        self.assertFalse(Movie.all_objects.filter(pk=self.alien.id).exists())
+        self.heat.refresh_from_db()
+        self.assertEqual((self.heat.ratings_count, self.heat.rating_sum), (4, 16))
+        self.assertEqual(UserRatingStats.objects.get(pk=self.raters[1].id).rating_count, 1)
+
+    def test_rebuild_between_delete_and_purge(self):
+        """Test recounts and rebuilds leave out a deleted user's ratings, which the purge then doesn't subtract"""
+        deletion.soft_delete_user(self.raters[4])
+        facets.rebuild()
+        facets.recount_movie_ratings(self.heat.pk)
+        self.heat.refresh_from_db()
+        self.assertEqual((self.heat.rating_count, self.heat.rating_sum), (4, 16))
+        deletion.purge()
+        self.heat.refresh_from_db()
+        self.assertEqual((self.heat.rating_count, self.heat.rating_sum), (4, 16))
+        self.assertEqual(Rating.objects.filter(movie=self.heat).count(), 4)
+
+
+class DatabaseBackupTestCase(TransactionTestCase):
+    """Test online snapshots of the database and posters (outside a transaction, as the command runs)"""
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output)
+        self.addCleanup(shutil.rmtree, self.media_root)
+        os.makedirs(os.path.join(self.media_root, 'posters'))
+        self.write_poster('a.0123456789ab.jpg', b'first poster')
+        user = User.objects.create_user(username='user1', password='pass123')
+        for i in range(50):
+            Movie.objects.create(title=f'Movie {i}', description='x' * 2000, release_year=2000,
+                                 genre='Drama', director='Director', created_by=user)
+
+    def write_poster(self, name, content):
+        with open(os.path.join(self.media_root, 'posters', name), 'wb') as poster:
+            poster.write(content)
+
+    def backup(self):
+        out = io.StringIO()
+        with override_settings(MEDIA_ROOT=self.media_root):
+            call_command('backup_database', '--output', self.output, '--pages', '8', '--pause', '0', stdout=out)
+        return out.getvalue()
+
+    def test_sqlite_snapshot_in_steps(self):
+        """Test the copy is a complete database taken over several steps and reports its locks"""
+        report = self.backup()
+        self.assertIn('locks held', report)
+        snapshot = report.strip().rsplit(' ', 1)[-1]
+        with open(os.path.join(snapshot, 'manifest.json')) as manifest:
+            stats = json.load(manifest)['stats']['database']
+        self.assertGreater(stats['steps'], 1)
+        self.assertLessEqual(stats['max_lock_seconds'], stats['lock_seconds'])
+
+        copy = sqlite3.connect(os.path.join(snapshot, 'db.sqlite3'))
+        self.addCleanup(copy.close)
+        self.assertEqual(copy.execute('SELECT COUNT(*) FROM api_movie').fetchone()[0], 50)
+        self.assertEqual(copy.execute('PRAGMA integrity_check').fetchone()[0], 'ok')
+
+    def test_posters_copied_incrementally(self):
+        """Test unchanged and duplicate posters are not copied again"""
+        self.assertIn('1 of 1 files copied', self.backup())
+        self.write_poster('b.0123456789ab.jpg', b'first poster')
+        self.write_poster('c.ba9876543210.jpg', b'second poster')
+        self.assertIn('1 of 3 files copied', self.backup())
+        objects = [name for _, _, names in os.walk(os.path.join(self.output, 'objects')) for name in names]
+        self.assertEqual(len(objects), 2)
+
+    def test_vanished_poster_skipped(self):
+        """Test a poster removed between listing and reading is left out of the snapshot"""
+        posters = os.path.join(self.media_root, 'posters')
+        with mock.patch('api.backup.os.walk', return_value=[(posters, [], ['a.0123456789ab.jpg', 'gone.jpg'])]):
+            self.assertIn('1 of 1 files copied', self.backup())
+
+    def test_unsupported_database(self):
+        """Test databases without an online backup fail with a command error"""
+        with mock.patch.object(connection, 'vendor', 'oracle'):
+            with self.assertRaisesMessage(CommandError, 'No online backup for oracle databases'):
+                self.backup()
+        self.assertEqual(os.listdir(self.output), [])
+
+
+@override_settings(ROLLUP_SETTLE_SECONDS=0)
+class RatingAnalyticsTestCase(APITestCase):
+    """Test hourly and daily rating rollups and the analytics endpoints"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create_superuser(username='admin', password='adminpass123')
+        self.client.force_authenticate(user=self.admin)
+        self.day = datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+        User.objects.filter(pk=self.admin.pk).update(date_joined=self.day - timedelta(days=100))
+        self.veteran = User.objects.create_user(username='veteran', password='pass123')
+        User.objects.filter(pk=self.veteran.pk).update(date_joined=self.day - timedelta(days=100))
+        self.newbie = User.objects.create_user(username='newbie', password='pass123')
+        User.objects.filter(pk=self.newbie.pk).update(date_joined=self.day)
+        self.heat = Movie.objects.create(title='Heat', description='Description', release_year=1995,
+                                         genre='Crime, Drama', director='Michael Mann', created_by=self.admin)
+        self.alien = Movie.objects.create(title='Alien', description='Description', release_year=1979,
+                                          genre='Horror', director='Ridley Scott', created_by=self.admin)
+        self.rate(self.heat, self.veteran, 5, hours=1)
+        self.rate(self.heat, self.newbie, 2, hours=1)
+        self.rate(self.alien, self.newbie, 4, hours=30)
+
+    def rate(self, movie, user, score, hours):
+        rating = Rating.objects.create(movie=movie, user=user, score=score)
+        Rating.objects.filter(pk=rating.pk).update(created_at=self.day + timedelta(hours=hours))
+
+    def series(self, url, **params):
+        params = {'start': '2026-03-01', 'end': '2026-03-02T23:00:00Z', **params}
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([q for q in ctx.captured_queries if '"api_rating"' in q['sql']])
+        return [(point['ratings'], point['average_score'], point['new_user_ratings']) for point in response.data]
+
+    def test_daily_and_hourly_series(self):
+        """Test rolled up totals per day, per hour, per movie and per genre"""
+        call_command('rollup_ratings', stdout=io.StringIO())
+        self.assertEqual(self.series('/api/analytics/ratings/'), [(2, 3.5, 1), (1, 4.0, 1)])
+        hourly = self.series('/api/analytics/ratings/', period='hour')
+        self.assertEqual(len(hourly), 48)
+        self.assertEqual(hourly[1], (2, 3.5, 1))
+        self.assertEqual(hourly[2], (0, None, 0))
+        self.assertEqual(self.series(f'/api/analytics/movies/{self.alien.id}/'), [(0, None, 0), (1, 4.0, 1)])
+        self.assertEqual(self.series('/api/analytics/genres/drama/'), [(2, 3.5, 1), (0, None, 0)])
+
+        response = self.client.get('/api/analytics/users/', {'start': '2026-03-01', 'end': '2026-03-02'})
+        self.assertEqual([(p['new_users'], p['new_user_ratings']) for p in response.data], [(1, 1), (0, 1)])
+
+    def test_incremental_runs(self):
+        """Test later runs only fold in new rows and add to existing buckets"""
+        call_command('rollup_ratings', '--batch-size', '2', stdout=io.StringIO())
+        self.rate(self.alien, self.veteran, 1, hours=2)
+        out = io.StringIO()
+        call_command('rollup_ratings', stdout=out)
+        self.assertIn('Rolled up 1 ratings and 0 signups', out.getvalue())
+        self.assertEqual(self.series('/api/analytics/ratings/'), [(3, 8 / 3, 1), (1, 4.0, 1)])
+        self.assertEqual(RatingRollup.objects.filter(period='day', dimension='total').count(), 2)
+
+    def test_later_changes_not_reflected(self):
+        """Test documented behaviour: ratings keep the score they were rolled up with"""
+        call_command('rollup_ratings', stdout=io.StringIO())
+        Rating.objects.filter(movie=self.heat, user=self.newbie).get().delete()
+        rating = Rating.objects.get(movie=self.heat, user=self.veteran)
+        rating.score = 1
+        rating.save()
+        call_command('rollup_ratings', stdout=io.StringIO())
+        self.assertEqual(self.series('/api/analytics/ratings/'), [(2, 3.5, 1), (1, 4.0, 1)])
+
+    @override_settings(ROLLUP_SETTLE_SECONDS=60)
+    def test_recent_rows_wait(self):
+        """Test rows younger than the settle time are left for a later run"""
+        Rating.objects.create(movie=self.alien, user=self.veteran, score=3)
+        self.assertEqual(rollups.rollup_ratings(), 3)
+
+    def test_merge_reads_only_batch_rows(self):
+        """Test merging reads the batch's own rollup rows, not whole buckets, and keeps 64-bit keys"""
+        fields = ['period', 'dimension', 'key', 'bucket']
+        RatingRollup.objects.create(period='day', dimension='movie', key=1, bucket=self.day,
+                                    rating_count=7, rating_sum=7)
+        batch = {('day', 'movie', 2 ** 40, self.day): [1, 5, 0]}
+        with CaptureQueriesContext(connection) as ctx:
+            rollups._merge(RatingRollup, batch, fields, rollups.RATING_FIELDS)
+        self.assertIn('"key" IN', ctx.captured_queries[0]['sql'])
+        rollups._merge(RatingRollup, batch, fields, rollups.RATING_FIELDS)
+        rows = RatingRollup.objects.order_by('key').values_list('key', 'rating_count', 'rating_sum')
+        self.assertEqual(list(rows), [(1, 7, 7), (2 ** 40, 2, 10)])
+
+    def test_numpy_and_python_grouping_agree(self):
+        """Test the vectorized and pure Python aggregation give the same totals"""
+        rows = [(1, 5, self.day, self.day), (1, 3, self.day + timedelta(hours=5), self.day - timedelta(days=30)),
+                (2, 4, self.day + timedelta(days=1), self.day)]
+        genres = {1: [7, 8], 2: [8]}
+        expected = rollups.aggregate_ratings(rows, genres, 7 * 86400)
+        with mock.patch.object(rollups, 'np', None):
+            self.assertEqual(rollups.aggregate_ratings(rows, genres, 7 * 86400), expected)
+        self.assertEqual(expected['day', 'genre', 8, int(self.day.timestamp())], [2, 8, 1])
+
+    def test_validation_and_permissions(self):
+        """Test bad parameters are rejected and non-admins are refused"""
+        self.assertEqual(self.client.get('/api/analytics/ratings/', {'period': 'week'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/api/analytics/ratings/', {'start': 'yesterday'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/api/analytics/ratings/', {'period': 'hour', 'start': '2020-01-01'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.client.force_authenticate(user=self.veteran)
+        self.assertEqual(self.client.get('/api/analytics/ratings/').status_code, status.HTTP_403_FORBIDDEN)
+
+
+class StubPosterHandler(BaseHTTPRequestHandler):
+    """Poster host for the proxy tests, counting requests and connections"""
+    protocol_version = 'HTTP/1.1'
+    requests = []
+    connections = 0
+    poster = b''
+
+    def setup(self):
+        super().setup()
+        type(self).connections += 1
+
+    def do_GET(self):
+        type(self).requests.append(self.path)
+        if self.path == '/redirect':
+            self._send(302, b'', 'text/plain', Location='/poster.png')
+        elif self.path.startswith('/poster'):
+            if 'slow' in self.path:
+                time.sleep(0.2)
+            self._send(200, self.poster, 'image/png')
+        elif self.path == '/page.html':
+            self._send(200, b'<script>alert(1)</script>', 'text/html')
+        else:
+            self._send(404, b'missing', 'text/plain')
+
+    def _send(self, status_code, body, content_type, **headers):
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PosterProxyTestCase(TestCase):
+    """Test external posters are fetched once and served from the local cache"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        out = io.BytesIO()
+        Image.new('RGB', (400, 600), (200, 30, 30)).save(out, 'PNG')
+        StubPosterHandler.poster = out.getvalue()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubPosterHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.origin = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        StubPosterHandler.requests = []
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        override = override_settings(POSTER_PROXY_CACHE_DIR=cache_dir, POSTER_PROXY_ALLOW_PRIVATE=True)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user(username='poster', password='testpass123')
+
+    def movie(self, path):
+        return Movie.objects.create(title='Poster Movie', description='Description', release_year=2023,
+                                    genre='Drama', director='Director', created_by=self.user,
+                                    poster_url=f'{self.origin}{path}')
+
+    def test_fetched_once(self):
+        """Test the external poster is fetched on the first request only"""
+        movie = self.movie('/poster.png')
+        for _ in range(3):
+            response = self.client.get(proxy_url(movie.pk))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(b''.join(response.streaming_content), StubPosterHandler.poster)
+            self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(StubPosterHandler.requests, ['/poster.png'])
+
+    def test_variant(self):
+        """Test a width variant is resized from the cached original"""
+        movie = self.movie('/poster.png')
+        self.client.get(proxy_url(movie.pk))
+        response = self.client.get(proxy_url(movie.pk, 100))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as image:
+            self.assertEqual(image.size, (100, 150))
+        self.assertNotEqual(response['ETag'], self.client.get(proxy_url(movie.pk))['ETag'])
+        self.assertEqual(len(StubPosterHandler.requests), 1)
+
+    def test_unknown_width(self):
+        """Test only the configured widths are accepted"""
+        movie = self.movie('/poster.png')
+        self.assertEqual(self.client.get(proxy_url(movie.pk, 123)).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(StubPosterHandler.requests, [])
+
+    def test_conditional_request(self):
+        """Test a matching ETag returns 304 Not Modified"""
+        movie = self.movie('/poster.png')
+        etag = self.client.get(proxy_url(movie.pk))['ETag']
+        response = self.client.get(proxy_url(movie.pk), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_redirect_followed(self):
+        """Test redirects from the poster host are followed"""
+        movie = self.movie('/redirect')
+        response = self.client.get(proxy_url(movie.pk))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(StubPosterHandler.requests, ['/redirect', '/poster.png'])
+
+    def test_non_image_rejected(self):
+        """Test non-image responses are not served and the failure is remembered"""
+        movie = self.movie('/page.html')
+        self.assertEqual(self.client.get(proxy_url(movie.pk)).status_code, status.HTTP_502_BAD_GATEWAY)
+        self.assertEqual(self.client.get(proxy_url(movie.pk)).status_code, status.HTTP_502_BAD_GATEWAY)
+        self.assertEqual(StubPosterHandler.requests, ['/page.html'])
+
+    def test_private_address_refused(self):
+        """Test posters on private addresses are refused by default"""
+        movie = self.movie('/poster.png')
+        with override_settings(POSTER_PROXY_ALLOW_PRIVATE=False):
+            response = self.client.get(proxy_url(movie.pk))
+        self.assertEqual(response.status_code, status.HTTP_502_BAD_GATEWAY)
+        self.assertEqual(StubPosterHandler.requests, [])
+
+    def test_no_external_poster(self):
+        """Test movies without an external poster return 404"""
+        movie = self.movie('/poster.png')
+        Movie.objects.filter(pk=movie.pk).update(poster_url=None)
+        self.assertEqual(self.client.get(proxy_url(movie.pk)).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_port(self):
+        """Test a poster URL with a malformed port is a failed fetch, not a server error"""
+        movie = self.movie('/poster.png')
+        Movie.objects.filter(pk=movie.pk).update(poster_url='http://127.0.0.1:99999/poster.png')
+        self.assertEqual(self.client.get(proxy_url(movie.pk)).status_code, status.HTTP_502_BAD_GATEWAY)
+
+    def test_deleted_movie_served_to_staff(self):
+        """Test staff still get the posters of soft-deleted movies the admin lists"""
+        movie = self.movie('/poster.png')
+        deletion.soft_delete_movies(Movie.objects.filter(pk=movie.pk))
+        self.assertEqual(self.client.get(proxy_url(movie.pk)).status_code, status.HTTP_404_NOT_FOUND)
+        self.client.force_login(User.objects.create_superuser(username='admin', password='adminpass123'))
+        self.assertEqual(self.client.get(proxy_url(movie.pk)).status_code, status.HTTP_200_OK)
+
+    def test_connection_reused(self):
+        """Test fetches from the same host share a keep-alive connection"""
+        pool = ConnectionPool(max_active=2, max_idle=2, timeout=5)
+        before = StubPosterHandler.connections
+        for name in ('a', 'b', 'c'):
+            self.assertEqual(pool.get(f'{self.origin}/poster-{name}.png', 10 ** 6, allow_private=True),
+                             StubPosterHandler.poster)
+        self.assertEqual(StubPosterHandler.connections - before, 1)
+
+    def test_concurrency_limit(self):
+        """Test fetches beyond the concurrency limit give up after the timeout"""
+        pool = ConnectionPool(max_active=1, max_idle=1, timeout=0.05)
+        pool._active.acquire()
+        with self.assertRaises(PosterProxyBusy):
+            pool.get(f'{self.origin}/poster.png', 10 ** 6, allow_private=True)
+        self.assertEqual(StubPosterHandler.requests, [])
+
+    def test_least_recently_used_evicted(self):
+        """Test the cache evicts the least recently used files past its size"""
+        posters = PosterCache(settings.POSTER_PROXY_CACHE_DIR, max_bytes=250)
+        now = timezone.now().timestamp()
+        for age, key in ((300, 'aa01'), (200, 'aa02')):
+            os.utime(posters.put(key, b'x' * 100), (now - age, now - age))
+        posters.get('aa01')  # used again, so aa02 is now the oldest
+        posters.put('aa03', b'x' * 100)
+        self.assertIsNotNone(posters.get('aa01'))
+        self.assertIsNone(posters.get('aa02'))
+        self.assertIsNotNone(posters.get('aa03'))
+
+    def test_concurrent_misses_fetch_once(self):
+        """Test concurrent requests for an uncached poster share one fetch"""
+        url = f'{self.origin}/poster-slow.png'
+        paths = []
+        threads = [threading.Thread(target=lambda: paths.append(cached_poster(url)[1])) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(paths)), 1)
+        self.assertEqual(StubPosterHandler.requests, ['/poster-slow.png'])
+
+    def test_admin_preview_uses_proxy(self):
+        """Test the admin renders external posters through the proxy, which admin workers mount"""
+        movie = self.movie('/poster.png')
+        self.assertIn(proxy_url(movie.pk, 100), MovieAdmin(Movie, admin_site).poster_preview(movie))
+        # Admin workers mount the proxy themselves
+        result = subprocess.run(
+            [sys.executable, '-c', 'import django; django.setup(); from django.urls import resolve; '
+                                   f'print(resolve("{proxy_url(movie.pk)}").url_name)'],
+            cwd=settings.BASE_DIR, env={**os.environ, 'DJANGO_SERVER_ROLES': 'admin'},
+            capture_output=True, text=True, check=True,
+        )
+        self.assertEqual(result.stdout.strip().splitlines()[-1], 'poster-proxy')
+
+
+class CoalescingTestCase(APITestCase):
+    """Test identical movie reads share one computation and its cached bytes"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='coalesce', password='testpass123')
+        self.movie = Movie.objects.create(title='Trending', description='Description', release_year=2024,
+                                          genre='Drama', director='Director', created_by=self.user)
+        self.url = f'/api/movies/{self.movie.pk}/'
+
+    def test_detail_cached(self):
+        """Test a repeated detail read is served from the cache without queries"""
+        first = self.client.get(self.url)
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second.data['title'], 'Trending')
+
+    def test_writes_invalidate(self):
+        """Test ratings invalidate the movie's detail, and editing the movie the list too"""
+        list_url = '/api/movies/?ordering=-created_at'
+        self.client.get(self.url)
+        self.client.get(list_url)
+        Rating.objects.create(movie=self.movie, user=self.user, score=4)
+        detail = self.client.get(self.url)
+        self.assertEqual(detail['X-Cache'], 'MISS')
+        self.assertEqual(detail.data['ratings_count'], 1)
+        # List pages keep sharing until they expire
+        listed = self.client.get(list_url)
+        self.assertEqual(listed['X-Cache'], 'HIT')
+        self.assertEqual(listed.data['results'][0]['ratings_count'], 0)
+        cache.clear()  # expired
+        self.assertEqual(self.client.get(list_url).data['results'][0]['ratings_count'], 1)
+        self.movie.title = 'Renamed'
+        self.movie.save()
+        self.assertEqual(self.client.get(self.url).data['title'], 'Renamed')
+        listed = self.client.get(list_url)
+        self.assertEqual(listed['X-Cache'], 'MISS')
+        self.assertEqual(listed.data['results'][0]['title'], 'Renamed')
+
+    def test_headers_replayed(self):
+        """Test shared responses carry the headers of the response they were rendered from"""
+        first = self.client.get(self.url)
+        second = self.client.get(self.url)
+        self.assertEqual(second['X-Cache'], 'HIT')
+        for header in ('Content-Type', 'Allow', 'Vary'):
+            self.assertTrue(first.has_header(header), header)
+            self.assertEqual(second[header], first[header], header)
+
+    def test_soft_delete_invalidates(self):
+        """Test a deleted movie stops being served from the cache"""
+        self.client.get(self.url)
+        deletion.soft_delete_movies(Movie.objects.filter(pk=self.movie.pk))
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_early_refresh(self):
+        """Test an entry is recomputed early depending on the random draw and its cost"""
+        self.client.get(self.url)
+        with override_settings(COALESCE_EARLY_REFRESH_BETA=1e9):
+            with mock.patch('api.coalesce.random.random', return_value=0.0):
+                self.assertEqual(self.client.get(self.url)['X-Cache'], 'HIT')
+            with mock.patch('api.coalesce.random.random', return_value=0.5):
+                self.assertEqual(self.client.get(self.url)['X-Cache'], 'MISS')
+
+    def test_browsable_api_not_coalesced(self):
+        """Test only JSON renderings are shared"""
+        response = self.client.get(self.url, HTTP_ACCEPT='text/html')
+        self.assertFalse(response.has_header('X-Cache'))
+
+    def test_media_type_in_key(self):
+        """Test renderings for different media type parameters are cached apart"""
+        plain = self.client.get(self.url)
+        indented = self.client.get(self.url, HTTP_ACCEPT='application/json; indent=4')
+        self.assertEqual(indented['X-Cache'], 'MISS')
+        self.assertNotEqual(indented.content, plain.content)
+        self.assertEqual(self.client.get(self.url, HTTP_ACCEPT='application/json; indent=4').content, indented.content)
+
+    # The primary stands in for a replica; without one nothing lags behind the invalidations
+    @override_settings(DATABASE_REPLICAS=['default'])
+    def test_own_writes_not_coalesced(self):
+        """Test a client that just wrote reads around shared responses, whichever worker cached them"""
+        self.client.get(self.url)
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+        response = self.client.post(f'{self.url}ratings/', {'score': 5}, **auth)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # As if another worker had cached the detail without seeing the invalidation
+        key = coalesce.entry_key(f'http://testserver{self.url}', 'application/json',
+                                 coalesce._versions([f'movie:{self.movie.pk}']))
+        cache.set(key, coalesce.Entry(200, (('Content-Type', 'application/json'),), b'{"ratings_count": 0}',
+                                      0.01, time.time() + 5))
+        response = self.client.get(self.url, **auth)
+        self.assertFalse(response.has_header('X-Cache'))
+        self.assertEqual(response.data['ratings_count'], 1)
+        self.client.cookies.clear()  # another client
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'HIT')
+
+    @override_settings(COALESCE_SHARED_LOCK=True, COALESCE_WAIT_SECONDS=2)
+    def test_waits_for_other_worker(self):
+        """Test a request waits for the entry another worker is computing"""
+        key = coalesce.entry_key(f'http://testserver{self.url}', 'application/json',
+                                 coalesce._versions([f'movie:{self.movie.pk}']))
+        cache.add(coalesce.LOCK_PREFIX + key, 1)
+        entry = coalesce.Entry(200, (('Content-Type', 'application/json'),), b'{"title": "From another worker"}',
+                               0.01, time.time() + 5)
+        threading.Timer(0.1, cache.set, (key, entry)).start()
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['title'], 'From another worker')
+
+    def test_single_flight(self):
+        """Test concurrent calls with one key run the function once and share its result"""
+        flights = coalesce.SingleFlight()
+        release = threading.Event()
+        calls, results = [], []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return 'result'
+
+        threads = [threading.Thread(target=lambda: results.append(flights.do('key', compute))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        while not flights._calls:
+            time.sleep(0.001)
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [('result', False)] + [('result', True)] * 4)
+
+    def test_single_flight_error_shared(self):
+        """Test callers waiting on a failed call get its exception"""
+        flights = coalesce.SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        errors = []
+
+        def fail():
+            started.set()
+            release.wait(5)
+            raise ValueError('boom')
+
+        def call():
+            try:
+                flights.do('key', fail)
+            except ValueError as e:
+                errors.append(str(e))
+
+        owner = threading.Thread(target=call)
+        owner.start()
+        started.wait(5)
+        waiter = threading.Thread(target=call)
+        waiter.start()
+        time.sleep(0.05)
+        release.set()
+        owner.join()
+        waiter.join()
+        self.assertEqual(errors, ['boom', 'boom'])
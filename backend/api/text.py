@@ -0,0 +1,36 @@
+import re
+import unicodedata
+
+
+_whitespace = re.compile(r'\s+')
+_name_separators = re.compile(r'\s*[,;/|]\s*')
+
+
+def normalize_text(value):
+    """
+    Case-fold, strip accents and collapse whitespace so that lookups match
+    regardless of how a name or title was typed.
+    """
+    if not value:
+        return ''
+    if not value.isascii():
+        value = unicodedata.normalize('NFKD', value)
+        value = ''.join(c for c in value if not unicodedata.combining(c))
+    return _whitespace.sub(' ', value.casefold()).strip()
+
+
+def split_names(value):
+    """
+    Split a free-text list such as "Keanu Reeves, Carrie-Anne Moss" or
+    "Action/Sci-Fi" into names, dropping blanks and duplicates (by their
+    normalized form) while keeping the original order.
+    """
+    names = []
+    seen = set()
+    for name in _name_separators.split(value or ''):
+        name = _whitespace.sub(' ', name).strip()
+        key = normalize_text(name)
+        if key and key not in seen:
+            seen.add(key)
+            names.append(name)
+    return names
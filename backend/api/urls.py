@@ -3,9 +3,19 @@ from .views import (
     UserRegistrationView,
     UserLoginView,
     MovieListCreateView,
+    MovieBatchView,
+    MovieDuplicatesView,
+    MovieFacetsView,
+    MovieSuggestView,
     MovieDetailView,
     MovieRatingListCreateView,
+    MovieRatingStreamView,
     UserRatingsView,
+    UserRatingStatsView,
+    RatingAnalyticsView,
+    MovieAnalyticsView,
+    GenreAnalyticsView,
+    UserActivityAnalyticsView,
 )
 
 urlpatterns = [
@@ -15,9 +25,21 @@ urlpatterns = [
 
     # Movie endpoints
     path('movies/', MovieListCreateView.as_view(), name='movie-list'),
+    path('movies/batch/', MovieBatchView.as_view(), name='movie-batch'),
+    path('movies/duplicates/', MovieDuplicatesView.as_view(), name='movie-duplicates'),
+    path('movies/facets/', MovieFacetsView.as_view(), name='movie-facets'),
+    path('movies/suggest/', MovieSuggestView.as_view(), name='movie-suggest'),
     path('movies/<int:pk>/', MovieDetailView.as_view(), name='movie-detail'),
 
     # Rating endpoints
+    path('movies/ratings/live/', MovieRatingStreamView.as_view(), name='movie-ratings-live'),
     path('movies/<int:movie_id>/ratings/', MovieRatingListCreateView.as_view(), name='movie-ratings'),
     path('users/<int:user_id>/ratings/', UserRatingsView.as_view(), name='user-ratings'),
+    path('users/<int:user_id>/stats/', UserRatingStatsView.as_view(), name='user-rating-stats'),
+
+    # Analytics endpoints (rollup tables only)
+    path('analytics/ratings/', RatingAnalyticsView.as_view(), name='analytics-ratings'),
+    path('analytics/movies/<int:movie_id>/', MovieAnalyticsView.as_view(), name='analytics-movie'),
+    path('analytics/genres/<str:name>/', GenreAnalyticsView.as_view(), name='analytics-genre'),
+    path('analytics/users/', UserActivityAnalyticsView.as_view(), name='analytics-users'),
 ]
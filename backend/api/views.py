@@ -1,17 +1,33 @@
+import datetime
+
 from rest_framework import generics, status, permissions, filters
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Q
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from .models import Movie, Rating
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.views import View
+from . import deletion, duplicates, facets, live, rollups, suggest
+from .coalesce import coalesced
+from .idempotency import idempotent
+from .models import Genre, Movie, Rating, RatingRollup, UserRatingStats
+from .text import normalize_text
 from .serializers import (
     UserRegistrationSerializer,
     UserSerializer,
     MovieSerializer,
     MovieDetailSerializer,
-    RatingSerializer
+    RatingSerializer,
+    RatingWithMovieSerializer,
+    UserRatingStatsSerializer,
 )
 
 
@@ -83,16 +99,137 @@ class MovieListCreateView(generics.ListCreateAPIView):
     search_fields = ['title', 'description', 'genre', 'director']
     ordering_fields = ['created_at', 'release_year', 'title']
     ordering = ['-created_at']
+    # Query parameter -> normalized M2M relation it filters on
+    credit_filters = {'genre': 'genres', 'actor': 'cast', 'director': 'directors'}
 
     def get_permissions(self):
         if self.request.method == 'POST':
             return [permissions.IsAuthenticated()]
         return [permissions.AllowAny()]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # Exact lookups on the indexed normalized names instead of LIKE scans
+        for param, relation in self.credit_filters.items():
+            value = self.request.query_params.get(param)
+            if value:
+                queryset = queryset.filter(**{f'{relation}__normalized_name': normalize_text(value)})
+        return queryset
+
+    @coalesced('movies')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # Refuse likely duplicates unless the client confirms with ?force=true
+        if request.query_params.get('force', '').lower() not in ('1', 'true'):
+            data = serializer.validated_data
+            matches = duplicates.find_duplicates(
+                data['title'], data['release_year'], imdb_id=data.get('imdb_id'), aka=data.get('aka'),
+            )
+            if matches:
+                return Response(
+                    {'error': 'This movie may already exist', 'duplicates': matches},
+                    status=status.HTTP_409_CONFLICT,
+                )
+        self.perform_create(serializer)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
 
 
+class MovieDuplicatesView(APIView):
+    """
+    Existing movies matching a title and year (and optionally imdb_id and
+    aka), so clients can warn about duplicates before creating a movie
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        title = request.query_params.get('title', '')
+        try:
+            release_year = int(request.query_params['release_year'])
+        except (KeyError, ValueError):
+            return Response({'error': 'release_year must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            exclude = int(request.query_params['exclude']) if request.query_params.get('exclude') else None
+        except ValueError:
+            return Response({'error': 'exclude must be a movie id'}, status=status.HTTP_400_BAD_REQUEST)
+        if not title.strip():
+            return Response({'error': 'title is required'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(duplicates.find_duplicates(
+            title, release_year, imdb_id=request.query_params.get('imdb_id'),
+            aka=request.query_params.get('aka'), exclude=exclude,
+        ))
+
+
+class MovieBatchView(APIView):
+    """
+    Several movies by id and/or imdb_id in one query, in the order asked
+    for; ids that match no movie are left out
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        try:
+            ids = [int(value) for value in request.query_params.get('ids', '').split(',') if value.strip()]
+        except ValueError:
+            return Response({'error': 'ids must be comma-separated integers'}, status=status.HTTP_400_BAD_REQUEST)
+        imdb_ids = [value.strip() for value in request.query_params.get('imdb_ids', '').split(',') if value.strip()]
+        ids, imdb_ids = list(dict.fromkeys(ids)), list(dict.fromkeys(imdb_ids))
+        if not ids and not imdb_ids:
+            return Response({'error': 'ids or imdb_ids is required'}, status=status.HTTP_400_BAD_REQUEST)
+        max_ids = getattr(settings, 'MOVIE_BATCH_MAX_IDS', 200)
+        if len(ids) + len(imdb_ids) > max_ids:
+            return Response({'error': f'At most {max_ids} movies per request'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Aggregates are stored on the row, so one query with the creator joined covers the serializer
+        movies = Movie.objects.select_related('created_by').filter(Q(pk__in=ids) | Q(imdb_id__in=imdb_ids))
+        by_id = {movie.pk: movie for movie in movies}
+        by_imdb_id = {movie.imdb_id: movie for movie in by_id.values() if movie.imdb_id}
+        found = [by_id[pk] for pk in ids if pk in by_id] + [by_imdb_id[key] for key in imdb_ids if key in by_imdb_id]
+        return Response(MovieSerializer(list(dict.fromkeys(found)), many=True, context={'request': request}).data)
+
+
+class MovieFacetsView(APIView):
+    """
+    Movie counts per genre, decade and average score band for the browse filters
+    """
+    permission_classes = [permissions.AllowAny]
+    # Parameters that scope the counts to the movies the list view would return
+    scope_params = ('search', 'genre', 'actor', 'director')
+
+    def get(self, request):
+        if any(request.query_params.get(param) for param in self.scope_params):
+            list_view = MovieListCreateView(request=request, args=(), kwargs={}, format_kwarg=None)
+            movies = list_view.filter_queryset(list_view.get_queryset())
+            return Response(facets.compute_counts(movies))
+        # Unscoped counts come from the incrementally maintained FacetCount table
+        return Response(facets.read_counts())
+
+
+class MovieSuggestView(APIView):
+    """
+    Title typeahead served from the in-process prefix index
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        try:
+            limit = int(request.query_params.get('limit', 0)) or None
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        if limit is not None and limit < 0:
+            return Response({'error': 'limit must not be negative'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(suggest.get_index().search(query, limit))
+
+
 class MovieDetailView(generics.RetrieveUpdateDestroyAPIView):
     """
     Retrieve, update or delete a movie
@@ -105,6 +242,10 @@ class MovieDetailView(generics.RetrieveUpdateDestroyAPIView):
             return [permissions.IsAuthenticated()]
         return [permissions.AllowAny()]
 
+    @coalesced('movie:{pk}')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     def perform_update(self, serializer):
         # Only the creator can update
         if serializer.instance.created_by != self.request.user:
@@ -115,7 +256,8 @@ class MovieDetailView(generics.RetrieveUpdateDestroyAPIView):
         # Only the creator can delete
         if instance.created_by != self.request.user:
             raise permissions.PermissionDenied("You can only delete your own movies")
-        instance.delete()
+        # Hidden now; the ratings and the row are removed later by purge_deleted
+        deletion.soft_delete_movies(Movie.objects.filter(pk=instance.pk))
 
 
 class MovieRatingListCreateView(APIView):
@@ -130,16 +272,26 @@ class MovieRatingListCreateView(APIView):
         serializer = RatingSerializer(ratings, many=True)
         return Response(serializer.data)
 
+    @idempotent
+    @transaction.atomic
     def post(self, request, movie_id):
+        # Atomic so the rating and the aggregates updated by its signals commit together
         movie = get_object_or_404(Movie, pk=movie_id)
 
+        # Validate before touching the table, so bad scores never reach the aggregate signals
+        serializer = RatingSerializer(data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        if 'score' not in data and not Rating.objects.filter(movie=movie, user=request.user).exists():
+            return Response({'score': ['This field is required.']}, status=status.HTTP_400_BAD_REQUEST)
+
         # Check if user already rated this movie
         rating, created = Rating.objects.get_or_create(
             movie=movie,
             user=request.user,
             defaults={
-                'score': request.data.get('score'),
-                'comment': request.data.get('comment', '')
+                'score': data.get('score'),
+                'comment': data.get('comment', '')
             }
         )
 
@@ -155,14 +307,148 @@ class MovieRatingListCreateView(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
+class MovieRatingStreamView(View):
+    """
+    Server-sent events with rating deltas (new, updated and deleted ratings
+    plus the new average and count) for the movies in ?movies=1,2,3.
+    Served only by the ASGI application, where idle streams hold no thread.
+    """
+
+    async def get(self, request):
+        if not isinstance(request, ASGIRequest):
+            return JsonResponse({'error': 'Live updates require the ASGI server'}, status=status.HTTP_501_NOT_IMPLEMENTED)
+        try:
+            movie_ids = {int(value) for value in request.GET.get('movies', '').split(',') if value}
+        except ValueError:
+            return JsonResponse({'error': 'movies must be a comma-separated list of ids'}, status=status.HTTP_400_BAD_REQUEST)
+        max_movies = getattr(settings, 'LIVE_MAX_MOVIES', 50)
+        if not movie_ids or len(movie_ids) > max_movies:
+            return JsonResponse({'error': f'Subscribe to between 1 and {max_movies} movies'}, status=status.HTTP_400_BAD_REQUEST)
+        if live.broker.full():
+            response = JsonResponse({'error': 'Too many live connections'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response['Retry-After'] = '30'
+            return response
+
+        response = StreamingHttpResponse(
+            live.event_stream(movie_ids, getattr(settings, 'LIVE_HEARTBEAT_SECONDS', 15)),
+            content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
 class UserRatingsView(generics.ListAPIView):
     """
-    List all ratings by a specific user
+    List all ratings by a specific user; ?include=movie adds a summary of
+    each rated movie so clients need not fetch them one by one
     """
-    serializer_class = RatingSerializer
     permission_classes = [permissions.AllowAny]
 
+    def include_movie(self):
+        # No request while the schema is generated
+        return self.request is not None and self.request.query_params.get('include') == 'movie'
+
+    def get_serializer_class(self):
+        return RatingWithMovieSerializer if self.include_movie() else RatingSerializer
+
     def get_queryset(self):
         user_id = self.kwargs['user_id']
-        return Rating.objects.filter(user_id=user_id)
+        ratings = Rating.objects.filter(user_id=user_id).select_related('user')
+        if self.include_movie():
+            ratings = ratings.select_related('movie')
+        return ratings
+
+
+class UserRatingStatsView(generics.RetrieveAPIView):
+    """
+    Rating summary for a user: count, average, score histogram, last rating
+    time and favourite genres
+    """
+    serializer_class = UserRatingStatsSerializer
+    permission_classes = [permissions.AllowAny]
+
+    def get_object(self):
+        user_id = self.kwargs['user_id']
+        stats = UserRatingStats.objects.filter(pk=user_id, user__deletion__isnull=True).first()
+        if stats is None:
+            # No row until the user's first rating
+            stats = UserRatingStats(user=get_object_or_404(User, pk=user_id, deletion__isnull=True))
+        return stats
+
+
+class AnalyticsView(APIView):
+    """
+    Base for the analytics endpoints: time series over ?period=hour|day
+    from ?start= to ?end= (ISO dates or times, UTC), read only from the
+    rollup tables that api.rollups fills. A rating counts once, with the
+    score it had when it was rolled up: later score changes, deletions and
+    purges do not reach the series.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    default_spans = {RatingRollup.HOUR: datetime.timedelta(hours=48), RatingRollup.DAY: datetime.timedelta(days=30)}
+
+    @staticmethod
+    def parse_moment(value):
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                raise ValueError(value)
+            moment = datetime.datetime.combine(day, datetime.time())
+        return moment if timezone.is_aware(moment) else timezone.make_aware(moment, datetime.timezone.utc)
+
+    def get(self, request, **kwargs):
+        period = request.query_params.get('period', RatingRollup.DAY)
+        if period not in rollups.PERIOD_SECONDS:
+            return Response({'error': 'period must be hour or day'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            end = self.parse_moment(request.query_params['end']) if request.query_params.get('end') else timezone.now()
+            start = (self.parse_moment(request.query_params['start']) if request.query_params.get('start')
+                     else end - self.default_spans[period])
+        except ValueError:
+            return Response({'error': 'start and end must be ISO 8601 dates or times'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        max_buckets = getattr(settings, 'ANALYTICS_MAX_BUCKETS', 1000)
+        if start > end or (end - start).total_seconds() / rollups.PERIOD_SECONDS[period] >= max_buckets:
+            return Response({'error': f'start must be before end and at most {max_buckets} {period}s earlier'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.series(period, start, end, **kwargs))
+
+
+class RatingAnalyticsView(AnalyticsView):
+    """
+    Ratings, average score and ratings by new users per hour or day
+    """
+
+    def series(self, period, start, end):
+        return rollups.rating_series(period, start, end)
+
+
+class MovieAnalyticsView(AnalyticsView):
+    """
+    A movie's ratings and average score per hour or day
+    """
+
+    def series(self, period, start, end, movie_id):
+        get_object_or_404(Movie, pk=movie_id)
+        return rollups.rating_series(period, start, end, RatingRollup.MOVIE, movie_id)
+
+
+class GenreAnalyticsView(AnalyticsView):
+    """
+    Ratings and average score of a genre's movies per hour or day
+    """
+
+    def series(self, period, start, end, name):
+        genre = get_object_or_404(Genre, normalized_name=normalize_text(name))
+        return rollups.rating_series(period, start, end, RatingRollup.GENRE, genre.pk)
+
+
+class UserActivityAnalyticsView(AnalyticsView):
+    """
+    New users and the ratings given by new users per hour or day
+    """
 
+    def series(self, period, start, end):
+        return rollups.signup_series(period, start, end)
@@ -2,6 +2,8 @@
 ASGI config for movie_platform project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Live rating updates (/api/movies/ratings/live/) are only served through it,
+e.g. ``uvicorn movie_platform.asgi:application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
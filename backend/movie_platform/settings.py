@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -31,33 +32,58 @@ ALLOWED_HOSTS = ["*"]
 
 # Application definition
 
-INSTALLED_APPS = [
-    'django.contrib.admin',
-    'django.contrib.auth',
-    'django.contrib.contenttypes',
-    'django.contrib.sessions',
-    'django.contrib.messages',
-    'django.contrib.staticfiles',
-    'rest_framework',
-    'rest_framework_simplejwt',
-    'drf_yasg',
-    'corsheaders',
-    'api',
+# Server roles: which parts of the project this process loads, as a
+# comma-separated list in DJANGO_SERVER_ROLES. 'api' serves /api/ and media,
+# 'admin' serves /admin/, 'docs' serves /swagger/ and /redoc/, and 'worker'
+# only runs management commands. 'all' (the default) loads everything.
+SERVER_ROLE_CHOICES = ('api', 'admin', 'docs', 'worker')
+SERVER_ROLES = {
+    role.strip() for role in os.environ.get('DJANGO_SERVER_ROLES', 'all').split(',') if role.strip()
+}
+if 'all' in SERVER_ROLES:
+    SERVER_ROLES = set(SERVER_ROLE_CHOICES)
+
+# Each app or middleware is loaded when any of its roles is enabled (None = always)
+APP_ROLES = [
+    ('django.contrib.admin', {'admin'}),
+    ('django.contrib.auth', None),
+    ('django.contrib.contenttypes', None),
+    ('django.contrib.sessions', {'admin'}),
+    ('django.contrib.messages', {'admin'}),
+    ('django.contrib.staticfiles', {'admin', 'docs'}),
+    ('rest_framework', None),
+    ('rest_framework_simplejwt', None),
+    ('drf_yasg', {'docs'}),
+    ('corsheaders', {'api'}),
+    ('api', None),
 ]
 
-MIDDLEWARE = [
-    'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
-    'corsheaders.middleware.CorsMiddleware',
-    'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+MIDDLEWARE_ROLES = [
+    ('django.middleware.security.SecurityMiddleware', None),
+    ('api.middleware.CompressionMiddleware', None),
+    ('api.middleware.ReplicaRoutingMiddleware', None),
+    ('django.contrib.sessions.middleware.SessionMiddleware', {'admin'}),
+    ('corsheaders.middleware.CorsMiddleware', {'api'}),
+    ('django.middleware.common.CommonMiddleware', None),
+    ('django.middleware.csrf.CsrfViewMiddleware', {'admin'}),
+    ('django.contrib.auth.middleware.AuthenticationMiddleware', {'admin'}),
+    ('django.contrib.messages.middleware.MessageMiddleware', {'admin'}),
+    ('django.middleware.clickjacking.XFrameOptionsMiddleware', {'admin'}),
 ]
 
+INSTALLED_APPS = [app for app, roles in APP_ROLES if roles is None or roles & SERVER_ROLES]
+
+MIDDLEWARE = [mw for mw, roles in MIDDLEWARE_ROLES if roles is None or roles & SERVER_ROLES]
+
 # Add CORS support (for development)
 CORS_ALLOW_ALL_ORIGINS = True  # For development only
+# corsheaders' default_headers plus Idempotency-Key (spelled out so settings
+# don't import corsheaders in roles that leave it out)
+CORS_ALLOW_HEADERS = (
+    'accept', 'authorization', 'content-type', 'user-agent', 'x-csrftoken', 'x-requested-with',
+    'idempotency-key',
+)
+CORS_EXPOSE_HEADERS = ('idempotent-replayed',)
 
 ROOT_URLCONF = 'movie_platform.urls'
 
@@ -86,9 +112,30 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # WAL lets reads, including online backups, run alongside a writer
+        'OPTIONS': {'init_command': 'PRAGMA journal_mode=WAL;'},
     }
 }
 
+# Read replicas: DJANGO_DB_REPLICAS lists database files (or names) that
+# share the default connection settings, e.g. "replica1.sqlite3,replica2.sqlite3".
+# Replicas configured by hand in DATABASES must be listed in DATABASE_REPLICAS.
+DATABASES.update({
+    f'replica{number}': {**DATABASES['default'], 'NAME': name.strip(), 'TEST': {'MIRROR': 'default'}}
+    for number, name in enumerate(filter(None, os.environ.get('DJANGO_DB_REPLICAS', '').split(',')), 1)
+})
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+DATABASE_ROUTERS = ['api.routing.PrimaryReplicaRouter']
+
+# Seconds after a write during which a client keeps reading from the primary,
+# tracked per user in the cache and in a cookie for anonymous clients
+REPLICA_STICKY_SECONDS = 5
+
+# Report per-alias query counts and time in a Server-Timing header
+DB_QUERY_METRICS = DEBUG
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -130,6 +177,35 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Media is served by api.media.serve_media. Set this to an internal nginx
+# location (e.g. '/protected-media/') to hand transfers to the proxy.
+MEDIA_ACCEL_REDIRECT_PREFIX = None
+# Cache lifetime for media files without a content hash in their name
+MEDIA_MAX_AGE = 3600
+
+# External poster proxy (api.poster_proxy): /media/proxy/<movie_id>/ fetches a
+# movie's poster_url once into a least recently used disk cache of at most
+# POSTER_PROXY_CACHE_MAX_BYTES and serves it, or a ?w= variant, from there.
+# At most POSTER_PROXY_MAX_CONCURRENCY fetches run at once per worker, with
+# POSTER_PROXY_POOL_SIZE idle keep-alive connections kept per host.
+POSTER_PROXY_CACHE_DIR = BASE_DIR / 'poster_cache'
+POSTER_PROXY_CACHE_MAX_BYTES = 512 * 1024 * 1024
+POSTER_PROXY_MAX_BYTES = 10 * 1024 * 1024
+POSTER_PROXY_WIDTHS = (100, 300, 600)
+POSTER_PROXY_MAX_CONCURRENCY = 8
+POSTER_PROXY_POOL_SIZE = 4
+POSTER_PROXY_TIMEOUT = 5
+POSTER_PROXY_FAILURE_TTL = 300
+POSTER_PROXY_MAX_AGE = 24 * 60 * 60
+# Posters are only fetched from public addresses unless this is set
+POSTER_PROXY_ALLOW_PRIVATE = False
+
+# Response compression (api.middleware.CompressionMiddleware)
+COMPRESSION_MIN_LENGTH = 1024
+COMPRESSION_CACHE_MIN_LENGTH = 64 * 1024
+COMPRESSION_CACHE_MAX_BYTES = 16 * 1024 * 1024
+COMPRESSION_CONTENT_TYPES = ('application/json', 'application/openapi+json')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -170,6 +246,96 @@ SIMPLE_JWT = {
     'TOKEN_TYPE_CLAIM': 'token_type',
 }
 
+# Import time budgets in milliseconds per server role, checked by
+# `python manage.py startup_benchmark` and the test suite
+STARTUP_IMPORT_BUDGET_MS = {
+    'api': 1000,
+    'admin': 1500,
+    'docs': 1500,
+    'worker': 800,
+}
+
+# Title typeahead (api.suggest): results per query, and how often each
+# worker picks up movies changed by other workers
+SUGGEST_TOP_K = 10
+SUGGEST_INDEX_REFRESH_SECONDS = 30
+
+# Live rating updates (api.live, ASGI only): streams per worker, events
+# buffered per slow client before it is told to resync, movies per stream,
+# and the keepalive interval
+LIVE_MAX_SUBSCRIBERS = 10000
+LIVE_MAX_PENDING_EVENTS = 32
+LIVE_MAX_MOVIES = 50
+LIVE_HEARTBEAT_SECONDS = 15
+
+# Duplicate detection (api.duplicates): minimum trigram similarity of a fuzzy
+# title match, how many years apart it may be, and how many bucket-sharing
+# candidates are scored per check
+DUPLICATE_SIMILARITY = 0.6
+DUPLICATE_YEAR_TOLERANCE = 1
+DUPLICATE_MAX_CANDIDATES = 200
+
+# Most movies one /api/movies/batch/ request may ask for
+MOVIE_BATCH_MAX_IDS = 200
+
+# Deleted movies and users are hidden at once and removed later by
+# `python manage.py purge_deleted`, this many ratings per transaction
+DELETION_BATCH_SIZE = 500
+
+# Snapshots written by `python manage.py backup_database`: where, and for
+# SQLite how many pages are copied per step and the pause between steps (seconds)
+BACKUP_ROOT = BASE_DIR / 'backups'
+BACKUP_STEP_PAGES = 256
+BACKUP_STEP_PAUSE = 0.005
+
+# Rating analytics (api.rollups, filled by `python manage.py rollup_ratings`):
+# rows folded per transaction, how old a row must be before it is folded (so
+# transactions still in flight are not skipped), what counts as a new user,
+# and the longest series an /api/analytics/ request may ask for
+ROLLUP_BATCH_SIZE = 50000
+ROLLUP_SETTLE_SECONDS = 60
+ANALYTICS_NEW_USER_DAYS = 7
+ANALYTICS_MAX_BUCKETS = 1000
+
+# Shared by every worker, so coalesced-response invalidations (api.coalesce)
+# and read-your-writes windows (REPLICA_STICKY_SECONDS) reach them all: a
+# directory on this host by default, or Redis across hosts with
+# DJANGO_REDIS_URL (needs the redis package)
+if os.environ.get('DJANGO_REDIS_URL'):
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['DJANGO_REDIS_URL'],
+    }}
+else:
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('DJANGO_CACHE_DIR', BASE_DIR / 'cache'),
+    }}
+
+# Request coalescing (api.coalesce) for movie detail and list GETs:
+# concurrent identical requests share one computation and its rendered
+# bytes, which stay cached for COALESCE_CACHE_TTL seconds unless a write
+# invalidates them first (rating writes leave list pages to expire), and
+# are refreshed early with a probability that grows towards expiry (a
+# larger COALESCE_EARLY_REFRESH_BETA refreshes earlier). With replicas, a
+# client that wrote within REPLICA_STICKY_SECONDS reads around them.
+COALESCE_CACHE_TTL = 5
+COALESCE_EARLY_REFRESH_BETA = 1.0
+COALESCE_MAX_BYTES = 1024 * 1024
+# Also coalesce across workers with a lock in the (shared) cache, waiting up
+# to COALESCE_WAIT_SECONDS for another worker's computation
+COALESCE_SHARED_LOCK = False
+COALESCE_WAIT_SECONDS = 5
+
+# Idempotency-Key support for movie and rating writes (api.idempotency):
+# how long keys are kept, and after how long an unfinished request's key is
+# considered abandoned
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+
+# Pre-generated OpenAPI document (python manage.py generate_openapi_schema)
+OPENAPI_SCHEMA_FILE = BASE_DIR / 'openapi.json'
+
 # Swagger settings
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
@@ -1,34 +1,42 @@
-from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
-from django.conf.urls.static import static
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
-
-schema_view = get_schema_view(
-   openapi.Info(
-      title="Movie Rating Platform API",
-      default_version='v1',
-      description="API for managing movies and ratings",
-      terms_of_service="https://www.google.com/policies/terms/",
-      contact=openapi.Contact(email="contact@movierating.local"),
-      license=openapi.License(name="BSD License"),
-   ),
-   public=True,
-   permission_classes=[permissions.AllowAny],
-)
-
-urlpatterns = [
-    path('admin/', admin.site.urls),
-    path('api/', include('api.urls')),
-
-    # Swagger/OpenAPI documentation
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
-]
-
-# Serve media files in development
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
+# Only the URL includes for this process's SERVER_ROLES are loaded, so API
+# workers never import the admin or drf_yasg.
+urlpatterns = []
+
+if 'admin' in settings.SERVER_ROLES:
+    from django.contrib import admin
+
+    urlpatterns += [
+        path('admin/', admin.site.urls),
+    ]
+
+if settings.SERVER_ROLES & {'api', 'admin'}:
+    from api.poster_proxy import serve_poster
+
+    urlpatterns += [
+        # External posters, fetched once and served from the local poster cache
+        # (the admin's poster previews use it too)
+        path('%sproxy/<int:movie_id>/' % settings.MEDIA_URL.lstrip('/'), serve_poster, name='poster-proxy'),
+    ]
+
+if 'api' in settings.SERVER_ROLES:
+    from api.media import serve_media
+
+    urlpatterns += [
+        path('api/', include('api.urls')),
+
+        # Serve media files (range/conditional requests, sendfile or X-Accel-Redirect)
+        re_path(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), serve_media, name='media'),
+    ]
+
+if 'docs' in settings.SERVER_ROLES:
+    from api.schema import CachedSchemaView
+
+    urlpatterns += [
+        # Swagger/OpenAPI documentation (spec served from api.schema.schema_cache)
+        re_path(r'^swagger\.(?P<format>json|yaml)$', CachedSchemaView.without_ui(), name='schema-json'),
+        path('swagger/', CachedSchemaView.with_ui('swagger'), name='schema-swagger-ui'),
+        path('redoc/', CachedSchemaView.with_ui('redoc'), name='schema-redoc'),
+    ]
@@ -79,7 +79,21 @@ const AddMovie = () => {
         });
       }
 
-      const response = await movieService.createMovie(dataToSend);
+      let response;
+      try {
+        response = await movieService.createMovie(dataToSend);
+      } catch (err) {
+        if (err.response?.status !== 409) throw err;
+        // Possible duplicates: let the user open one or create the movie anyway
+        const matches = err.response.data.duplicates
+          .map((movie) => `${movie.title} (${movie.release_year})`)
+          .join('\n');
+        if (!window.confirm(`This movie may already exist:\n${matches}\n\nCreate it anyway?`)) {
+          navigate(`/movies/${err.response.data.duplicates[0].id}`);
+          return;
+        }
+        response = await movieService.createMovie(dataToSend, { force: true });
+      }
       navigate(`/movies/${response.data.id}`);
     } catch (err) {
       setError(err.response?.data?.message || 'Failed to create movie');
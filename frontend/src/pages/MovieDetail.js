@@ -24,6 +24,35 @@ const MovieDetail = () => {
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [id]);
 
+  // Apply rating deltas pushed by the server instead of refetching
+  useEffect(() => {
+    if (typeof EventSource === 'undefined') return undefined;
+    return ratingService.subscribeToRatings([id], (type, data) => {
+      if (type === 'resync') {
+        fetchMovieDetail();
+        return;
+      }
+      setMovie((current) => {
+        if (!current) return current;
+        const others = (current.ratings || []).filter((rating) => rating.id !== data.rating.id);
+        const existing = (current.ratings || []).find((rating) => rating.id === data.rating.id);
+        let ratings = others;
+        if (type === 'rating') {
+          ratings = existing
+            ? current.ratings.map((rating) => (rating.id === data.rating.id ? data.rating : rating))
+            : [data.rating, ...others];
+        }
+        return {
+          ...current,
+          ratings,
+          average_rating: data.average_rating,
+          ratings_count: data.ratings_count,
+        };
+      });
+    });
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [id]);
+
   const fetchMovieDetail = async () => {
     try {
       setLoading(true);
@@ -100,7 +129,7 @@ const MovieDetail = () => {
         {/* Display poster image if available */}
         {(movie.poster_image || movie.poster_url) && (
           <img 
-            src={movie.poster_image || movie.poster_url}
+            src={movieService.posterSrc(movie)}
             alt={`${movie.title} poster`}
             className="movie-poster"
             style={movie.photo_width && movie.photo_height ? {
@@ -33,7 +33,9 @@ export const authService = {
 export const movieService = {
   getMovies: (params) => api.get('/movies/', { params }),
   getMovie: (id) => api.get(`/movies/${id}/`),
-  createMovie: (movieData) => {
+  createMovie: (movieData, { force = false } = {}) => {
+    // force skips the server's duplicate check (409 with candidate matches)
+    const params = force ? { force: true } : undefined;
     // Check if movieData contains a file (for image upload)
     const hasFile = movieData instanceof FormData || 
                     (movieData.poster_image && movieData.poster_image instanceof File);
@@ -52,23 +54,42 @@ export const movieService = {
       }
       
       return api.post('/movies/', formData, {
+        params,
         headers: {
           'Content-Type': 'multipart/form-data',
         },
       });
     }
     
-    return api.post('/movies/', movieData);
+    return api.post('/movies/', movieData, { params });
   },
   updateMovie: (id, movieData) => api.put(`/movies/${id}/`, movieData),
   deleteMovie: (id) => api.delete(`/movies/${id}/`),
+  findDuplicates: (params) => api.get('/movies/duplicates/', { params }),
+  getMoviesBatch: (ids) => api.get('/movies/batch/', { params: { ids: ids.join(',') } }),
+  // External posters go through the server's poster cache instead of being hotlinked
+  posterSrc: (movie, width) => {
+    if (movie.poster_image || !movie.poster_url) return movie.poster_image;
+    const mediaBase = API_BASE_URL.replace(/\/api\/?$/, '');
+    return `${mediaBase}/media/proxy/${movie.id}/${width ? `?w=${width}` : ''}`;
+  },
 };
 
 // Rating endpoints
 export const ratingService = {
   getMovieRatings: (movieId) => api.get(`/movies/${movieId}/ratings/`),
   createOrUpdateRating: (movieId, ratingData) => api.post(`/movies/${movieId}/ratings/`, ratingData),
-  getUserRatings: (userId) => api.get(`/users/${userId}/ratings/`),
+  // includeMovie inlines a movie_summary per rating instead of one request per movie
+  getUserRatings: (userId, { includeMovie = false } = {}) =>
+    api.get(`/users/${userId}/ratings/`, { params: includeMovie ? { include: 'movie' } : undefined }),
+  // Live rating deltas over server-sent events; returns a function that unsubscribes
+  subscribeToRatings: (movieIds, onEvent) => {
+    const source = new EventSource(`${API_BASE_URL}/movies/ratings/live/?movies=${movieIds.join(',')}`);
+    ['rating', 'rating_deleted', 'resync'].forEach((type) => {
+      source.addEventListener(type, (event) => onEvent(type, JSON.parse(event.data)));
+    });
+    return () => source.close();
+  },
 };
 
 export default api;